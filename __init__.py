@@ -1,5 +1,21 @@
 __all__ = [
+    'anytime',
+    'batch',
+    'benchmark',
+    'cache',
+    'clauses',
+    'cli',
+    'counting',
+    'deck',
     'game',
+    'lazy',
+    'propagation',
+    'recommend',
+    'sampling',
+    'service',
+    'session',
     'solver',
+    'stats',
+    'symmetry',
     'view'
 ]
@@ -0,0 +1,4 @@
+import sys
+from cluedo.cli import main
+
+sys.exit(main())
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+import time
+
+
+class AnytimeSolve(object):
+    """
+    Runs Cluedo.solve() in a background thread, so that the caller (e.g. a notebook kernel) stays
+    responsive, and publishes what is known so far while it runs.
+
+    Progress is published at most once per <interval> seconds, as the packed solutions of every
+    player (see Cluedo.assignments()). In backbone mode a card only shows as held or not held once
+    that is proven, so the published tables fill in as the solve proceeds. A run can be cancelled at
+    any time; it then stops as if its time limit had expired, with everything proven so far.
+    """
+
+    def __init__(self, cluedo, on_progress=None, on_done=None, interval=0.5):
+        """
+        @param: on_progress A callable called with the packed solutions of every player known so far.
+        @param: on_done A callable called with the SolveStats of the solve once it finishes, or with
+                None if it raised an exception (see error).
+        @param: interval The minimum number of seconds between two calls to <on_progress>.
+        """
+        self.__cluedo = cluedo
+        self.__on_progress = on_progress
+        self.__on_done = on_done
+        self.__interval = interval
+        self.__cancel = threading.Event()
+        self.__thread = None
+        self.__last_published = 0.0
+        self.__latest = None
+        self.__stats = None
+        self.__error = None
+
+    def start(self, **solve_args):
+        """
+        Start solving in the background.
+        @param: solve_args The arguments to Cluedo.solve(), such as time_limit and mode.
+        @return: self
+        """
+        if self.running:
+            raise RuntimeError("the solve is already running")
+        self.__cancel.clear()
+        self.__stats = self.__error = None
+        self.__thread = threading.Thread(target=self.__run, kwargs=solve_args, daemon=True)
+        self.__thread.start()
+        return self
+
+    def __run(self, **solve_args):
+        try:
+            self.__stats = self.__cluedo.solve(progress=self.__progress, cancel=self.__cancel, **solve_args)
+        except Exception as error:
+            self.__error = error
+        if self.__on_done is not None:
+            self.__on_done(self.__stats)
+
+    def __progress(self, seen):
+        now = time.perf_counter()
+        if now - self.__last_published < self.__interval:
+            return
+        self.__last_published = now
+        self.__latest = self.__cluedo.assignments(seen)
+        if self.__on_progress is not None:
+            self.__on_progress(self.__latest)
+
+    def cancel(self):
+        """
+        Stop the solve, keeping what it has proven so far.
+        """
+        self.__cancel.set()
+        # interrupt the CP-SAT search in progress, rather than waiting for it to finish
+        solver = self.__cluedo.solver
+        if solver is not None and hasattr(solver, 'StopSearch'):
+            solver.StopSearch()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the solve to finish.
+        @return: the SolveStats of the solve, or None if it has not finished yet.
+        @raise: the exception raised by the solve, if any.
+        """
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        if self.__error is not None:
+            raise self.__error
+        return self.__stats
+
+    async def result(self):
+        """
+        Wait for the solve to finish without blocking the event loop.
+        @return: the SolveStats of the solve.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, self.wait)
+
+    @property
+    def running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    @property
+    def cancelled(self):
+        return self.__cancel.is_set()
+
+    @property
+    def latest(self):
+        """
+        @return: the packed solutions of every player last published, or None.
+        """
+        return self.__latest
+
+    @property
+    def stats(self):
+        return self.__stats
+
+    @property
+    def error(self):
+        return self.__error
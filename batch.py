@@ -0,0 +1,160 @@
+"""
+Analyze recorded games in bulk.
+
+The games are read as JSON Lines, one game per line:
+
+    {"id": "game-1", "players_spec": [["Will", 6], ["Julie", 6], ["Laura", 6]],
+     "turns": [["Julie", "ALL_FALSE", "MR_GREEN", "ROPE", "HALL"], ...]}
+
+A game of another variant names its deck, e.g. "deck": "master_detective" (see cluedo.deck).
+
+Each turn is a turn history row (see cluedo.cli). Every game is replayed turn by turn through a
+Cluedo instance, games are spread across a process pool, and the deductions are written out as JSON
+Lines as soon as each game is done: one line per turn the game was solved at.
+
+    python -m cluedo.batch games.jsonl [-o results.jsonl] [--workers 4] [--at final]
+"""
+from cluedo.cli import deductions
+from cluedo.solver import Cluedo, worker_pool
+import argparse
+import json
+import sys
+
+# when to solve a game
+EveryTurn = 'every'
+FinalTurn = 'final'
+
+
+def solve_turns(game, at=EveryTurn):
+    """
+    @param: at EveryTurn, FinalTurn, or a collection of turn numbers (counting from 1; 0 is the board
+            before any turn). A game may also give its own turn numbers, under 'solve_at'.
+    @return: the set of turn numbers to solve <game> at.
+    """
+    num_turns = len(game.get('turns', []))
+    at = game.get('solve_at', at)
+    if at == EveryTurn:
+        return set(range(1, num_turns + 1))
+    if at == FinalTurn:
+        return {num_turns}
+    return {turn for turn in at if 0 <= turn <= num_turns}
+
+
+def analyze_game(game, at=EveryTurn, mode=Cluedo.Backbone, time_limit=None):
+    """
+    Replay one game, solving it at the turns asked for.
+    @return: the list of results, one per turn solved, in turn order.
+    """
+    cluedo = Cluedo([tuple(player) for player in game['players_spec']], deck=game.get('deck', 'classic'))
+    turns = solve_turns(game, at)
+    results = []
+
+    def solve(turn):
+        stats = cluedo.solve(time_limit=time_limit, mode=mode)
+        results.append({
+            'id': game.get('id'),
+            'turn': turn,
+            'infeasible': cluedo.infeasible,
+            'complete': stats.complete,
+            'solutions': stats.solutions,
+            'wall_time': stats.wall_time,
+            'players': {} if cluedo.infeasible else deductions(cluedo),
+        })
+
+    if 0 in turns:
+        solve(0)
+    for turn, row in enumerate(game.get('turns', []), 1):
+        player_name, kind, *items = row
+        cluedo.begin_turn(json.dumps(row))
+        cluedo.add_observation(player_name, kind, items)
+        if turn in turns:
+            solve(turn)
+    return results
+
+
+def analyze_game_safely(game, at, mode, time_limit):
+    """
+    Run analyze_game(), turning an error into a result, so that one bad log does not stop the batch.
+    """
+    try:
+        return analyze_game(game, at, mode, time_limit)
+    except Exception as error:
+        return [{'id': game.get('id') if isinstance(game, dict) else None, 'error': repr(error)}]
+
+
+def analyze(games, at=EveryTurn, mode=Cluedo.Backbone, time_limit=None, num_workers=1):
+    """
+    Analyze a stream of games.
+    @param: games An iterable of games, as dictionaries.
+    @param: num_workers The number of worker processes the games are spread across; with one, the games
+            are analyzed in this process, in order.
+    @return: a generator of per-turn results, as returned by analyze_game(), yielded as soon as their game
+             is done. Games may finish out of order; each result carries the id of its game.
+    """
+    if num_workers <= 1:
+        for game in games:
+            yield from analyze_game_safely(game, at, mode, time_limit)
+        return
+
+    from concurrent.futures import FIRST_COMPLETED, wait
+    pool = worker_pool(num_workers)
+    pending = set()
+    games = iter(games)
+    exhausted = False
+    try:
+        while pending or not exhausted:
+            # keep a bounded number of games in flight, so that the stream is never read ahead whole
+            while not exhausted and len(pending) < 2 * num_workers:
+                game = next(games, None)
+                if game is None:
+                    exhausted = True
+                else:
+                    pending.add(pool.submit(analyze_game_safely, game, at, mode, time_limit))
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+    finally:
+        # (the consumer stopped early, or a worker died: drop the games not started yet)
+        for future in pending:
+            future.cancel()
+
+
+def read_games(lines):
+    """
+    @return: a generator of the games in an iterable of JSON lines, skipping blank lines.
+    """
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cluedo.batch', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('games', help="the game logs, one JSON game per line, or '-' for stdin")
+    parser.add_argument('-o', '--output', help='the results file (by default, stdout)')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--at', default=EveryTurn,
+                        help=f"when to solve each game: '{EveryTurn}' turn, the '{FinalTurn}' turn only, or a "
+                             f"comma-separated list of turn numbers")
+    parser.add_argument('--mode', choices=[Cluedo.Backbone, Cluedo.Count, Cluedo.Sample, Cluedo.Enumerate], default=Cluedo.Backbone)
+    parser.add_argument('--time-limit', type=float, default=None, help='the time limit of each solve')
+    args = parser.parse_args(argv)
+
+    at = args.at if args.at in (EveryTurn, FinalTurn) else {int(turn) for turn in args.at.split(',')}
+    source = sys.stdin if args.games == '-' else open(args.games)
+    sink = sys.stdout if args.output is None else open(args.output, 'w')
+    try:
+        for result in analyze(read_games(source), at, args.mode, args.time_limit, args.workers):
+            sink.write(json.dumps(result) + '\n')
+            sink.flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,290 @@
+"""
+An offline benchmark of the solver over generated games.
+
+Each scenario deals the cards of a deck at random for 3 to 6 players (up to 10 with the Master
+Detective deck) and plays a history of turns up to a game phase: no clues at all, mid-game, or
+near-solved. The game is then solved in every mode asked for,
+each run in a fresh process so that its peak memory is its own. The wall time, the number of
+solutions, the peak memory and the time spent packing the result are recorded for each run, and
+compared against a stored baseline to flag regressions. The default suite, and so the baseline,
+covers the classic deck for 3 to 6 players and the Master Detective deck for 6 and 10 players.
+
+    python -m cluedo.benchmark                      # run the suite and compare with the baseline
+    python -m cluedo.benchmark --save               # run the suite and store it as the new baseline
+    python -m cluedo.benchmark --scaling            # how the solver scales with the cards and players
+"""
+from cluedo.deck import CLASSIC, deck as registered_deck
+from cluedo.solver import Cluedo
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tracemalloc
+
+# the number of rounds of suggestions played in each game phase; past the first phase, the
+# benchmarked player also knows their own hand
+Phases = {'no_clues': 0, 'mid_game': 1, 'near_solved': 4}
+
+PlayerCounts = (3, 4, 5, 6)
+
+# the decks and player counts of the default suite, and so of the stored baseline: the classic deck
+# at every player count, and the larger Master Detective deck at a typical and at its largest table
+BaselineDecks = {'classic': PlayerCounts, 'master_detective': (6, 10)}
+
+Modes = (Cluedo.Backbone, Cluedo.Count)
+
+# the decks and player counts of the scaling suite: every player count each deck allows, so that the
+# growth with the number of cards and with the number of players can be read off the same report
+ScalingDecks = ('classic', 'master_detective')
+
+DefaultBaseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks', 'baseline.json')
+
+
+def players_spec(num_players, deck=CLASSIC):
+    """
+    @return: the players specification of a game with <num_players> players, who are dealt the cards
+             left once the Murderer's are drawn in turn (18 with the classic deck).
+    """
+    return deck.players_spec(num_players)
+
+
+def deal(spec, rng, deck=CLASSIC):
+    """
+    @return: a (murderer cards, {player name: cards}) tuple for a random deal.
+    """
+    murderer = [rng.choice(list(card_type)) for card_type in deck.card_types]
+    rest = [card for card in deck.cards if card not in murderer]
+    rng.shuffle(rest)
+    hands, start = {}, 0
+    for name, num_cards in spec:
+        hands[name] = rest[start:start + num_cards]
+        start += num_cards
+    return murderer, hands
+
+
+def play(cluedo, spec, hands, num_rounds, rng, deck=CLASSIC):
+    """
+    Play <num_rounds> rounds of random suggestions, adding what the first player (the one the
+    solver works for) learns from them to <cluedo>. A player who cannot refute a suggestion holds
+    none of its cards; the first player is shown the refuting card of their own suggestions, and
+    only knows the refuter holds one of the cards of everybody else's.
+    @return: the number of turns played.
+    """
+    names = [name for name, _ in spec]
+    num_turns = 0
+    for _ in range(num_rounds):
+        for position, suggester in enumerate(names):
+            suggestion = [rng.choice(list(card_type)) for card_type in deck.card_types]
+            for responder in names[position + 1:] + names[:position]:
+                held = [card for card in suggestion if card in hands[responder]]
+                if not held:
+                    for card in suggestion:
+                        cluedo.add_constraint(responder, card, False)
+                    continue
+                # (the first player learns nothing from refuting a suggestion themselves)
+                if suggester == names[0]:
+                    cluedo.add_constraint(responder, rng.choice(held))
+                elif responder != names[0]:
+                    cluedo.add_or_constraint(responder, suggestion)
+                break
+            num_turns += 1
+    return num_turns
+
+
+def name(num_players, phase, mode, seed, deck_name=CLASSIC.name):
+    """
+    @return: the name of a scenario run; runs of the classic deck are not prefixed with the deck, as
+             in baselines stored before there were other decks.
+    """
+    prefix = '' if deck_name == CLASSIC.name else f'{deck_name}/'
+    return f'{prefix}{num_players}p/{phase}/{mode}/{seed}'
+
+
+def scenario(num_players, phase, seed=0, deck_name=CLASSIC.name):
+    """
+    @return: a (Cluedo, number of turns) tuple for a generated game.
+    """
+    deck = registered_deck(deck_name)
+    prefix = '' if deck_name == CLASSIC.name else f'{deck_name}/'
+    rng = random.Random(f'{prefix}{num_players}/{phase}/{seed}')
+    spec = players_spec(num_players, deck)
+    _, hands = deal(spec, rng, deck)
+    cluedo = Cluedo(spec, deck=deck)
+    if Phases[phase]:
+        me = spec[0][0]
+        for card in deck.cards:
+            cluedo.add_constraint(me, card, card in hands[me])
+    return cluedo, play(cluedo, spec, hands, Phases[phase], rng, deck)
+
+
+def run(num_players, phase, mode, seed=0, time_limit=10.0, deck_name=CLASSIC.name):
+    """
+    Solve one scenario and measure it.
+    @return: a dictionary of the scenario and its measurements.
+    """
+    cluedo, num_turns = scenario(num_players, phase, seed, deck_name)
+    # (the solver libraries are imported outside the timed solve, as in a session that has solved before)
+    import numpy
+    import ortools.sat.python.cp_model
+    tracemalloc.start()
+    stats = cluedo.solve(time_limit=time_limit, mode=mode)
+    cluedo.players
+    _, peak_python = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'name': name(num_players, phase, mode, seed, deck_name),
+        'deck': deck_name,
+        'cards': cluedo.deck.num_cards,
+        'players': num_players,
+        'phase': phase,
+        'mode': mode,
+        'seed': seed,
+        'turns': num_turns,
+        'complete': stats.complete,
+        'solutions': stats.solutions,
+        'wall_time': stats.wall_time,
+        'cpu_time': stats.user_time,
+        'packing_time': stats.packing_time,
+        'branches': stats.branches,
+        'conflicts': stats.conflicts,
+        'peak_python_kb': peak_python // 1024,
+        # (ru_maxrss is in KiB on Linux)
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_suite(player_counts=PlayerCounts, phases=tuple(Phases), modes=Modes, seeds=(0,), time_limit=10.0,
+              isolate=True, decks=(CLASSIC.name,)):
+    """
+    Run every combination of deck, player count, phase, mode and seed; player counts a deck is not
+    played with are skipped.
+    @param: isolate Run each scenario in a fresh process, so that the peak memory is that of the scenario alone.
+    @param: player_counts The player counts, or None for every player count each deck allows.
+    @return: the list of run() results.
+    """
+    jobs = [(num_players, phase, mode, seed, time_limit, deck_name)
+            for deck_name in decks
+            for num_players in player_counts or range(3, registered_deck(deck_name).max_players + 1)
+            if num_players <= registered_deck(deck_name).max_players
+            for phase in phases for mode in modes for seed in seeds]
+    if not isolate:
+        return [run(*job) for job in jobs]
+    context = multiprocessing.get_context('spawn')
+    if sys.version_info >= (3, 11):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context, max_tasks_per_child=1) as pool:
+            return [pool.submit(run, *job).result() for job in jobs]
+    # (before Python 3.11, a pool cannot replace its worker after each task: each scenario gets a pool of its own)
+    results = []
+    for job in jobs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results.append(pool.submit(run, *job).result())
+    return results
+
+
+def load_baseline(path=DefaultBaseline):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(results, path=DefaultBaseline):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1)
+
+
+def compare(results, baseline, tolerance=1.5, min_seconds=0.05, min_kb=8192):
+    """
+    Compare benchmark results with a baseline.
+    @param: tolerance The ratio to the baseline above which a time or memory measurement regresses.
+    @param: min_seconds, min_kb Differences smaller than these are noise, whatever the ratio.
+    @return: a list of regression messages, empty if there is none.
+    """
+    by_name = {entry['name']: entry for entry in baseline}
+    regressions = []
+    for result in results:
+        before = by_name.get(result['name'])
+        if before is None:
+            continue
+        if before['complete'] and not result['complete']:
+            regressions.append(f"{result['name']}: no longer completes within the time limit")
+        elif before['complete'] and result['solutions'] != before['solutions'] and result['mode'] == Cluedo.Count:
+            regressions.append(f"{result['name']}: {result['solutions']} deals, was {before['solutions']}")
+        for measurement, minimum in (('wall_time', min_seconds), ('packing_time', min_seconds),
+                                     ('peak_rss_kb', min_kb)):
+            now, then = result[measurement], before[measurement]
+            if now > tolerance * then and now - then > minimum:
+                regressions.append(f"{result['name']}: {measurement} {now:.3g}, was {then:.3g}")
+    return regressions
+
+
+def scaling(results):
+    """
+    Summarize how the solve time grows with the deck and the number of players.
+    @return: a {(deck, cards, mode): {players: the largest wall time over the phases and seeds}} dictionary.
+    """
+    ret_val = {}
+    for result in results:
+        times = ret_val.setdefault((result.get('deck', CLASSIC.name), result.get('cards', CLASSIC.num_cards),
+                                    result['mode']), {})
+        times[result['players']] = max(times.get(result['players'], 0.0), result['wall_time'])
+    return ret_val
+
+
+def report(results):
+    columns = ('name', 'turns', 'complete', 'solutions', 'wall_time', 'packing_time', 'peak_rss_kb')
+    lines = ['\t'.join(columns)]
+    for result in results:
+        lines.append('\t'.join(f'{result[column]:.3f}' if isinstance(result[column], float) else str(result[column])
+                               for column in columns))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--players', type=int, nargs='+', default=None,
+                        help=f'the player counts (by default, those of {BaselineDecks}, or every count with --scaling)')
+    parser.add_argument('--decks', nargs='+', default=None,
+                        help=f"the decks (by default, those of {BaselineDecks}, or {ScalingDecks} with --scaling)")
+    parser.add_argument('--scaling', action='store_true',
+                        help='run every deck at every player count it allows, and summarize the growth')
+    parser.add_argument('--phases', nargs='+', choices=list(Phases), default=list(Phases))
+    parser.add_argument('--modes', nargs='+', choices=[Cluedo.Enumerate, Cluedo.Backbone, Cluedo.Count, Cluedo.Sample],
+                        default=list(Modes))
+    parser.add_argument('--seeds', type=int, nargs='+', default=[0])
+    parser.add_argument('--time-limit', type=float, default=10.0)
+    parser.add_argument('--baseline', default=DefaultBaseline)
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    parser.add_argument('--save', action='store_true', help='store the results as the new baseline')
+    args = parser.parse_args(argv)
+
+    if args.scaling:
+        suites = [(args.players, deck_name) for deck_name in args.decks or ScalingDecks]
+    else:
+        suites = [(args.players or BaselineDecks.get(deck_name, PlayerCounts), deck_name)
+                  for deck_name in args.decks or BaselineDecks]
+    results = [result for player_counts, deck_name in suites
+               for result in run_suite(player_counts, args.phases, args.modes, args.seeds, args.time_limit,
+                                       decks=(deck_name,))]
+    print(report(results))
+    if args.scaling:
+        for (deck_name, num_cards, mode), times in scaling(results).items():
+            print(f"{deck_name} ({num_cards} cards), {mode}: " +
+                  ', '.join(f'{players}p {wall_time:.3f}s' for players, wall_time in sorted(times.items())))
+    if args.save:
+        save_baseline(results, args.baseline)
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}: run with --save to store one')
+        return 0
+    regressions = compare(results, load_baseline(args.baseline), args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
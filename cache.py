@@ -0,0 +1,103 @@
+from collections import OrderedDict
+import hashlib
+import pickle
+import shelve
+
+
+class SolveCache(object):
+    """
+    A bounded LRU cache of solve results, keyed by a canonical form of the board: the hand sizes of
+    the players, the set of constraints added so far and the kind of solve. The same board reached
+    by a different order of turns, with repeated constraints, or by players with other names, maps
+    to the same key.
+
+    When a path is given, results are also written to a shelve file there, so that they survive the
+    process and can be shared between runs; entries evicted from memory are still found on disk.
+    """
+
+    def __init__(self, max_size=1024, path=None):
+        """
+        @param: max_size The maximum number of results held in memory.
+        @param: path The path of the shelve file results are persisted to, or None to keep results in
+                memory only.
+        """
+        self.__max_size = max_size
+        self.__entries = OrderedDict()
+        self.__shelf = shelve.open(path, protocol=pickle.HIGHEST_PROTOCOL) if path else None
+        self.__hits = 0
+        self.__misses = 0
+
+    @staticmethod
+    def key(players_spec, constraints, *options):
+        """
+        @param: players_spec The players specification of the game.
+        @param: constraints The (kind, player index, card indices, value) constraints added so far.
+        @param: options Anything else the result depends on, such as the solve mode.
+        @return: a stable hash of the canonical form of the board.
+        """
+        canonical = (
+            tuple(num_cards for _, num_cards in players_spec),
+            tuple(sorted({(kind, player_index, tuple(sorted(card_indices)), value)
+                          for kind, player_index, card_indices, value in constraints})),
+            options,
+        )
+        return hashlib.sha256(repr(canonical).encode()).hexdigest()
+
+    def get(self, key):
+        """
+        @return: the result cached under <key>, or None.
+        """
+        if key in self.__entries:
+            self.__entries.move_to_end(key)
+            self.__hits += 1
+            return self.__entries[key]
+        if self.__shelf is not None and key in self.__shelf:
+            value = self.__shelf[key]
+            self.__insert(key, value)
+            self.__hits += 1
+            return value
+        self.__misses += 1
+        return None
+
+    def put(self, key, value):
+        self.__insert(key, value)
+        if self.__shelf is not None:
+            self.__shelf[key] = value
+
+    def __insert(self, key, value):
+        self.__entries[key] = value
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.__max_size:
+            self.__entries.popitem(last=False)
+
+    def clear(self):
+        self.__entries.clear()
+        if self.__shelf is not None:
+            self.__shelf.clear()
+        self.__hits = 0
+        self.__misses = 0
+
+    def close(self):
+        if self.__shelf is not None:
+            self.__shelf.close()
+            self.__shelf = None
+
+    def __len__(self):
+        return len(self.__entries)
+
+    @property
+    def max_size(self):
+        return self.__max_size
+
+    @property
+    def hits(self):
+        return self.__hits
+
+    @property
+    def misses(self):
+        return self.__misses
+
+    @property
+    def hit_rate(self):
+        lookups = self.__hits + self.__misses
+        return self.__hits / lookups if lookups else 0.0
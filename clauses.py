@@ -0,0 +1,138 @@
+class ClauseDatabase(object):
+    """
+    The constraints added to a game, kept in simplified form: the unit constraints (a player holds,
+    or does not hold, a card) and the OR-clauses (a player holds at least one of some cards) that
+    are not implied by the others.
+
+    As constraints are added:
+
+    * a duplicate constraint is dropped;
+    * a clause is dropped once one of its cards is known to be held by its player;
+    * a clause loses the cards its player is known not to hold, including the cards known to be held
+      by another player, and becomes a unit constraint once a single card is left;
+    * a clause is dropped if another clause of the same player has a subset of its cards.
+
+    The simplified constraints admit the same deals as the constraints added, and are what models
+    and counters are built from. Contradictory constraints are kept as added, so that whatever is
+    built from them is infeasible.
+    """
+
+    def __init__(self, constraints=()):
+        """
+        @param: constraints A list of (kind, player index, card indices, value) tuples, as logged by
+                Cluedo.add_constraint and Cluedo.add_or_constraint.
+        """
+        self.__units = {}  # (player index, card) -> 0 or 1
+        self.__holder = {}  # card -> the player index known to hold it
+        self.__clauses = {}  # player index -> set of frozensets of cards
+        self.__conflicts = []  # constraints that contradict the others, as added
+        self.__num_added = 0
+        for constraint in constraints:
+            self.add(constraint)
+
+    def copy(self):
+        """
+        @return: an independent copy of the database, which can be restored in place of rebuilding it
+                 from the constraints.
+        """
+        other = ClauseDatabase()
+        other.__units = dict(self.__units)
+        other.__holder = dict(self.__holder)
+        other.__clauses = {player_index: set(clauses) for player_index, clauses in self.__clauses.items()}
+        other.__conflicts = list(self.__conflicts)
+        other.__num_added = self.__num_added
+        return other
+
+    def __is_true(self, player_index, card):
+        return self.__units.get((player_index, card)) == 1
+
+    def __is_false(self, player_index, card):
+        return self.__units.get((player_index, card)) == 0 or \
+            self.__holder.get(card, player_index) != player_index
+
+    def add(self, constraint):
+        """
+        Add a constraint, and simplify the clauses it affects.
+        @return: whether the constraint changed the database, i.e. was not already implied.
+        """
+        self.__num_added += 1
+        kind, player_index, card_indices, value = constraint
+        if kind == 'or':
+            return self.__add_clause(player_index, frozenset(card_indices), constraint)
+        return self.__add_unit(player_index, card_indices[0], int(value), constraint)
+
+    def __add_unit(self, player_index, card, value, constraint):
+        known = self.__units.get((player_index, card))
+        if known == value or known is None and not value and self.__is_false(player_index, card):
+            return False
+        if known is not None or value and card in self.__holder:
+            self.__conflicts.append(constraint)
+            return True
+        self.__units[player_index, card] = value
+        if value:
+            self.__holder[card] = player_index
+
+        # simplify the clauses mentioning the card: the player's own clauses are satisfied (if the
+        # card is held) or lose the card (if not), and if the card is held, the other players'
+        # clauses lose it
+        for clause_player, clauses in list(self.__clauses.items()):
+            for clause in [clause for clause in clauses if card in clause]:
+                if clause not in clauses:
+                    # (already simplified by a unit the loop derived)
+                    continue
+                if clause_player == player_index and value:
+                    clauses.discard(clause)
+                elif clause_player == player_index or value:
+                    clauses.discard(clause)
+                    self.__add_clause(clause_player, clause - {card}, ('or', clause_player, tuple(sorted(clause)), 1))
+        return True
+
+    def __add_clause(self, player_index, cards, constraint):
+        if any(self.__is_true(player_index, card) for card in cards):
+            return False
+        live = frozenset(card for card in cards if not self.__is_false(player_index, card))
+        if not live:
+            self.__conflicts.append(constraint)
+            return True
+        if len(live) == 1:
+            return self.__add_unit(player_index, next(iter(live)), 1, constraint)
+        clauses = self.__clauses.setdefault(player_index, set())
+        if any(clause <= live for clause in clauses):
+            return False
+        for clause in [clause for clause in clauses if live < clause]:
+            clauses.discard(clause)
+        clauses.add(live)
+        return True
+
+    def constraints(self):
+        """
+        @return: the simplified constraints, as (kind, player index, card indices, value) tuples in a
+                 canonical order: the unit constraints, the clauses, and then any contradiction.
+        """
+        units = [('eq', player_index, (card,), value) for (player_index, card), value in sorted(self.__units.items())]
+        clauses = sorted(('or', player_index, tuple(sorted(clause)), 1)
+                         for player_index, player_clauses in self.__clauses.items() for clause in player_clauses)
+        return units + clauses + list(self.__conflicts)
+
+    @property
+    def num_added(self):
+        """
+        @return: the number of constraints added, including those dropped as implied.
+        """
+        return self.__num_added
+
+    @property
+    def num_units(self):
+        return len(self.__units)
+
+    @property
+    def num_clauses(self):
+        return sum(len(clauses) for clauses in self.__clauses.values())
+
+    @property
+    def contradictory(self):
+        """
+        @return: whether a contradiction between the constraints has been found (the converse does not
+                 hold: constraints can contradict each other in ways only a solver finds).
+        """
+        return bool(self.__conflicts)
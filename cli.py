@@ -0,0 +1,118 @@
+"""
+Solve a Cluedo game from the command line, without a notebook.
+
+The game is a JSON file with the players specification and, optionally, the turn history:
+
+    {"players": [["Will", 6], ["Julie", 6], ["Laura", 6]],
+     "turns": [["Julie", "ALL_FALSE", "MR_GREEN", "ROPE", "HALL"],
+               ["Laura", "SOME_TRUE", "MR_GREEN", "ROPE", "HALL"]]}
+
+Each turn is a row of the View's turn history: a player, SOME_TRUE if the player holds at least
+one of the cards or ALL_FALSE if the player holds none of them, and the cards. More turns can be
+given in a separate file, one JSON row per line. A game of another variant names its deck, e.g.
+"deck": "master_detective" (see cluedo.deck).
+
+    python -m cluedo game.json [--turns turns.jsonl] [--mode backbone] [--json]
+"""
+from cluedo.solver import Cluedo
+import argparse
+import json
+import sys
+
+
+def load_game(path, turns_path=None):
+    """
+    @return: a (players specification, turns, deck name) tuple read from a game file and an optional
+             turn log.
+    """
+    with open(path) as f:
+        game = json.load(f)
+    turns = list(game.get('turns', []))
+    if turns_path is not None:
+        with open(turns_path) as f:
+            turns.extend(json.loads(line) for line in f if line.strip())
+    return [tuple(player) for player in game['players']], turns, game.get('deck', 'classic')
+
+
+def replay(cluedo, turns):
+    """
+    Add turn history rows to <cluedo>, one turn each.
+    """
+    for row in turns:
+        player_name, kind, *items = row
+        cluedo.begin_turn(json.dumps(row))
+        cluedo.add_observation(player_name, kind, items)
+
+
+def deductions(cluedo):
+    """
+    @return: the deductions of the last solve, as a JSON-serializable dictionary from player name to
+             the cards the player holds, does not hold, and may hold (and, after a count, to the
+             probability the player holds each card; after sampling, to the estimated probability and
+             its confidence interval).
+    """
+    ret_val = {}
+    deck = cluedo.deck
+    for player_name, player in cluedo.players.items():
+        held, not_held, unknown = [], [], []
+        for card_type in deck.card_types:
+            for card in deck.card_values[card_type]:
+                values = player[card_type][card]
+                (held if values == {1} else not_held if values == {0} else unknown).append(card)
+        ret_val[player_name] = {'held': held, 'not_held': not_held, 'unknown': unknown}
+        if cluedo.marginals is not None and (cluedo.complete or cluedo.intervals is not None):
+            probabilities = cluedo.probabilities(player_name)
+            ret_val[player_name]['probabilities'] = {card: probabilities[card_type][card]
+                                                     for card_type in deck.card_types for card in unknown
+                                                     if card in probabilities[card_type]}
+        if cluedo.intervals is not None:
+            intervals = cluedo.confidence_intervals(player_name)
+            ret_val[player_name]['intervals'] = {card: list(intervals[card_type][card])
+                                                 for card_type in deck.card_types for card in unknown
+                                                 if card in intervals[card_type]}
+    return ret_val
+
+
+def report(cluedo, stats):
+    lines = []
+    if cluedo.infeasible:
+        return 'No deal is consistent with the turns.'
+    for player_name, known in deductions(cluedo).items():
+        lines.append(f"{player_name}:")
+        lines.append(f"  holds:      {', '.join(known['held']) or '-'}")
+        lines.append(f"  may hold:   {', '.join(known['unknown']) or '-'}")
+        for card, probability in known.get('probabilities', {}).items():
+            interval = known.get('intervals', {}).get(card)
+            spread = f" ({100 * interval[0]:.1f}-{100 * interval[1]:.1f}%)" if interval else ''
+            lines.append(f"    {card}: {100 * probability:.1f}%{spread}")
+    noun = {Cluedo.Count: 'deals', Cluedo.Sample: 'sampled deals'}.get(stats.mode, 'solutions')
+    lines.append(f"({stats.solutions} {noun}, "
+                 f"{stats.status.lower()}, {stats.wall_time:.2f}s)")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cluedo', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('game', help='the game file')
+    parser.add_argument('--turns', help='a file of more turns, one JSON row per line')
+    parser.add_argument('--mode', choices=[Cluedo.Backbone, Cluedo.Count, Cluedo.Sample, Cluedo.Enumerate], default=Cluedo.Backbone)
+    parser.add_argument('--time-limit', type=float, default=None)
+    parser.add_argument('--json', action='store_true', help='print the deductions as JSON')
+    args = parser.parse_args(argv)
+
+    players_spec, turns, deck = load_game(args.game, args.turns)
+    cluedo = Cluedo(players_spec, deck=deck)
+    replay(cluedo, turns)
+    stats = cluedo.solve(time_limit=args.time_limit, mode=args.mode)
+    if args.json:
+        print(json.dumps({'infeasible': cluedo.infeasible, 'complete': stats.complete,
+                          'solutions': stats.solutions,
+                          'players': {} if cluedo.infeasible else deductions(cluedo)}))
+    else:
+        print(report(cluedo, stats))
+    return 1 if cluedo.infeasible else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,345 @@
+from collections import defaultdict
+import bisect
+import itertools
+import random
+import time
+
+
+class DealCounter(object):
+    """
+    Counts the deals of the cards that are consistent with a set of constraints, without enumerating them.
+
+    A deal gives every card to exactly one holder. Holder 0 is the Murderer, who holds exactly one card
+    of each category; every other holder holds exactly its hand size. The cards are dealt one at a time
+    and the deals are counted by dynamic programming over the state left after each card: the number of
+    cards each player still has to receive, the categories the Murderer already holds a card of, and
+    which of the open OR-clauses have already been satisfied. A clause is closed, and dropped from the
+    state, once its last card has been dealt, so the cards are dealt in an order that keeps as few
+    clauses open at a time as possible.
+
+    A forward pass counts the ways to reach each state and a backward pass the ways to complete it, so
+    that the number of deals giving each card to each holder falls out of a single sweep. The ways to
+    complete each state are kept, so that deals can then be drawn uniformly at random (see sample()).
+    """
+
+    # number of states processed between checks of the deadline
+    DeadlineCheckInterval = 1024
+
+    def __init__(self, hand_sizes, category_sizes, constraints, deadline=None, cancel=None):
+        """
+        @param: hand_sizes The number of cards held by each holder, indexed by player index. The
+                Murderer is holder 0.
+        @param: category_sizes The number of cards in each category, in card ordinal order.
+        @param: constraints A list of (kind, player index, card indices, value) tuples, as logged by
+                Cluedo.add_constraint and Cluedo.add_or_constraint.
+        @param: deadline The time.time() after which counting is abandoned with a TimeoutError.
+        @param: cancel A threading.Event which, once set, abandons counting with a TimeoutError.
+        """
+        self.__deadline = deadline
+        self.__cancel = cancel
+        self.__states_since_check = 0
+        self.__hand_sizes = tuple(hand_sizes)
+        self.__num_holders = len(hand_sizes)
+        self.__num_cards = sum(category_sizes)
+        self.__all_categories = (1 << len(category_sizes)) - 1
+        self.__category = [category for category, size in enumerate(category_sizes) for _ in range(size)]
+
+        self.__allowed = [set(range(self.__num_holders)) for _ in range(self.__num_cards)]
+        self.__clauses = []
+        self.__consistent = self.__simplify(constraints)
+        self.__counts = None
+        self.__total = None
+        self.__transitions = None
+        self.__completions = None  # for each step, the number of ways to complete each state before it
+
+    def __simplify(self, constraints):
+        """
+        Fold the unit constraints into the holders allowed for each card, and reduce the OR-clauses
+        against them until nothing changes.
+        @return: False if the constraints are found to be contradictory.
+        """
+        clauses = []
+        for kind, player_index, card_indices, value in constraints:
+            if kind == 'or':
+                clauses.append((player_index, set(card_indices)))
+            elif value:
+                self.__allowed[card_indices[0]] &= {player_index}
+            else:
+                self.__allowed[card_indices[0]].discard(player_index)
+
+        changed = True
+        while changed:
+            changed = False
+            remaining = []
+            for player_index, cards in clauses:
+                if any(self.__allowed[card] == {player_index} for card in cards):
+                    continue
+                cards = {card for card in cards if player_index in self.__allowed[card]}
+                if not cards:
+                    return False
+                if len(cards) == 1:
+                    self.__allowed[cards.pop()] &= {player_index}
+                    changed = True
+                    continue
+                remaining.append((player_index, cards))
+            clauses = remaining
+
+        if any(not allowed for allowed in self.__allowed):
+            return False
+        self.__clauses = clauses
+        return True
+
+    def __order(self):
+        """
+        @return: the cards in the order they are dealt, chosen greedily so that as few clauses as
+                 possible are open (partly dealt) at any time.
+        """
+        order = []
+        dealt = set()
+        remaining = list(range(self.__num_cards))
+        while remaining:
+            def open_clauses(card):
+                placed = dealt | {card}
+                return sum(1 for _, cards in self.__clauses if cards & placed and not cards <= placed)
+            card = min(remaining, key=open_clauses)
+            order.append(card)
+            dealt.add(card)
+            remaining.remove(card)
+        return order
+
+    def __dealing_transitions(self):
+        """
+        @return: for each card, in dealing order, the card, the list of (holder, clause bits satisfied,
+                 category bit) moves, the bits of the clauses closed once the card has been dealt, and
+                 the bit of the category completed by the card, if any.
+        """
+        order = self.__order()
+        position = {card: step for step, card in enumerate(order)}
+        last_step = [max(position[card] for card in cards) for _, cards in self.__clauses]
+        category_end = {}
+        for card in order:
+            category_end[self.__category[card]] = position[card]
+
+        transitions = []
+        for step, card in enumerate(order):
+            category_bit = 1 << self.__category[card]
+            moves = []
+            for holder in sorted(self.__allowed[card]):
+                bits = 0
+                for clause_index, (player_index, cards) in enumerate(self.__clauses):
+                    if player_index == holder and card in cards:
+                        bits |= 1 << clause_index
+                moves.append((holder, bits, category_bit if holder == 0 else 0))
+            closing = 0
+            for clause_index, last in enumerate(last_step):
+                if last == step:
+                    closing |= 1 << clause_index
+            completed = category_bit if category_end[self.__category[card]] == step else 0
+            transitions.append((card, moves, closing, completed))
+        return transitions
+
+    @staticmethod
+    def __step(state, move, closing, completed):
+        """
+        @return: the state after dealing a card with <move>, or None if the move leads to no deal.
+        """
+        budgets, murderer_categories, satisfied = state
+        holder, bits, category_bit = move
+        if holder == 0:
+            if murderer_categories & category_bit:
+                return None
+            murderer_categories |= category_bit
+        else:
+            if budgets[holder - 1] == 0:
+                return None
+            budgets = budgets[:holder - 1] + (budgets[holder - 1] - 1,) + budgets[holder:]
+        if murderer_categories & completed != completed:
+            return None
+        satisfied |= bits
+        if satisfied & closing != closing:
+            return None
+        return budgets, murderer_categories, satisfied & ~closing
+
+    def __check_deadline(self):
+        if self.__deadline is None and self.__cancel is None:
+            return
+        self.__states_since_check += 1
+        if self.__states_since_check >= DealCounter.DeadlineCheckInterval:
+            self.__states_since_check = 0
+            if self.__deadline is not None and time.time() > self.__deadline:
+                raise TimeoutError("deal counting did not finish before the deadline")
+            if self.__cancel is not None and self.__cancel.is_set():
+                raise TimeoutError("deal counting was cancelled")
+
+    def __run(self):
+        if self.__counts is not None:
+            return
+        self.__counts = [[0] * self.__num_cards for _ in range(self.__num_holders)]
+        self.__total = 0
+        if not self.__consistent:
+            return
+
+        try:
+            self.__count()
+        except TimeoutError:
+            self.__counts = None
+            raise
+
+    def __count(self):
+        transitions = self.__transitions = self.__dealing_transitions()
+        initial = (self.__hand_sizes[1:], 0, 0)
+
+        # forward pass: the number of ways to reach each state before each card is dealt
+        layers = [{initial: 1}]
+        for _, moves, closing, completed in transitions:
+            layer = defaultdict(int)
+            for state, count in layers[-1].items():
+                self.__check_deadline()
+                for move in moves:
+                    next_state = DealCounter.__step(state, move, closing, completed)
+                    if next_state is not None:
+                        layer[next_state] += count
+            layers.append(layer)
+
+        # backward pass: the number of ways to complete each state, accumulating the per-card counts
+        final = (tuple(0 for _ in self.__hand_sizes[1:]), self.__all_categories, 0)
+        completions = {final: 1}
+        self.__completions = [None] * self.__num_cards + [completions]
+        for step in reversed(range(self.__num_cards)):
+            card, moves, closing, completed = transitions[step]
+            previous = {}
+            for state, count in layers[step].items():
+                self.__check_deadline()
+                ways = 0
+                for move in moves:
+                    next_state = DealCounter.__step(state, move, closing, completed)
+                    if next_state is None:
+                        continue
+                    tail = completions.get(next_state, 0)
+                    if tail:
+                        ways += tail
+                        self.__counts[move[0]][card] += count * tail
+                if ways:
+                    previous[state] = ways
+            completions = self.__completions[step] = previous
+        self.__total = completions.get(initial, 0)
+
+    @property
+    def total(self):
+        """
+        @return: the number of consistent deals.
+        @raise: TimeoutError if the deadline passed before counting finished.
+        """
+        self.__run()
+        return self.__total
+
+    @property
+    def counts(self):
+        """
+        @return: the number of consistent deals giving each card to each holder, as a
+                 (holders x cards) list of lists.
+        """
+        self.__run()
+        return self.__counts
+
+    def probabilities(self):
+        """
+        @return: the probability that each holder holds each card, over the consistent deals, as a
+                 (holders x cards) list of lists. Every probability is 0 if there is no consistent deal.
+        """
+        total = self.total
+        if not total:
+            return [[0.0] * self.__num_cards for _ in range(self.__num_holders)]
+        return [[count / total for count in row] for row in self.counts]
+
+    def murderer_counts(self, card_classes=()):
+        """
+        Count the consistent deals by the cards the Murderer holds, in a single forward pass in which
+        the state records the Murderer's card of each category rather than only the categories dealt.
+        @param: card_classes Lists of interchangeable cards (see Symmetries.card_classes). A Murderer's
+                card of a class is recorded as the first card of the class, which merges the states
+                that only differ by it, and the count is then split evenly over the class.
+        @return: a dictionary from the Murderer's card ordinals, one per category in category order, to
+                 the number of consistent deals; the cards with no consistent deal are left out.
+        @raise: TimeoutError if the deadline passes before counting finishes.
+        """
+        if not self.__consistent:
+            return {}
+        representative = {card: cards[0] for cards in card_classes for card in cards}
+        num_categories = self.__all_categories.bit_length()
+        transitions = self.__transitions or self.__dealing_transitions()
+
+        layer = {(self.__hand_sizes[1:], (-1,) * num_categories, 0): 1}
+        for card, moves, closing, completed in transitions:
+            category = self.__category[card]
+            next_layer = defaultdict(int)
+            for (budgets, murderer, satisfied), count in layer.items():
+                self.__check_deadline()
+                for holder, bits, _ in moves:
+                    if holder == 0:
+                        if murderer[category] >= 0:
+                            continue
+                        next_murderer = murderer[:category] + (representative.get(card, card),) + \
+                            murderer[category + 1:]
+                        next_budgets = budgets
+                    else:
+                        if budgets[holder - 1] == 0:
+                            continue
+                        next_murderer = murderer
+                        next_budgets = budgets[:holder - 1] + (budgets[holder - 1] - 1,) + budgets[holder:]
+                    if completed and next_murderer[category] < 0:
+                        continue
+                    next_satisfied = satisfied | bits
+                    if next_satisfied & closing != closing:
+                        continue
+                    next_layer[next_budgets, next_murderer, next_satisfied & ~closing] += count
+            layer = next_layer
+
+        class_of = {cards[0]: cards for cards in card_classes}
+        ret_val = {}
+        for (_, murderer, _), count in layer.items():
+            # (every card of a class stands for the same number of deals, by symmetry)
+            shares = [class_of.get(card, [card]) for card in murderer]
+            share = count
+            for cards in shares:
+                share //= len(cards)
+            for cards in itertools.product(*shares):
+                ret_val[cards] = share
+        return ret_val
+
+    def sample(self, num_samples, rng=None):
+        """
+        Draw consistent deals uniformly at random: the cards are dealt in order, each to a holder drawn
+        with a weight of the number of ways to complete the deal from the state that leaves.
+        @param: rng A random.Random.
+        @return: a list of <num_samples> deals, each the list of the holder of every card.
+        @raise: ValueError if there is no consistent deal.
+        """
+        if not self.total:
+            raise ValueError("there is no consistent deal to sample")
+        rng = random.Random() if rng is None else rng
+        initial = (self.__hand_sizes[1:], 0, 0)
+        # the holders and next states a state can move to, with their cumulative weights, shared by
+        # every deal drawn through the state
+        choices = {}
+        deals = []
+        for _ in range(num_samples):
+            deal = [0] * self.__num_cards
+            state = initial
+            for step, (card, moves, closing, completed) in enumerate(self.__transitions):
+                choice = choices.get((step, state))
+                if choice is None:
+                    targets, weights = [], []
+                    for move in moves:
+                        next_state = DealCounter.__step(state, move, closing, completed)
+                        ways = 0 if next_state is None else self.__completions[step + 1].get(next_state, 0)
+                        if ways:
+                            targets.append((move[0], next_state))
+                            weights.append(ways)
+                    choice = choices[step, state] = targets, list(itertools.accumulate(weights))
+                targets, cumulative = choice
+                index = 0 if len(targets) == 1 else \
+                    min(bisect.bisect(cumulative, rng.random() * cumulative[-1]), len(targets) - 1)
+                deal[card], state = targets[index]
+            deals.append(deal)
+        return deals
@@ -0,0 +1,233 @@
+from enum import Enum
+
+
+class Suspect(Enum):
+    """
+    The set of murder suspects.
+    """
+    MISS_SCARLET = 'MISS_SCARLET'
+    PROF_PLUM = 'PROF_PLUM'
+    MRS_PEACOCK = 'MRS_PEACOCK'
+    MR_GREEN = 'MR_GREEN'
+    COL_MUSTARD = 'COL_MUSTARD'
+    MRS_WHITE = 'MRS_WHITE'
+
+
+class Weapon(Enum):
+    """
+    The set of possible murder weapons.
+    """
+    CANDLESTICK = 'CANDLESTICK'
+    DAGGER = 'DAGGER'
+    LEAD_PIPE = 'LEAD_PIPE'
+    REVOLVER = 'REVOLVER'
+    ROPE = 'ROPE'
+    WRENCH = 'WRENCH'
+
+
+class Room(Enum):
+    """
+    The set of locations where the murder may have occurred.
+    """
+    KITCHEN = 'KITCHEN'
+    BALLROOM = 'BALLROOM'
+    CONSERVATORY = 'CONSERVATORY'
+    DINING_ROOM = 'DINING_ROOM'
+    BILLIARD_ROOM = 'BILLIARD_ROOM'
+    LIBRARY = 'LIBRARY'
+    LOUNGE = 'LOUNGE'
+    HALL = 'HALL'
+    STUDY = 'STUDY'
+
+
+class MasterDetectiveSuspect(Enum):
+    """
+    The murder suspects of Master Detective Cluedo.
+    """
+    MISS_SCARLET = 'MISS_SCARLET'
+    PROF_PLUM = 'PROF_PLUM'
+    MRS_PEACOCK = 'MRS_PEACOCK'
+    MR_GREEN = 'MR_GREEN'
+    COL_MUSTARD = 'COL_MUSTARD'
+    MRS_WHITE = 'MRS_WHITE'
+    MISS_PEACH = 'MISS_PEACH'
+    MONSIEUR_BRUNETTE = 'MONSIEUR_BRUNETTE'
+    MADAME_ROSE = 'MADAME_ROSE'
+    SERGEANT_GRAY = 'SERGEANT_GRAY'
+
+
+class MasterDetectiveWeapon(Enum):
+    """
+    The possible murder weapons of Master Detective Cluedo.
+    """
+    CANDLESTICK = 'CANDLESTICK'
+    KNIFE = 'KNIFE'
+    LEAD_PIPE = 'LEAD_PIPE'
+    REVOLVER = 'REVOLVER'
+    ROPE = 'ROPE'
+    WRENCH = 'WRENCH'
+    HORSESHOE = 'HORSESHOE'
+    POISON = 'POISON'
+
+
+class MasterDetectiveRoom(Enum):
+    """
+    The locations where the murder may have occurred in Master Detective Cluedo.
+    """
+    CARRIAGE_HOUSE = 'CARRIAGE_HOUSE'
+    CONSERVATORY = 'CONSERVATORY'
+    KITCHEN = 'KITCHEN'
+    TROPHY_ROOM = 'TROPHY_ROOM'
+    DINING_ROOM = 'DINING_ROOM'
+    DRAWING_ROOM = 'DRAWING_ROOM'
+    GAZEBO = 'GAZEBO'
+    COURTYARD = 'COURTYARD'
+    FOUNTAIN = 'FOUNTAIN'
+    LIBRARY = 'LIBRARY'
+    BILLIARD_ROOM = 'BILLIARD_ROOM'
+    STUDIO = 'STUDIO'
+
+
+class Deck(object):
+    """
+    The cards of a variant of Cluedo: one Enum per category, in a fixed order that gives each card its
+    ordinal. The Murderer holds one card of each category, and the rest are dealt to the players.
+
+    Decks are registered by name on creation, so that a game can be restored from a snapshot that
+    names its deck.
+    """
+
+    # every deck created so far, by name
+    registry = {}
+
+    def __init__(self, name, card_types, category_names=None, max_players=6):
+        """
+        @param: name The name of the deck, unique among decks.
+        @param: card_types The Enum of each category.
+        @param: category_names The display name of each category; by default, the Enum names.
+        @param: max_players The maximum number of players.
+        """
+        self.__name = name
+        self.__card_types = tuple(card_types)
+        self.__category_names = tuple(category_names or (card_type.__name__ for card_type in card_types))
+        self.__max_players = max_players
+        self.__cards = [card for card_type in self.__card_types for card in card_type]
+        self.__card_index = {card: index for index, card in enumerate(self.__cards)}
+        self.__card_values = {card_type: [card.value for card in card_type] for card_type in self.__card_types}
+        self.__card_slices = {}
+        start = 0
+        for card_type in self.__card_types:
+            self.__card_slices[card_type] = slice(start, start + len(card_type))
+            start += len(card_type)
+        Deck.registry[name] = self
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def card_types(self):
+        return self.__card_types
+
+    @property
+    def category_names(self):
+        return self.__category_names
+
+    @property
+    def max_players(self):
+        return self.__max_players
+
+    @property
+    def cards(self):
+        """
+        @return: every card, in ordinal order.
+        """
+        return self.__cards
+
+    @property
+    def card_index(self):
+        """
+        @return: a dictionary from card to ordinal.
+        """
+        return self.__card_index
+
+    @property
+    def num_cards(self):
+        return len(self.__cards)
+
+    @property
+    def num_dealt(self):
+        """
+        @return: the number of cards dealt to the players.
+        """
+        return len(self.__cards) - len(self.__card_types)
+
+    @property
+    def card_values(self):
+        """
+        @return: a dictionary from card type to the values of its cards, in ordinal order.
+        """
+        return self.__card_values
+
+    @property
+    def card_slices(self):
+        """
+        @return: a dictionary from card type to the slice of its cards' ordinals.
+        """
+        return self.__card_slices
+
+    @property
+    def category_sizes(self):
+        return [len(card_type) for card_type in self.__card_types]
+
+    def card(self, value):
+        """
+        @return: the card of the deck with value <value>, which may also be the card itself.
+        """
+        if not isinstance(value, str):
+            return value
+        for card_type in self.__card_types:
+            try:
+                return card_type(value)
+            except ValueError:
+                pass
+        raise ValueError(f"{value!r} is not a card of the {self.__name} deck")
+
+    def hand_sizes(self, num_players):
+        """
+        @return: the hand size of each of <num_players> players when the cards are dealt in turn.
+        """
+        if not 0 < num_players <= self.__max_players:
+            raise ValueError(f"the {self.__name} deck is for 1 to {self.__max_players} players, not {num_players}")
+        return [self.num_dealt // num_players + (index < self.num_dealt % num_players) for index in range(num_players)]
+
+    def players_spec(self, num_players, prefix='P'):
+        """
+        @return: a players specification with generated names, for a game with <num_players> players.
+        """
+        return [(f'{prefix}{index}', hand_size) for index, hand_size in enumerate(self.hand_sizes(num_players))]
+
+    def signature(self):
+        """
+        @return: a hashable description of the cards of the deck, e.g. for cache keys.
+        """
+        return self.__name, tuple(tuple(values) for values in self.__card_values.values())
+
+    def __reduce__(self):
+        # (decks are pickled by name, e.g. to worker processes, which have the built-in decks registered)
+        return deck, (self.__name,)
+
+    def __repr__(self):
+        return f"Deck({self.__name!r}, {'/'.join(str(size) for size in self.category_sizes)} cards)"
+
+
+def deck(name):
+    """
+    @return: the deck registered under <name>.
+    """
+    return Deck.registry[name]
+
+
+CLASSIC = Deck('classic', (Suspect, Weapon, Room), ('Suspects', 'Weapons', 'Rooms'), max_players=6)
+MASTER_DETECTIVE = Deck('master_detective', (MasterDetectiveSuspect, MasterDetectiveWeapon, MasterDetectiveRoom),
+                        ('Suspects', 'Weapons', 'Rooms'), max_players=10)
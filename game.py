@@ -1,43 +1,8 @@
-from enum import Enum
+from cluedo import solver
+from cluedo.deck import CLASSIC, Suspect, Weapon, Room
+from cluedo.lazy import LazyModule
 
-
-class Suspect(Enum):
-    """
-    The set of murder suspects.
-    """
-    COL_MUSTARD = 'COL_MUSTARD'
-    MISS_SCARLET = 'MISS_SCARLET'
-    MR_GREEN = 'MR_GREEN'
-    MRS_PEACOCK = 'MRS_PEACOCK'
-    MRS_WHITE = 'MRS_WHITE'
-    PROF_PLUM = 'PROF_PLUM'
-
-
-class Weapon(Enum):
-    """
-    The set of possible murder weapons.
-    """
-    CANDLESTICK = 'CANDLESTICK'
-    DAGGER = 'DAGGER'
-    LEAD_PIPE = 'LEAD_PIPE'
-    REVOLVER = 'REVOLVER'
-    ROPE = 'ROPE'
-    WRENCH = 'WRENCH'
-
-
-class Room(Enum):
-    """
-    The set of locations where the murder may have occurred.
-    """
-    BALLROOM = 'BALLROOM'
-    BILLIARD_ROOM = 'BILLIARD_ROOM'
-    CONSERVATORY = 'CONSERVATORY'
-    DINING_ROOM = 'DINING_ROOM'
-    HALL = 'HALL'
-    KITCHEN = 'KITCHEN'
-    LIBRARY = 'LIBRARY'
-    LOUNGE = 'LOUNGE'
-    STUDY = 'STUDY'
+np = LazyModule('numpy')
 
 
 class Player(object):
@@ -71,3 +36,197 @@ class Cluedo(object):
     @property
     def player_names(self):
         return [player.name for player in self.__players]
+
+
+def deal(num_games, hand_sizes, rng=None, deck=CLASSIC):
+    """
+    Deal the cards of many games at once: the Murderer draws one card of each category, and the rest
+    are shuffled and dealt to the players in turn order, by hand size.
+    @param: hand_sizes The number of cards of each player; they must add up to the cards left once the
+            Murderer has drawn.
+    @param: rng A numpy.random.Generator.
+    @param: deck The Deck to deal.
+    @return: a (games x cards) array of the holder of each card, by solver card ordinal (the simulator
+             plays in the solver's card order, so that it can feed the solver directly); holder 0 is
+             the Murderer and holder i the i-th player.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    assert sum(hand_sizes) == deck.num_dealt
+    holders = np.zeros((num_games, deck.num_cards), dtype=np.int8)
+    keys = rng.random((num_games, deck.num_cards))
+    games = np.arange(num_games)
+    for card_type in deck.card_types:
+        category = deck.card_slices[card_type]
+        murderer = category.start + rng.integers(len(card_type), size=num_games)
+        # the Murderer's cards sort last, out of the players' deal
+        keys[games, murderer] = 2.0
+    order = np.argsort(keys, axis=1)
+    dealt_holders = np.repeat(np.arange(1, len(hand_sizes) + 1), hand_sizes)
+    holders[games[:, None], order[:, :len(dealt_holders)]] = dealt_holders
+    return holders
+
+
+def random_suggestion(player_index, suspected, rng, deck=CLASSIC):
+    """
+    Suggest any card of each category.
+    @param: suspected The cards the suggester has not yet seen, as a boolean array by card ordinal.
+    @return: the suggested card ordinals, one per category.
+    """
+    return [deck.card_slices[card_type].start + int(rng.integers(len(card_type))) for card_type in deck.card_types]
+
+
+def eliminating_suggestion(player_index, suspected, rng, deck=CLASSIC):
+    """
+    Suggest, in each category, a card the suggester has not yet seen (if any is left).
+    """
+    suggestion = []
+    for card_type in deck.card_types:
+        category = deck.card_slices[card_type]
+        candidates = np.flatnonzero(suspected[category]) + category.start
+        if not len(candidates):
+            candidates = np.arange(category.start, category.stop)
+        suggestion.append(int(rng.choice(candidates)))
+    return suggestion
+
+
+def random_refutation(player_index, held, suggester_index, rng):
+    """
+    Show any of the suggested cards held.
+    @param: held The ordinals of the suggested cards the refuting player holds.
+    @return: the ordinal of the card shown.
+    """
+    return int(rng.choice(held))
+
+
+def first_refutation(player_index, held, suggester_index, rng):
+    """
+    Always show the first suggested card held, in card order.
+    """
+    return int(min(held))
+
+
+class Simulation(object):
+    """
+    Self-play games of Cluedo, followed by the solver.
+
+    Every player suggests in turn, with a pluggable suggestion strategy, and the players after the
+    suggester refute it in order, with a pluggable refutation strategy. The first player is the
+    observer: a solver is fed what the observer learns (their own hand, the players who pass, the
+    cards shown to them, and who refutes everybody else's suggestions) and solved after every turn,
+    until it has found the three cards of the Murderer.
+    """
+
+    def __init__(self, num_players, suggestion=eliminating_suggestion, refutation=random_refutation,
+                 mode=solver.Cluedo.Backbone, time_limit=None, seed=None, deck=CLASSIC):
+        self.__deck = deck
+        self.__game = Cluedo([Player(f'P{index}', hand_size)
+                              for index, hand_size in enumerate(deck.hand_sizes(num_players))])
+        self.__suggestion = suggestion
+        self.__refutation = refutation
+        self.__mode = mode
+        self.__time_limit = time_limit
+        self.__rng = np.random.default_rng(seed)
+
+    @property
+    def game(self):
+        return self.__game
+
+    @property
+    def deck(self):
+        return self.__deck
+
+    @property
+    def players_spec(self):
+        return [(player.name, player.num_cards) for player in self.__game.players]
+
+    def deal(self, num_games):
+        return deal(num_games, [player.num_cards for player in self.__game.players], self.__rng, self.__deck)
+
+    def play(self, holders, max_turns=200):
+        """
+        Play one game until the solver has found the Murderer's cards, or for <max_turns> turns.
+        @param: holders The holder of each card, as a row of deal().
+        @return: a dictionary of the turns it took the solver to find the Murderer's cards (None if it
+                 did not), the latency of each solve, and the game log, in the format read by
+                 cluedo.batch.
+        """
+        names = self.__game.player_names
+        num_players = len(names)
+        deck = self.__deck
+        cards = np.array([card.value for card in deck.cards])
+        cluedo = solver.Cluedo(self.players_spec, deck=deck)
+        # the cards each player has not seen yet
+        suspected = np.ones((num_players, deck.num_cards), dtype=bool)
+        for index in range(num_players):
+            suspected[index, holders == index + 1] = False
+
+        # the observer knows their own hand
+        log = [[names[0], solver.Cluedo.SomeTrue, card] for card in cards[holders == 1].tolist()]
+        log.append([names[0], solver.Cluedo.AllFalse] + cards[holders != 1].tolist())
+        for row in log:
+            cluedo.add_observation(row[0], row[1], row[2:])
+
+        murderer = np.flatnonzero(holders == 0).tolist()
+        latencies = []
+        turns_to_solve = None
+        for turn in range(1, max_turns + 1):
+            suggester = (turn - 1) % num_players
+            suggestion = self.__suggestion(suggester, suspected[suggester], self.__rng, deck)
+            rows = []
+            for offset in range(1, num_players):
+                responder = (suggester + offset) % num_players
+                held = [card for card in suggestion if holders[card] == responder + 1]
+                if not held:
+                    rows.append([names[responder], solver.Cluedo.AllFalse] + cards[suggestion].tolist())
+                    continue
+                shown = self.__refutation(responder, held, suggester, self.__rng)
+                suspected[suggester, shown] = False
+                # (the observer learns nothing from refuting a suggestion themselves)
+                if suggester == 0:
+                    rows.append([names[responder], solver.Cluedo.SomeTrue, cards[shown]])
+                elif responder != 0:
+                    rows.append([names[responder], solver.Cluedo.SomeTrue] + cards[suggestion].tolist())
+                break
+
+            cluedo.begin_turn(f'turn {turn}')
+            for row in rows:
+                cluedo.add_observation(row[0], row[1], row[2:])
+            log.extend(rows)
+            stats = cluedo.solve(time_limit=self.__time_limit, mode=self.__mode)
+            latencies.append(stats.wall_time)
+            known = cluedo.player()
+            if all(known[type(deck.cards[card])][deck.cards[card].value] == {1} for card in murderer):
+                turns_to_solve = turn
+                break
+
+        return {
+            'turns_to_solve': turns_to_solve,
+            'latencies': latencies,
+            'log': {'deck': deck.name, 'players_spec': [list(player) for player in self.players_spec], 'turns': log},
+        }
+
+    def run(self, num_games, max_turns=200):
+        """
+        Deal and play <num_games> games.
+        @return: a dictionary of turns-to-solve and solve latency statistics over the games, along with
+                 the result of play() for each game.
+        """
+        games = [self.play(holders, max_turns) for holders in self.deal(num_games)]
+        solved = np.array([game['turns_to_solve'] for game in games if game['turns_to_solve'] is not None])
+        latencies = np.array([latency for game in games for latency in game['latencies']])
+        return {
+            'games': num_games,
+            'solved': len(solved),
+            'turns_to_solve': {
+                'mean': float(solved.mean()) if len(solved) else None,
+                'median': float(np.median(solved)) if len(solved) else None,
+                'p90': float(np.percentile(solved, 90)) if len(solved) else None,
+                'max': int(solved.max()) if len(solved) else None,
+            },
+            'latency': {
+                'mean': float(latencies.mean()) if len(latencies) else None,
+                'p95': float(np.percentile(latencies, 95)) if len(latencies) else None,
+                'max': float(latencies.max()) if len(latencies) else None,
+            },
+            'results': games,
+        }
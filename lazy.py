@@ -0,0 +1,33 @@
+import importlib
+
+
+class LazyModule(object):
+    """
+    A stand-in for a module that is only imported when one of its attributes is first used, so that
+    importing the solver stays cheap for callers that never reach the code that needs the module
+    (e.g. ortools, which pulls in pandas, when propagation or counting settles the board).
+    """
+
+    def __init__(self, name, on_import=None):
+        """
+        @param: name The absolute name of the module.
+        @param: on_import A callable called with the module once it is imported, e.g. to configure it.
+        """
+        self.__name = name
+        self.__on_import = on_import
+        self.__module = None
+
+    def __getattr__(self, attribute):
+        if self.__module is None:
+            module = importlib.import_module(self.__name)
+            if self.__on_import is not None:
+                self.__on_import(module)
+            self.__module = module
+        return getattr(self.__module, attribute)
+
+    @property
+    def loaded(self):
+        return self.__module is not None
+
+    def __repr__(self):
+        return f"<lazy module '{self.__name}'{'' if self.loaded else ' (not imported)'}>"
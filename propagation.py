@@ -0,0 +1,172 @@
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+class Propagator(object):
+    """
+    Applies the simple card-ownership deductions to a fixpoint, without calling a solver.
+
+    The state is a pair of bitmasks over the card ordinals for each holder: the cards the holder is
+    known to hold, and the cards the holder is known not to hold. Holder 0 is the Murderer. The rules
+    applied are:
+
+    * every card is held by exactly one holder, so a card held by one holder is excluded for the
+      others, and a card that only one holder can still hold is held by that holder;
+    * a player whose hand is full holds no other card, and a player who can only still hold as many
+      cards as the hand size holds all of them;
+    * an OR-clause that is already satisfied is dropped, and one with a single live card left
+      becomes a held card;
+    * the Murderer holds exactly one card of each category.
+
+    These rules are sound but not complete: a board they leave unsettled still needs a solver.
+    """
+
+    def __init__(self, hand_sizes, category_sizes, constraints):
+        """
+        @param: hand_sizes The number of cards held by each holder, indexed by player index. The
+                Murderer is holder 0.
+        @param: category_sizes The number of cards in each category, in card ordinal order.
+        @param: constraints A list of (kind, player index, card indices, value) tuples, as logged by
+                Cluedo.add_constraint and Cluedo.add_or_constraint.
+        """
+        self.__hand_sizes = list(hand_sizes)
+        self.__num_cards = sum(category_sizes)
+        self.__all = (1 << self.__num_cards) - 1
+        self.__categories = []
+        offset = 0
+        for size in category_sizes:
+            self.__categories.append(((1 << size) - 1) << offset)
+            offset += size
+
+        self.__held = [0] * len(hand_sizes)
+        self.__excluded = [0] * len(hand_sizes)
+        self.__clauses = []
+        for kind, player_index, card_indices, value in constraints:
+            bits = 0
+            for card_index in card_indices:
+                bits |= 1 << card_index
+            if kind == 'or':
+                self.__clauses.append((player_index, bits))
+            elif value:
+                self.__held[player_index] |= bits
+            else:
+                self.__excluded[player_index] |= bits
+        self.__consistent = self.__propagate()
+
+    def __propagate(self):
+        """
+        Apply the rules until nothing changes.
+        @return: False if a contradiction was found.
+        """
+        held, excluded = self.__held, self.__excluded
+        changed = True
+        while changed:
+            before = (tuple(held), tuple(excluded), len(self.__clauses))
+
+            # OR-clauses
+            clauses = []
+            for player_index, bits in self.__clauses:
+                if held[player_index] & bits:
+                    continue
+                live = bits & ~excluded[player_index]
+                if not live:
+                    return False
+                if live & (live - 1):
+                    clauses.append((player_index, live))
+                else:
+                    held[player_index] |= live
+            self.__clauses = clauses
+
+            # every card is held by exactly one holder
+            seen_once = 0
+            for index in range(len(held)):
+                if held[index] & seen_once:
+                    return False
+                seen_once |= held[index]
+            for index in range(len(held)):
+                excluded[index] |= seen_once & ~held[index]
+            possible_once, possible_twice = 0, 0
+            for index in range(len(held)):
+                possible = self.__all & ~excluded[index]
+                possible_twice |= possible_once & possible
+                possible_once |= possible
+            if possible_once != self.__all:
+                return False
+            single = possible_once & ~possible_twice
+            for index in range(len(held)):
+                held[index] |= single & ~excluded[index]
+
+            # hand sizes
+            for index, hand_size in enumerate(self.__hand_sizes):
+                possible = self.__all & ~excluded[index]
+                num_held, num_possible = popcount(held[index]), popcount(possible)
+                if num_held > hand_size or num_possible < hand_size:
+                    return False
+                if num_held == hand_size:
+                    excluded[index] = self.__all & ~held[index]
+                elif num_possible == hand_size:
+                    held[index] = possible
+
+            # the Murderer holds one card of each category
+            for category in self.__categories:
+                category_held = held[0] & category
+                if category_held & (category_held - 1):
+                    return False
+                if category_held:
+                    excluded[0] |= category & ~category_held
+                possible = category & ~excluded[0]
+                if not possible:
+                    return False
+                if not possible & (possible - 1):
+                    held[0] |= possible
+
+            if any(h & e for h, e in zip(held, excluded)):
+                return False
+            changed = (tuple(held), tuple(excluded), len(self.__clauses)) != before
+        return True
+
+    @property
+    def consistent(self):
+        """
+        @return: False if the constraints were found to be contradictory.
+        """
+        return self.__consistent
+
+    @property
+    def settled(self):
+        """
+        @return: whether the owner of every card is known.
+        """
+        return self.__consistent and all(h | e == self.__all for h, e in zip(self.__held, self.__excluded))
+
+    @property
+    def held(self):
+        """
+        @return: the bitmask of the cards known to be held, indexed by player index.
+        """
+        return list(self.__held)
+
+    @property
+    def excluded(self):
+        """
+        @return: the bitmask of the cards known not to be held, indexed by player index.
+        """
+        return list(self.__excluded)
+
+    @property
+    def clauses(self):
+        """
+        @return: the OR-clauses left open, as (player index, card bitmask) tuples.
+        """
+        return list(self.__clauses)
+
+    def facts(self):
+        """
+        @return: a (mask, values) tuple of bitsets over the flat (player index x card index) variable
+                 layout, for the variables whose value is known.
+        """
+        mask, values = 0, 0
+        for index, (held, excluded) in enumerate(zip(self.__held, self.__excluded)):
+            mask |= (held | excluded) << index * self.__num_cards
+            values |= held << index * self.__num_cards
+        return mask, values
@@ -0,0 +1,120 @@
+from cluedo.lazy import LazyModule
+import itertools
+
+np = LazyModule('numpy')
+
+
+class SuggestionRanker(object):
+    """
+    Ranks the suggestions a player can make by their expected information gain: how much a
+    suggestion is expected to reduce the uncertainty about the deal, over a sample of consistent
+    deals drawn uniformly at random (see DealCounter.sample()).
+
+    A suggestion names one card of each category. The players after the suggester answer it in turn:
+    each player who holds none of the cards passes, and the first who holds one shows one of them to
+    the suggester, which ends the round. The outcome the suggester observes is who refutes and which
+    card is shown, or that nobody can refute. In a given deal, the refuter is settled but the card
+    shown is the refuter's choice, taken to be uniform among the suggested cards they hold. The
+    information gain of a suggestion is then the mutual information between the deal and the
+    outcome: the entropy of the outcome, less the entropy left by the refuter's choice.
+
+    The deals are shared by every suggestion, and the outcomes of every suggestion are tallied in
+    one vectorized pass over all the suggestions at once, a bounded number of them per chunk. The
+    gains are cached per suggester and order of responders.
+    """
+
+    # number of suggestions whose outcomes are tallied at once, which bounds the memory used
+    ChunkSize = 128
+
+    def __init__(self, deals, category_sizes):
+        """
+        @param: deals The deals, as a (deals x cards) array of the holder of each card by card
+                ordinal. Holder 0 is the Murderer.
+        @param: category_sizes The number of cards in each category, in card ordinal order.
+        """
+        self.__deals = np.asarray(deals)
+        starts = list(itertools.accumulate([0] + list(category_sizes[:-1])))
+        # every suggestion, as the card ordinals it names, one per category
+        self.__candidates = np.array(list(itertools.product(*[range(start, start + size)
+                                                               for start, size in zip(starts, category_sizes)])),
+                                     dtype=np.intp)
+        self.__gains = {}
+
+    @property
+    def candidates(self):
+        """
+        @return: every suggestion, as a (suggestions x categories) array of card ordinals.
+        """
+        return self.__candidates
+
+    @property
+    def num_deals(self):
+        return len(self.__deals)
+
+    def __ranks(self, responders):
+        """
+        @return: a (deals x cards) array of the position of the holder of each card among the
+                 responders, or len(responders) if the card is held by nobody who can show it.
+        """
+        num_holders = max(int(self.__deals.max(initial=0)), *responders, 0) + 1
+        positions = np.full(num_holders, len(responders), dtype=np.int16)
+        positions[list(responders)] = np.arange(len(responders))
+        return positions[self.__deals]
+
+    def outcomes(self, responders, candidates=None):
+        """
+        @param: responders The holder index of each player who answers the suggestion, in the order
+                they answer.
+        @param: candidates The suggestions, as returned by candidates; by default, every suggestion.
+        @return: a (probabilities, choice entropy) tuple. The probabilities are a (suggestions x
+                 outcomes) array, where outcome <r> * categories + <i> is the <r>-th responder showing
+                 the <i>-th card of the suggestion, and the last outcome is nobody refuting. The
+                 choice entropy is the expected entropy, in bits, of the refuter's choice of card.
+        """
+        candidates = self.__candidates if candidates is None else np.asarray(candidates, dtype=np.intp)
+        ranks = self.__ranks(responders)
+        num_responders = len(responders)
+        num_slots = candidates.shape[1]
+        num_outcomes = num_responders * num_slots + 1
+        probabilities = np.empty((len(candidates), num_outcomes))
+        choice_entropy = np.empty(len(candidates))
+        for start in range(0, len(candidates), SuggestionRanker.ChunkSize):
+            chunk = candidates[start:start + SuggestionRanker.ChunkSize]
+            # (deals x suggestions x slots) positions of the holders of the suggested cards
+            suggested = ranks[:, chunk]
+            refuter = suggested.min(axis=2)
+            shown = suggested == refuter[:, :, None]
+            num_shown = shown.sum(axis=2)
+            refuted = refuter < num_responders
+            # (a deal nobody refutes puts all its weight on the first slot of the last outcome)
+            weights = np.where(refuted[:, :, None], shown / num_shown[:, :, None], np.arange(num_slots) == 0)
+            outcome = np.where(refuted[:, :, None], refuter[:, :, None] * num_slots + np.arange(num_slots),
+                               num_outcomes - 1)
+            outcome += (np.arange(len(chunk)) * num_outcomes)[None, :, None]
+            tally = np.bincount(outcome.ravel(), weights.ravel(), minlength=len(chunk) * num_outcomes)
+            probabilities[start:start + len(chunk)] = tally.reshape(len(chunk), num_outcomes) / len(self.__deals)
+            choice_entropy[start:start + len(chunk)] = np.where(refuted, np.log2(num_shown), 0.0).mean(axis=0)
+        return probabilities, choice_entropy
+
+    def gains(self, responders):
+        """
+        @param: responders The holder index of each player who answers the suggestion, in order.
+        @return: the expected information gain of every suggestion of candidates, in bits.
+        """
+        key = tuple(responders)
+        if key not in self.__gains:
+            probabilities, choice_entropy = self.outcomes(responders)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                entropy = -np.where(probabilities > 0, probabilities * np.log2(probabilities), 0.0).sum(axis=1)
+            self.__gains[key] = np.maximum(entropy - choice_entropy, 0.0)
+        return self.__gains[key]
+
+    def rank(self, responders, top=None):
+        """
+        @return: the (suggestion index, expected information gain) tuples of the <top> suggestions
+                 with the highest gain (by default, every suggestion), best first.
+        """
+        gains = self.gains(responders)
+        # (a stable sort keeps equal gains in card order)
+        order = np.argsort(-gains, kind='stable')[:top]
+        return [(int(index), float(gains[index])) for index in order]
@@ -0,0 +1,196 @@
+from cluedo.lazy import LazyModule
+import itertools
+import random
+import time
+
+np = LazyModule('numpy')
+
+
+class DealSampler(object):
+    """
+    Estimates ownership probabilities from consistent deals drawn by Markov chain Monte Carlo, for
+    boards with too many deals to count exactly in time.
+
+    The chain walks over the consistent deals by swapping the holders of two cards: the swap keeps
+    every hand size, and swapping a Murderer's card only with a card of the same category keeps the
+    Murderer's one card per category. A swap is proposed uniformly among the pairs of cards that can
+    still change hands and accepted whenever the deal it leads to is consistent, so that the chain
+    converges to the uniform distribution over the deals it can reach. The deal is recorded once per
+    sweep (one proposal per card that can move) after a burn-in of a few sweeps.
+
+    The memory used is fixed, whatever the number of samples: the counts of each card held by each
+    holder, kept in a fixed number of batches. The batches are merged pairwise whenever they are all
+    full, and the spread of their means gives the confidence intervals of the estimates (the batch
+    means method, which accounts for the correlation between successive samples of the chain).
+    """
+
+    # number of proposals between checks of the deadline
+    DeadlineCheckInterval = 1024
+
+    def __init__(self, hand_sizes, category_sizes, constraints, deal, rng=None, num_batches=32):
+        """
+        @param: hand_sizes The number of cards held by each holder, indexed by player index. The
+                Murderer is holder 0.
+        @param: category_sizes The number of cards in each category, in card ordinal order.
+        @param: constraints A list of (kind, player index, card indices, value) tuples, as logged by
+                Cluedo.add_constraint and Cluedo.add_or_constraint.
+        @param: deal A consistent deal to start the chain from, as the holder of each card by card
+                ordinal (e.g. from a solver witness).
+        @param: rng A random.Random.
+        @param: num_batches The number of batches the samples are split into, an even number.
+        """
+        self.__num_holders = len(hand_sizes)
+        self.__num_cards = sum(category_sizes)
+        self.__category = [category for category, size in enumerate(category_sizes) for _ in range(size)]
+        self.__rng = random.Random() if rng is None else rng
+        self.__holder = list(deal)
+
+        self.__allowed = [set(range(self.__num_holders)) for _ in range(self.__num_cards)]
+        self.__clauses = []  # (player index, set of cards) of each OR-clause
+        for kind, player_index, card_indices, value in constraints:
+            if kind == 'or':
+                self.__clauses.append((player_index, set(card_indices)))
+            elif value:
+                self.__allowed[card_indices[0]] &= {player_index}
+            else:
+                self.__allowed[card_indices[0]].discard(player_index)
+        self.__card_clauses = [[] for _ in range(self.__num_cards)]
+        for clause_index, (_, cards) in enumerate(self.__clauses):
+            for card in cards:
+                self.__card_clauses[card].append(clause_index)
+        # the number of cards of each clause its player holds, which must stay positive
+        self.__satisfied = [sum(self.__holder[card] == player_index for card in cards)
+                            for player_index, cards in self.__clauses]
+        if not self.__consistent():
+            raise ValueError("the deal to start sampling from is not consistent with the constraints")
+        self.__movable = [card for card in range(self.__num_cards) if len(self.__allowed[card]) > 1]
+
+        self.__num_batches = num_batches
+        self.__batch_size = 1
+        self.__batches = []  # per batch, a flat (holders x cards) list of counts
+        self.__last_batch_samples = 0  # the number of samples in the last batch
+        self.__num_samples = 0
+        self.__proposed = 0
+        self.__accepted = 0
+
+    def __consistent(self):
+        holder = self.__holder
+        return all(holder[card] in allowed for card, allowed in enumerate(self.__allowed)) and \
+            all(count > 0 for count in self.__satisfied)
+
+    def __propose(self):
+        """
+        Propose swapping the holders of two cards, and make the swap if it keeps the deal consistent.
+        """
+        self.__proposed += 1
+        first, second = self.__rng.choice(self.__movable), self.__rng.choice(self.__movable)
+        holder = self.__holder
+        first_holder, second_holder = holder[first], holder[second]
+        if first_holder == second_holder:
+            return
+        if (first_holder == 0 or second_holder == 0) and self.__category[first] != self.__category[second]:
+            return
+        if second_holder not in self.__allowed[first] or first_holder not in self.__allowed[second]:
+            return
+        changes = {}
+        for card, before, after in ((first, first_holder, second_holder), (second, second_holder, first_holder)):
+            for clause_index in self.__card_clauses[card]:
+                player_index = self.__clauses[clause_index][0]
+                changes[clause_index] = changes.get(clause_index, 0) + (after == player_index) - \
+                    (before == player_index)
+        if any(self.__satisfied[clause_index] + change <= 0 for clause_index, change in changes.items()):
+            return
+        for clause_index, change in changes.items():
+            self.__satisfied[clause_index] += change
+        holder[first], holder[second] = second_holder, first_holder
+        self.__accepted += 1
+
+    def __sweeps(self, deadline, cancel):
+        """
+        @return: a generator that runs the chain for one sweep per step, until <deadline> or <cancel>.
+        """
+        steps = 0
+        while True:
+            for _ in range(len(self.__movable) or 1):
+                if self.__movable:
+                    self.__propose()
+                steps += 1
+                if steps >= DealSampler.DeadlineCheckInterval:
+                    steps = 0
+                    if deadline is not None and time.time() > deadline or cancel is not None and cancel.is_set():
+                        return
+            yield
+
+    def deals(self, num_deals=None, burn_in=10, deadline=None, cancel=None):
+        """
+        @param: num_deals The number of deals drawn; by default, until <deadline> or <cancel>.
+        @param: burn_in The number of sweeps run before the first deal is drawn.
+        @return: a generator of up to <num_deals> deals, one per sweep, each the list of the holder of
+                 every card; it stops early at <deadline> or once <cancel> is set.
+        """
+        sweeps = self.__sweeps(deadline, cancel)
+        for _ in itertools.islice(sweeps, burn_in):
+            pass
+        for _ in itertools.islice(sweeps, num_deals):
+            yield list(self.__holder)
+
+    def run(self, num_samples=None, burn_in=10, deadline=None, cancel=None):
+        """
+        Draw samples into the batches, until <num_samples> are drawn, <deadline> passes or <cancel>
+        is set, whichever comes first. Runs can be repeated to draw more samples.
+        @return: the number of samples drawn so far, over every run.
+        """
+        if num_samples is None and deadline is None and cancel is None:
+            raise ValueError("sampling needs a number of samples, a deadline or a cancel event to stop")
+        num_cards = self.__num_cards
+        for deal in self.deals(num_samples, burn_in if not self.__num_samples else 0, deadline, cancel):
+            if not self.__batches or self.__last_batch_samples == self.__batch_size:
+                if len(self.__batches) == self.__num_batches:
+                    # the batches are full: merge them pairwise into full batches twice the size
+                    self.__batches = [[first + second for first, second in zip(*pair)]
+                                      for pair in zip(self.__batches[::2], self.__batches[1::2])]
+                    self.__batch_size *= 2
+                self.__batches.append([0] * (self.__num_holders * num_cards))
+                self.__last_batch_samples = 0
+            batch = self.__batches[-1]
+            for card, holder in enumerate(deal):
+                batch[holder * num_cards + card] += 1
+            self.__last_batch_samples += 1
+            self.__num_samples += 1
+        return self.__num_samples
+
+    @property
+    def num_samples(self):
+        return self.__num_samples
+
+    @property
+    def acceptance_rate(self):
+        return self.__accepted / self.__proposed if self.__proposed else 0.0
+
+    def counts(self):
+        """
+        @return: the number of samples in which each holder holds each card, as a (holders x cards) array.
+        """
+        if not self.__batches:
+            return np.zeros((self.__num_holders, self.__num_cards), dtype=int)
+        return np.sum(self.__batches, axis=0).reshape(self.__num_holders, self.__num_cards)
+
+    def probabilities(self):
+        """
+        @return: the estimated probability that each holder holds each card, as a (holders x cards) array.
+        """
+        return self.counts() / max(self.__num_samples, 1)
+
+    def intervals(self, z=1.96):
+        """
+        @param: z The number of standard errors of the interval (1.96 for about 95% confidence).
+        @return: the half-width of the confidence interval of each estimate of probabilities(), from the
+                 spread of the full batch means, as a (holders x cards) array. The intervals are 1 until
+                 there are at least two full batches.
+        """
+        full = self.__batches if self.__last_batch_samples == self.__batch_size else self.__batches[:-1]
+        if len(full) < 2:
+            return np.ones((self.__num_holders, self.__num_cards))
+        means = np.array(full, dtype=float) / self.__batch_size
+        half_widths = z * means.std(axis=0, ddof=1) / np.sqrt(len(full))
+        return half_widths.reshape(self.__num_holders, self.__num_cards)
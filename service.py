@@ -0,0 +1,434 @@
+"""
+Host many games at once behind a local HTTP/JSON service.
+
+    POST   /games                      {"players": [["Will", 6], ...], "deck": "classic"}, or {"session": ...}
+    GET    /games/<id>                 the players, deck and number of turns of a game
+    DELETE /games/<id>
+    POST   /games/<id>/turns           {"suggester": "Will", "suggestion": ["MR_GREEN", "ROPE", "HALL"],
+                                        "passers": ["Julie"], "refuter": "Laura", "shown_card": null},
+                                       or {"row": ["Julie", "ALL_FALSE", "MR_GREEN", "ROPE", "HALL"]}
+    GET    /games/<id>/deductions      ?mode=backbone&time_limit=5
+    GET    /games/<id>/probabilities   ?mode=count&time_limit=5
+    GET    /games/<id>/session         a snapshot of the game (see cluedo.session)
+    GET    /metrics
+
+Solves run in a bounded process pool, so that the event loop keeps serving requests. Each query has
+a time budget (its time_limit, up to a maximum) that covers both the wait for a worker and the solve;
+a solve that is still running when the budget is spent answers 504, and its result is kept for the
+next query. Queries for a game and mode that is already being solved wait for that solve rather than
+start another one, and complete results are reused until a turn is added. Once as many solves are
+queued as the queue allows, queries that need a new solve are turned away with 503 and Retry-After.
+The latency of every endpoint, and the counts of solves, coalesced and rejected queries, are
+reported by /metrics.
+
+    python -m cluedo.service [--host 127.0.0.1] [--port 8080] [--workers 2] [--max-queue 64]
+"""
+from cluedo import session as sessions
+from cluedo.cli import deductions
+from cluedo.solver import Cluedo, discard_worker_pool, worker_pool
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+
+
+class Overloaded(RuntimeError):
+    """
+    Raised when a query needs a new solve but the solve queue is full.
+    """
+
+
+def solve_game(state, mode, deadline):
+    """
+    Solve a game in a worker process, on a copy restored from <state>.
+    @param: deadline The time.time() by which the solve stops, whatever it has found.
+    @return: a (state, result) tuple: the state of the solved copy, with its results (see
+             Cluedo.state()), and the JSON-serializable result of the solve.
+    """
+    cluedo = Cluedo.from_state(state)
+    stats = cluedo.solve(mode=mode, time_limit=max(deadline - time.time(), GameService.MinTimeLimit))
+    probabilities = None
+    if cluedo.marginals is not None and (cluedo.complete or cluedo.intervals is not None):
+        probabilities = {player_name: {card: probability
+                                       for card_probabilities in cluedo.probabilities(player_name).values()
+                                       for card, probability in card_probabilities.items()}
+                         for player_name in cluedo.player_names}
+    return cluedo.state(results=True), {
+        'mode': mode,
+        'complete': stats.complete,
+        'infeasible': cluedo.infeasible,
+        'solutions': stats.solutions,
+        'solve_time': stats.wall_time,
+        'players': {} if cluedo.infeasible else deductions(cluedo),
+        'probabilities': probabilities,
+    }
+
+
+class Metrics(object):
+    """
+    The latency of each endpoint over its most recent requests, and counters of what the service did.
+    """
+
+    # number of the most recent latencies kept per endpoint
+    Window = 1024
+
+    def __init__(self):
+        self.__latencies = {}  # endpoint -> deque of seconds
+        self.__requests = {}  # endpoint -> number of requests
+        self.__errors = {}  # endpoint -> number of requests answered with an error
+        self.counters = {'solves': 0, 'coalesced': 0, 'reused': 0, 'rejected': 0, 'timeouts': 0, 'failures': 0}
+
+    def record(self, endpoint, seconds, status):
+        self.__latencies.setdefault(endpoint, deque(maxlen=Metrics.Window)).append(seconds)
+        self.__requests[endpoint] = self.__requests.get(endpoint, 0) + 1
+        if status >= 400:
+            self.__errors[endpoint] = self.__errors.get(endpoint, 0) + 1
+
+    @staticmethod
+    def __percentile(ordered, fraction):
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+    def as_dict(self):
+        endpoints = {}
+        for endpoint, latencies in self.__latencies.items():
+            ordered = sorted(latencies)
+            endpoints[endpoint] = {
+                'requests': self.__requests[endpoint],
+                'errors': self.__errors.get(endpoint, 0),
+                'mean': sum(ordered) / len(ordered),
+                'p50': Metrics.__percentile(ordered, 0.5),
+                'p95': Metrics.__percentile(ordered, 0.95),
+                'p99': Metrics.__percentile(ordered, 0.99),
+                'max': ordered[-1],
+            }
+        return {'endpoints': endpoints, **self.counters}
+
+
+class Game(object):
+    """
+    A hosted game: the authoritative Cluedo instance, which only ever solves in the workers, and the
+    results and solves in flight of each solve mode.
+    """
+
+    def __init__(self, cluedo):
+        self.cluedo = cluedo
+        self.version = 0  # the number of turns added through the service, which tags the results
+        self.results = {}  # mode -> (version, result) of the last complete solve
+        self.solves = {}  # mode -> (version, future) of the solve in flight
+
+
+class GameService(object):
+    """
+    The games and the solve queue behind the HTTP endpoints (see serve()).
+    """
+
+    # the time budget of a query that does not give one, and the largest budget allowed, in seconds
+    DefaultTimeLimit = 5.0
+    MaxTimeLimit = 60.0
+
+    # the shortest time limit a solve is given, even once the budget of its query is spent waiting
+    MinTimeLimit = 0.05
+
+    # extra seconds a query waits past its budget, for the worker to return the result
+    Grace = 1.0
+
+    def __init__(self, num_workers=2, max_queue=64):
+        """
+        @param: num_workers The number of worker processes the solves run in.
+        @param: max_queue The maximum number of solves queued or running at once.
+        """
+        self.__num_workers = num_workers
+        self.__max_queue = max_queue
+        self.__games = {}
+        self.__queue_depth = 0
+        self.metrics = Metrics()
+
+    @property
+    def queue_depth(self):
+        return self.__queue_depth
+
+    def game(self, game_id):
+        """
+        @raise: KeyError if there is no game <game_id>.
+        """
+        if game_id not in self.__games:
+            raise KeyError(f"no game {game_id!r}")
+        return self.__games[game_id]
+
+    def create_game(self, players_spec=None, deck='classic', session=None, game_id=None):
+        """
+        @param: session A snapshot to restore the game from, instead of a players specification.
+        @return: the id of the new game.
+        """
+        if session is not None:
+            cluedo, _ = sessions.restore(session)
+        elif players_spec:
+            cluedo = Cluedo([tuple(player) for player in players_spec], deck=deck)
+        else:
+            raise ValueError("a game needs players or a session")
+        game_id = uuid.uuid4().hex[:12] if game_id is None else str(game_id)
+        if game_id in self.__games:
+            raise ValueError(f"game {game_id!r} already exists")
+        self.__games[game_id] = Game(cluedo)
+        return game_id
+
+    def delete_game(self, game_id):
+        self.game(game_id)
+        del self.__games[game_id]
+
+    def add_turn(self, game_id, turn):
+        """
+        @param: turn Either the arguments of Cluedo.add_turn(), or a turn history row under 'row'.
+        @return: the index of the turn.
+        """
+        game = self.game(game_id)
+        if 'row' in turn:
+            player_name, kind, *items = turn['row']
+            if player_name not in game.cluedo.player_names:
+                raise ValueError(f"{player_name!r} is not a player")
+            turn_index = game.cluedo.begin_turn(json.dumps(turn['row']))
+            try:
+                game.cluedo.add_observation(player_name, kind, items)
+            except Exception:
+                game.cluedo.undo()
+                raise
+        else:
+            if 'suggester' not in turn or 'suggestion' not in turn:
+                raise ValueError("a turn needs a suggester and a suggestion, or a turn history row")
+            turn_index = game.cluedo.add_turn(turn['suggester'], turn['suggestion'], turn.get('passers', []),
+                                              turn.get('refuter'), turn.get('shown_card'), turn.get('label'))
+        game.version += 1
+        return turn_index
+
+    async def solve(self, game_id, mode=Cluedo.Backbone, time_limit=None):
+        """
+        Solve a game, or wait for the solve of the same board and mode already in flight, or reuse the
+        last complete result if no turn was added since.
+        @param: time_limit The time budget of the query, in seconds, up to MaxTimeLimit.
+        @return: the result of the solve, as returned by solve_game().
+        @raise: Overloaded if the solve queue is full; TimeoutError if the budget is spent.
+        """
+        if mode not in (Cluedo.Backbone, Cluedo.Count, Cluedo.Sample, Cluedo.Enumerate):
+            raise ValueError(f"unknown solve mode {mode!r}")
+        budget = min(GameService.DefaultTimeLimit if time_limit is None else float(time_limit),
+                     GameService.MaxTimeLimit)
+        game = self.game(game_id)
+        version, result = game.results.get(mode, (None, None))
+        if version == game.version:
+            self.metrics.counters['reused'] += 1
+            return result
+
+        version, future = game.solves.get(mode, (None, None))
+        if version == game.version:
+            self.metrics.counters['coalesced'] += 1
+        else:
+            if self.__queue_depth >= self.__max_queue:
+                self.metrics.counters['rejected'] += 1
+                raise Overloaded(f"{self.__queue_depth} solves are queued")
+            self.__queue_depth += 1
+            self.metrics.counters['solves'] += 1
+            future = asyncio.ensure_future(self.__run_solve(game, mode, time.time() + budget))
+            # (the error of a solve every query gave up on is only counted, in failures)
+            future.add_done_callback(lambda done: done.cancelled() or done.exception())
+            game.solves[mode] = (game.version, future)
+        try:
+            # (shielded, so that a query giving up does not cancel the solve the others wait for)
+            return await asyncio.wait_for(asyncio.shield(future), budget + GameService.Grace)
+        except asyncio.TimeoutError:
+            self.metrics.counters['timeouts'] += 1
+            raise TimeoutError(f"the solve did not finish within its {budget:g}s budget") from None
+
+    async def __run_solve(self, game, mode, deadline):
+        version = game.version
+        state = game.cluedo.state()
+        loop = asyncio.get_running_loop()
+        try:
+            try:
+                solved_state, result = await loop.run_in_executor(worker_pool(self.__num_workers), solve_game,
+                                                                  state, mode, deadline)
+            except BrokenProcessPool:
+                # a worker died: start a new pool, and run the solve in it once more
+                discard_worker_pool(self.__num_workers)
+                solved_state, result = await loop.run_in_executor(worker_pool(self.__num_workers), solve_game,
+                                                                  state, mode, deadline)
+        except Exception:
+            self.metrics.counters['failures'] += 1
+            raise
+        finally:
+            self.__queue_depth -= 1
+            if game.solves.get(mode, (None,))[0] == version:
+                del game.solves[mode]
+        if game.version == version:
+            # keep the deductions and solutions of the solve for the next ones, and reuse its results
+            game.cluedo = Cluedo.from_state(solved_state)
+            if result['complete']:
+                game.results[mode] = (version, result)
+        return result
+
+    async def handle(self, method, path, query, body):
+        """
+        Answer a request.
+        @return: a (status, JSON-serializable response) tuple.
+        """
+        if not isinstance(body, dict):
+            raise ValueError("the request body must be a JSON object")
+        parts = [part for part in path.split('/') if part]
+        option = {name: values[-1] for name, values in query.items()}
+        if parts == ['metrics'] and method == 'GET':
+            return 200, dict(self.metrics.as_dict(), queue_depth=self.__queue_depth, max_queue=self.__max_queue,
+                             games=len(self.__games))
+        if parts == ['games'] and method == 'POST':
+            game_id = self.create_game(body.get('players'), body.get('deck', 'classic'), body.get('session'),
+                                       body.get('id'))
+            return 201, {'id': game_id}
+        if len(parts) == 2 and parts[0] == 'games':
+            game = self.game(parts[1])
+            if method == 'GET':
+                return 200, {'players': [list(player) for player in game.cluedo.state()['players_spec']],
+                             'deck': game.cluedo.deck.name, 'turns': len(game.cluedo.turns)}
+            if method == 'DELETE':
+                self.delete_game(parts[1])
+                return 200, {'id': parts[1]}
+        if len(parts) == 3 and parts[0] == 'games':
+            if parts[2] == 'turns' and method == 'POST':
+                return 201, {'turn': self.add_turn(parts[1], body)}
+            if parts[2] in ('deductions', 'probabilities') and method == 'GET':
+                default_mode = Cluedo.Backbone if parts[2] == 'deductions' else Cluedo.Count
+                result = await self.solve(parts[1], option.get('mode', default_mode), option.get('time_limit'))
+                fields = ['mode', 'complete', 'infeasible', 'solutions', 'solve_time',
+                          'players' if parts[2] == 'deductions' else 'probabilities']
+                return 200, {field: result[field] for field in fields}
+            if parts[2] == 'session' and method == 'GET':
+                return 200, sessions.snapshot(self.game(parts[1]).cluedo)
+        return 404, {'error': f"no endpoint {method} {path}"}
+
+
+# the error statuses of the exceptions raised while handling a request
+ErrorStatuses = ((KeyError, 404), (Overloaded, 503), (TimeoutError, 504), (ValueError, 400), (TypeError, 400))
+
+# the largest request body accepted, in bytes
+MaxBodySize = 1 << 20
+
+
+async def respond(writer, status, response, keep_alive=True, headers=()):
+    data = json.dumps(response).encode()
+    reason = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large',
+              500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout'}.get(status, '')
+    lines = [f'HTTP/1.1 {status} {reason}', 'Content-Type: application/json', f'Content-Length: {len(data)}',
+             f"Connection: {'keep-alive' if keep_alive else 'close'}", *headers]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + data)
+    await writer.drain()
+
+
+async def handle_connection(service, reader, writer):
+    """
+    Serve the requests of one connection, which is kept alive between requests unless the client
+    asks otherwise.
+    """
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, target, version = request_line.decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+            length = int(headers.get('content-length', 0))
+            if length > MaxBodySize:
+                await respond(writer, 413, {'error': 'the request body is too large'}, keep_alive=False)
+                break
+            body = await reader.readexactly(length) if length else b''
+
+            start = time.perf_counter()
+            url = urlsplit(target)
+            extra_headers = ()
+            routed = True
+            try:
+                status, response = await service.handle(method, url.path, parse_qs(url.query),
+                                                        json.loads(body) if body else {})
+                routed = status != 404
+            except Exception as error:
+                status = next((status for kind, status in ErrorStatuses if isinstance(error, kind)), 500)
+                response = {'error': str(error.args[0]) if isinstance(error, KeyError) else str(error)}
+                if status == 503:
+                    extra_headers = ('Retry-After: 1',)
+            endpoint = method + ' ' + '/'.join('<id>' if index == 2 else part
+                                               for index, part in enumerate(url.path.split('/')))
+            service.metrics.record(endpoint if routed else 'unknown', time.perf_counter() - start, status)
+            await respond(writer, status, response, keep_alive, extra_headers)
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8080):
+    """
+    @return: the asyncio server answering the requests to <service> on <host>:<port> (0 for any free
+             port; see server.sockets).
+    """
+    return await asyncio.start_server(lambda reader, writer: handle_connection(service, reader, writer), host, port)
+
+
+async def request(host, port, method, path, body=None):
+    """
+    Send one request to the service, e.g. from a test or a load generator.
+    @return: a (status, JSON response) tuple.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        data = b'' if body is None else json.dumps(body).encode()
+        writer.write(f'{method} {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n'
+                     f'Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n'.encode() + data)
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            if name.strip().lower() == 'content-length':
+                length = int(value)
+        return status, json.loads(await reader.readexactly(length))
+    finally:
+        writer.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m cluedo.service', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=2, help='the number of solver processes')
+    parser.add_argument('--max-queue', type=int, default=64, help='the most solves queued or running at once')
+    args = parser.parse_args(argv)
+
+    async def run():
+        server = await serve(GameService(args.workers, args.max_queue), args.host, args.port)
+        print(f"serving on http://{args.host}:{server.sockets[0].getsockname()[1]}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Save a game to a file and restore it, e.g. across a notebook restart or onto another worker.
+
+A session file is JSON, gzip-compressed when its name ends in ".gz":
+
+    {"format": "cluedo-session", "version": 1,
+     "state": {...},
+     "history": [["Julie", "ALL_FALSE", "MR_GREEN", "ROPE", "HALL"], ...]}
+
+The state is Cluedo.state(results=True): the players specification, the constraint log with its
+turns, the deductions carried over between solves, and the results of the last solve. A restored game
+answers player(), players and probabilities() straight away, and solve() only runs a solver once the
+board changes. The history is the View's turn history, if any.
+
+A compressed session of a classic game is a few kilobytes, so that one can be kept per turn.
+"""
+from cluedo.solver import Cluedo
+import gzip
+import json
+
+Format = 'cluedo-session'
+
+# the version of the session format written; files of this version or older can be read
+Version = 1
+
+# number of the most recent witness solutions kept in a session, as hints for the next solves
+MaxWitnesses = 16
+
+
+def snapshot(cluedo, history=None):
+    """
+    @param: history The View's turn history, if any.
+    @return: a JSON-serializable snapshot of <cluedo> and its results.
+    """
+    state = cluedo.state(results=True)
+    state['witnesses'] = state['witnesses'][-MaxWitnesses:]
+    return {'format': Format, 'version': Version, 'state': state,
+            'history': None if history is None else [list(row) for row in history]}
+
+
+def restore(session, cache=None):
+    """
+    @param: session A snapshot, as returned by snapshot().
+    @param: cache An optional SolveCache for the restored game.
+    @return: a (Cluedo, history) tuple.
+    @raise: ValueError if <session> is not a snapshot, or is of a later version of the format.
+    """
+    if not isinstance(session, dict) or session.get('format') != Format:
+        raise ValueError("not a Cluedo session")
+    if session.get('version', 0) > Version:
+        raise ValueError(f"session format version {session['version']} is newer than the supported {Version}")
+    return Cluedo.from_state(session['state'], cache), session.get('history')
+
+
+def save(path, cluedo, history=None):
+    """
+    Write a snapshot of <cluedo> (see snapshot()) to the session file <path>.
+    """
+    data = json.dumps(snapshot(cluedo, history), separators=(',', ':')).encode()
+    with open(path, 'wb') as f:
+        f.write(gzip.compress(data) if str(path).endswith('.gz') else data)
+
+
+def load(path, cache=None):
+    """
+    @return: the (Cluedo, history) tuple restored from the session file <path> (see restore()).
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return restore(json.loads(data), cache)
@@ -1,45 +1,38 @@
-from ortools.sat.python import cp_model
+from cluedo.cache import SolveCache
+from cluedo.clauses import ClauseDatabase
+from cluedo.counting import DealCounter
+from cluedo.deck import CLASSIC, MASTER_DETECTIVE, Deck, Suspect, Weapon, Room, deck as registered_deck
+from cluedo.lazy import LazyModule
+from cluedo.propagation import Propagator
+from cluedo.recommend import SuggestionRanker
+from cluedo.sampling import DealSampler
+from cluedo.stats import SolveStats
+from cluedo.symmetry import Symmetries
 from collections import defaultdict
-from enum import Enum
+import atexit
+import functools
+import itertools
+import logging
+import random
+import sys
+import time
 
+# imported on first use, so that the solver can be imported (e.g. by a command-line tool) and can
+# answer boards settled by propagation or counting without paying for them
+cp_model = LazyModule('ortools.sat.python.cp_model')
+np = LazyModule('numpy')
 
-class Suspect(Enum):
-    """
-    The set of murder suspects.
-    """
-    MISS_SCARLET = 'MISS_SCARLET'
-    PROF_PLUM = 'PROF_PLUM'
-    MRS_PEACOCK = 'MRS_PEACOCK'
-    MR_GREEN = 'MR_GREEN'
-    COL_MUSTARD = 'COL_MUSTARD'
-    MRS_WHITE = 'MRS_WHITE'
-
-
-class Weapon(Enum):
-    """
-    The set of possible murder weapons.
-    """
-    CANDLESTICK = 'CANDLESTICK'
-    DAGGER = 'DAGGER'
-    LEAD_PIPE = 'LEAD_PIPE'
-    REVOLVER = 'REVOLVER'
-    ROPE = 'ROPE'
-    WRENCH = 'WRENCH'
+logger = logging.getLogger(__name__)
 
 
-class Room(Enum):
-    """
-    The set of locations where the murder may have occurred.
-    """
-    KITCHEN = 'KITCHEN'
-    BALLROOM = 'BALLROOM'
-    CONSERVATORY = 'CONSERVATORY'
-    DINING_ROOM = 'DINING_ROOM'
-    BILLIARD_ROOM = 'BILLIARD_ROOM'
-    LIBRARY = 'LIBRARY'
-    LOUNGE = 'LOUNGE'
-    HALL = 'HALL'
-    STUDY = 'STUDY'
+# the cards of the classic deck, in a fixed order that gives each card its ordinal in the variable
+# layout; games of other variants take their cards from their Deck
+CARD_TYPES = CLASSIC.card_types
+CARDS = CLASSIC.cards
+CARD_INDEX = CLASSIC.card_index
+NUM_CARDS = CLASSIC.num_cards
+CARD_VALUES = CLASSIC.card_values
+CARD_SLICES = CLASSIC.card_slices
 
 
 class Cluedo(object):
@@ -59,45 +52,24 @@ class Cluedo(object):
         # reserved name for the true murderer "player"
         Murderer = 'Murderer'
 
-        def __init__(self, name, num_cards, model):
+        def __init__(self, name, num_cards, model, deck=CLASSIC):
             self.__name = name
             self.__num_cards = num_cards
             self.__model = model
-            self.__variable_map = {}
+            self.__deck = deck
 
-            # add suspect variables
-            suspect_vars = {}
-            for s in list(Suspect):
-                var_name = "{}${}".format(name, s.value)
-                suspect_vars[var_name] = self.model.NewBoolVar(var_name)
-
-            # add weapon variables
-            weapon_vars = {}
-            for w in list(Weapon):
-                var_name = "{}${}".format(name, w.value)
-                weapon_vars[var_name] = self.model.NewBoolVar(var_name)
-
-            # add room variables
-            room_vars = {}
-            for r in list(Room):
-                var_name = "{}${}".format(name, r.value)
-                room_vars[var_name] = self.model.NewBoolVar(var_name)
-
-            # aggregate into a single collection
-            self.__variable_map.update(suspect_vars)
-            self.__variable_map.update(weapon_vars)
-            self.__variable_map.update(room_vars)
+            # add one variable per card, in card ordinal order
+            self.__variables = [self.model.NewBoolVar("{}${}".format(name, card.value)) for card in deck.cards]
 
             # add a constraint that there can only by <num_cards> true values for a given player
-            self.model.AddSumConstraint(self.__variable_map.values(), num_cards, num_cards)
+            self.model.Add(sum(self.__variables) == num_cards)
 
             # if this is the "murderer", then add another constraint that
             # there must be one and only one of each suspect, weapon, and room
             if self.name == Cluedo.Player.Murderer:
-                assert num_cards == 3
-                self.model.Add(sum(suspect_vars.values()) == 1)
-                self.model.Add(sum(weapon_vars.values()) == 1)
-                self.model.Add(sum(room_vars.values()) == 1)
+                assert num_cards == len(deck.card_types)
+                for card_type in deck.card_types:
+                    self.model.Add(sum(self.__variables[deck.card_slices[card_type]]) == 1)
 
         @property
         def name(self):
@@ -111,148 +83,1276 @@ class Cluedo(object):
         def model(self):
             return self.__model
 
+        @property
+        def variables(self):
+            """
+            @return: the player's variables, indexed by card ordinal.
+            """
+            return self.__variables
+
         @property
         def variable_map(self):
-            return self.__variable_map
+            return {"{}${}".format(self.name, card.value): var for card, var in zip(self.__deck.cards, self.__variables)}
 
-    class SolutionCollector(cp_model.CpSolverSolutionCallback):
+    class SolutionCollector(object):
         """
-        A callback class that stores intermediate solutions to the SAT solver.
-        Instances of this class can also be used to store "packed" representations
-        of solutions, where a packed representation is a variable mapped to the set of
+        A solution callback (see callback) that folds the solutions of the SAT solver into a "packed" representation
+        as they arrive, where a packed representation is a variable mapped to the set of
         possible values it can contain, after running the constraint solver.
 
         Each variable indicates whether it is known that a given player holds a given suspect,
         weapon, or room card. For example, if it is known that 'Will' holds the 'Kitchen' card,
         then variable 'Will$KITCHEN' will be set to True.
 
+        Rather than storing every solution, the collector keeps two bitsets over all the variables:
+        the variables seen set to 0 and the variables seen set to 1. Memory therefore stays constant
+        however many solutions there are, and the search is stopped as soon as every variable has
+        been seen with both values (or is fixed in the model), since no further solution can change
+        the packed result.
+
+        When <keep_solutions> is set, every solution is instead written as a bit-packed row of a
+        growable (solutions x variables) uint8 matrix, and the search runs to completion so that
+        the packed result and the per-variable marginals are vectorized reductions over the matrix.
+
+        When the model breaks <symmetries>, the solutions found are one representative per orbit;
+        the packed result is closed under the symmetries, and the marginals weigh each
+        representative by the size of its orbit.
         """
 
-        def __init__(self, variables):
-            cp_model.CpSolverSolutionCallback.__init__(self)
+        # initial number of rows of the solution matrix; it doubles whenever it fills up
+        InitialCapacity = 1024
+
+        # (the collector wraps a CP-SAT callback rather than being one, so that ortools is only
+        # imported once a search runs)
+
+        def __init__(self, variables, stop_when_packed=True, keep_solutions=False, fixed=0, player_names=None,
+                     symmetries=None, progress=None, cancel=None, deck=CLASSIC):
+            self.__callback = solution_callback_class()(self.NewSolution)
+            self.__deck = deck
+            self.__progress = progress  # called with Seen() after each solution
+            self.__cancel = cancel  # a threading.Event that stops the search once set
             self.__variables = variables
-            self.__solutions = []
+            self.__symmetries = symmetries if symmetries else None
+            self.__player_names = player_names  # the player names in variable layout order
+            self.__stop_when_packed = stop_when_packed and not keep_solutions
+            self.__fixed = fixed  # bitset of the variables fixed in the model, which can only take one value
+            self.__all = (1 << len(self.__variables)) - 1
+            self.__seen_zero = 0
+            self.__seen_one = 0
+            self.__solution_count = 0
+            self.__matrix = None
+            if keep_solutions:
+                row_bytes = (len(self.__variables) + 7) // 8
+                self.__matrix = np.zeros((Cluedo.SolutionCollector.InitialCapacity, row_bytes), dtype=np.uint8)
 
-        def Solutions(self):
-            return self.__solutions.copy()
+        @property
+        def callback(self):
+            """
+            @return: the CP-SAT solution callback to pass to the solver.
+            """
+            return self.__callback
 
-        def SolutionCount(self):
-            return len(self.__solutions)
+        def Value(self, variable):
+            return self.__callback.Value(variable)
 
-        def OnSolutionCallback(self):
-            pass
+        def StopSearch(self):
+            self.__callback.StopSearch()
+
+        def SolutionCount(self):
+            return self.__solution_count
 
         def NewSolution(self):
-            solution = {}
-            for key, value in self.__variables.items():
-                solution[key] = self.Value(value)
-            self.__solutions.append(solution)
+            self.__new_solution()
+            if self.__progress is not None:
+                self.__progress(self.Seen())
+            if self.__cancel is not None and self.__cancel.is_set():
+                self.StopSearch()
+
+        def __new_solution(self):
+            if self.__matrix is not None:
+                self.__store_solution()
+                return
+
+            ones = 0
+            for index, variable in enumerate(self.__variables):
+                if self.Value(variable):
+                    ones |= 1 << index
+            self.__seen_one |= ones
+            self.__seen_zero |= self.__all & ~ones
+            self.__solution_count += 1
+            if self.__stop_when_packed:
+                seen_zero, seen_one = self.Seen()
+                if seen_zero & seen_one | self.__fixed == self.__all:
+                    self.StopSearch()
+
+        def __store_solution(self):
+            if self.__solution_count == len(self.__matrix):
+                grown = np.zeros((2 * len(self.__matrix), self.__matrix.shape[1]), dtype=np.uint8)
+                grown[:self.__solution_count] = self.__matrix
+                self.__matrix = grown
+            row = np.fromiter((self.Value(variable) for variable in self.__variables),
+                              dtype=np.uint8, count=len(self.__variables))
+            self.__matrix[self.__solution_count] = np.packbits(row, bitorder='little')
+            self.__solution_count += 1
+
+        def Solutions(self):
+            """
+            @return: a (solutions x variables) uint8 matrix of every solution found (of every
+                     representative, if the model breaks symmetries), or None if the collector does
+                     not keep solutions.
+            """
+            if self.__matrix is None:
+                return None
+            return np.unpackbits(self.__matrix[:self.__solution_count], axis=1,
+                                 count=len(self.__variables), bitorder='little')
+
+        def Seen(self):
+            """
+            @return: a (seen_zero, seen_one) tuple of bitsets over the variable indices.
+            """
+            if self.__matrix is None:
+                seen = self.__seen_zero, self.__seen_one
+            else:
+                rows = self.__matrix[:self.__solution_count]
+                seen_one = np.bitwise_or.reduce(rows, axis=0) if len(rows) else np.zeros(rows.shape[1], np.uint8)
+                seen_zero = np.bitwise_or.reduce(~rows, axis=0) if len(rows) else seen_one
+                seen = (int.from_bytes(seen_zero.tobytes(), 'little') & self.__all,
+                        int.from_bytes(seen_one.tobytes(), 'little') & self.__all)
+            if self.__symmetries is None:
+                return seen
+            return tuple(self.__symmetries.expand(bits) for bits in seen)
+
+        def Domains(self):
+            """
+            @return: the set of values seen in the solutions so far, indexed by variable.
+            """
+            return [{value for value, seen in enumerate(self.Seen()) if seen >> index & 1}
+                    for index in range(len(self.__variables))]
 
         def PackedSolutions(self, player_name):
-            ret_val = {}
-            ret_val[Suspect] = defaultdict(set)
-            ret_val[Weapon] = defaultdict(set)
-            ret_val[Room] = defaultdict(set)
-
-            suspects = list(Suspect).copy()
-            weapons = list(Weapon).copy()
-            rooms = list(Room).copy()
-
-            for sol in self.Solutions():
-                for key, value in sol.items():
-                    for s in suspects:
-                        if key == f"{player_name}${s.value}":
-                            ret_val[Suspect][s.value].add(value)
-                    for w in weapons:
-                        if key == f"{player_name}${w.value}":
-                            ret_val[Weapon][w.value].add(value)
-                    for r in rooms:
-                        if key == f"{player_name}${r.value}":
-                            ret_val[Room][r.value].add(value)
-                remove_suspects = [s for s in suspects if len(ret_val[Suspect][s.value]) > 1]
-                suspects = [s for s in suspects if s not in remove_suspects]
-                remove_weapons = [w for w in weapons if len(ret_val[Weapon][w.value]) > 1]
-                weapons = [w for w in weapons if w not in remove_weapons]
-                remove_rooms = [r for r in rooms if len(ret_val[Room][r.value]) > 1]
-                rooms = [r for r in rooms if not r in remove_rooms]
-                if not (suspects) and not (weapons) and not (rooms):
-                    break
-
-            return ret_val
-
-    def __init__(self, players_spec):
+            """
+            @return: the packed solutions of player <player_name>, as returned by Cluedo.player().
+            """
+            return Cluedo.pack(self.Seen(), self.__player_names.index(player_name), self.__deck)
+
+        def Marginals(self):
+            """
+            @return: the fraction of the solutions found in which each variable is set to 1, indexed
+                     by variable, or None if the collector does not keep solutions.
+            """
+            if self.__matrix is None or not self.__solution_count:
+                return None
+            if self.__symmetries is None:
+                return self.Solutions().sum(axis=0, dtype=np.int64) / self.__solution_count
+            _, marginals = self.__symmetries.weigh(self.Solutions(), len(self.__player_names))
+            return marginals.reshape(-1)
+
+        def DealCount(self):
+            """
+            @return: the number of deals the solutions found stand for: the number of solutions, or
+                     the total size of their orbits if the model breaks symmetries. None if the
+                     collector does not keep solutions.
+            """
+            if self.__matrix is None:
+                return None
+            if self.__symmetries is None:
+                return self.__solution_count
+            weights, _ = self.__symmetries.weigh(self.Solutions(), len(self.__player_names))
+            return int(round(weights.sum()))
+
+    # solve modes
+    Enumerate = 'enumerate'
+    Backbone = 'backbone'
+    Count = 'count'
+    Sample = 'sample'
+
+    # observation kinds, as entered in a turn history
+    SomeTrue = 'SOME_TRUE'  # the player holds at least one of the cards
+    AllFalse = 'ALL_FALSE'  # the player holds none of the cards
+
+    # maximum number of solutions kept between solves for reuse as witnesses
+    MaxWitnesses = 256
+
+    # number of deals sampled in sample mode when there is neither a number of samples nor a time limit
+    DefaultSamples = 10000
+
+    # the default number of seconds recommend() spends drawing the deals it ranks the suggestions over
+    RecommendTimeLimit = 5.0
+
+    def __init__(self, players_spec, cache=None, deck=CLASSIC):
         """
         Initialize the Cluedo game instance.
         @param: players_spec A specification of each player name along with the number of cards she holds.
+        @param: cache An optional SolveCache of solve results, which may be shared between games.
+        @param: deck The Deck of the variant played, or the name of a registered one.
         """
+        self.__deck = registered_deck(deck) if isinstance(deck, str) else deck
+        if len(players_spec) > self.__deck.max_players:
+            raise ValueError(f"the {self.__deck.name} deck is for at most {self.__deck.max_players} players")
         self.__players_spec = players_spec
-        self.__model = cp_model.CpModel()
+        self.__cache = cache
+        self.__stats = SolveStats(None)  # the stats of the last solve
+        self.__solve_callbacks = []
+        self.__player_names = [Cluedo.Player.Murderer] + [name for name, _ in players_spec]
+        self.__player_index = {name: index for index, name in enumerate(self.__player_names)}
+        self.__constraints = []  # log of (kind, player index, card indices, value) tuples added so far
+        # the constraints of the log in simplified form, from which the models and counters are built
+        self.__clause_db = ClauseDatabase()
+        self.__hand_sizes = [len(self.__deck.card_types)] + [card_count for _, card_count in players_spec]
+        self.__num_variables = len(self.__player_names) * self.__deck.num_cards
+        # turns begun with begin_turn(): the position of their first constraint in the log, and a
+        # checkpoint of the deductions and results known when they began
+        self.__turns = []
         self.__solver = None
         self.__solution_collector = None
-        self.__players = {}  # dictionary from name -> Player instance
+        self.__seen = None  # (seen_zero, seen_one) bitsets over the variable indices, set by solve()
+        self.__marginals = None  # (players x cards) array of ownership probabilities, set by solve()
+        self.__intervals = None  # (players x cards) array of the confidence half-widths of sampled marginals
+        self.__complete = False  # whether the last solve ran to completion, rather than timing out
+        # the (cache key, number of solutions) of the board the results are complete for, so that the
+        # results are reused until the board changes
+        self.__result = None
+        # deductions carried over between solves: since constraints are only ever added, a variable
+        # proven to take a single value stays proven, and a model proven infeasible stays infeasible
+        self.__facts = (0, 0)  # (mask, values) bitsets of the variables proven to take a single value
+        self.__infeasible = False
+        self.__witnesses = []  # bitsets of the variables set to 1 in the solutions found so far
+        # the SuggestionRanker of the last recommendation, with the constraints and sampling it was made for
+        self.__ranker = None
+        # the deal counts of every Murderer's hand, with the constraints they were counted for
+        self.__murderer_counts = None
+        # the model of the simplified constraints, built on first use after they change
+        self.__model, self.__players, self.__variables, self.__variable_map = None, None, None, None
+        # the [model, variables, facts fixed] the satisfiability checks share, built on first use after
+        # the constraints change
+        self.__checks = None
+
+    def __ensure_model(self):
+        if self.__model is None:
+            self.__model, self.__players, self.__variables = self.__build_model()
+            self.__variable_map = {}
+            for player in self.__players.values():
+                self.__variable_map.update(player.variable_map)
+
+    def __build_model(self):
+        """
+        Build a fresh CP-SAT model from the players specification and the constraints added so far,
+        in their simplified form (see clauses.ClauseDatabase).
+        @return: a (model, players, variables) tuple, where variables is the flat list of every
+                 player's variables, indexed by Cluedo.index().
+        """
+        model = cp_model.CpModel()
+        players = {}  # dictionary from name -> Player instance
 
         # initialize the Murderer Player
-        self.__players[Cluedo.Player.Murderer] = Cluedo.Player(Cluedo.Player.Murderer, 3, self.model)
+        players[Cluedo.Player.Murderer] = Cluedo.Player(Cluedo.Player.Murderer, len(self.__deck.card_types), model,
+                                                        self.__deck)
 
         # initialize the other Players
         for name, card_count in self.__players_spec:
-            self.__players[name] = Cluedo.Player(name, card_count, self.model)
+            players[name] = Cluedo.Player(name, card_count, model, self.__deck)
 
         # put all the variables into a single collection
-        self.__variable_map = {}
-        self.__variable_map.update(self.__players[Cluedo.Player.Murderer].variable_map)
-        for name, player in self.__players.items():
-            self.__variable_map.update(player.variable_map)
+        variables = [var for name in self.__player_names for var in players[name].variables]
+
+        # Add constraint that exactly one player can have a particular card. (A parity constraint
+        # admits the same solutions, given the hand sizes, but is much harder to refute.)
+        num_cards = self.__deck.num_cards
+        for card_index in range(num_cards):
+            model.Add(sum(variables[card_index::num_cards]) == 1)
 
-        # Add constraint that at most one player can have a particular card
-        pvar_maps = [p.variable_map for p in list(self.__players.values())]
-        pvars = [list(vm.values()) for vm in pvar_maps]
-        for v in zip(*pvars):
-            self.__model.AddBoolXOr(v)
+        for constraint in self.__clause_db.constraints():
+            Cluedo.__apply_constraint(model, variables, constraint, num_cards)
+
+        return model, players, variables
+
+    @staticmethod
+    def __apply_constraint(model, variables, constraint, num_cards):
+        kind, player_index, card_indices, value = constraint
+        constraint_vars = [variables[player_index * num_cards + card_index] for card_index in card_indices]
+        if kind == 'or':
+            model.AddBoolOr(constraint_vars)
+        else:
+            model.Add(constraint_vars[0] == value)
+
+    def index(self, player_name, item):
+        """
+        @return: the index of the variable for player <player_name> holding card <item>.
+        """
+        return self.__player_index[player_name] * self.__deck.num_cards + self.__deck.card_index[item]
 
     def add_constraint(self, player_name, item, value=True):
-        self.model.Add(self.variable_map[f"{player_name}${item.value}"] == value)
+        self.__add(('eq', self.__player_index[player_name], (self.__deck.card_index[item],), int(value)))
 
     def add_or_constraint(self, player_name, items):
-        constraint_vars = []
-        for item in items:
-            constraint_vars.append(self.variable_map[f"{player_name}${item.value}"])
-        self.model.AddBoolOr(constraint_vars)
+        self.__add(('or', self.__player_index[player_name], tuple(self.__deck.card_index[item] for item in items), 1))
+
+    def add_observation(self, player_name, kind, items):
+        """
+        Add what a turn history row says about a player.
+        @param: kind Either Cluedo.SomeTrue, if the player holds at least one of the cards, or
+                Cluedo.AllFalse, if the player holds none of them.
+        @param: items The cards, as Suspect/Weapon/Room members or their values.
+        """
+        items = [self.__deck.card(item) for item in items]
+        if kind == Cluedo.SomeTrue:
+            if len(items) == 1:
+                self.add_constraint(player_name, items[0])
+            else:
+                self.add_or_constraint(player_name, items)
+        elif kind == Cluedo.AllFalse:
+            for item in items:
+                self.add_constraint(player_name, item, False)
+        else:
+            raise ValueError(f"unknown observation kind {kind!r}")
+
+    def add_turn(self, suggester, suggestion, passers, refuter=None, shown_card=None, label=None):
+        """
+        Add a whole suggestion round as a new turn (see begin_turn()): the players who pass hold none of
+        the suggested cards, and the refuter holds the card shown, or at least one of the suggested
+        cards if the card was not seen. The constraints are simplified as they are added (see
+        clause_database), so that what the round tells is only kept where it is not already known.
+        @param: suggester The name of the player who made the suggestion.
+        @param: suggestion The suggested cards, as Suspect/Weapon/Room members or their values.
+        @param: passers The names of the players who could not refute the suggestion.
+        @param: refuter The name of the player who refuted the suggestion, if anybody did.
+        @param: shown_card The card the refuter showed, if it was seen.
+        @param: label A description of the turn; by default, the suggestion.
+        @return: the index of the turn.
+        """
+        suggestion = list(dict.fromkeys(self.__deck.card(item) for item in suggestion))
+        shown_card = None if shown_card is None else self.__deck.card(shown_card)
+        for name in [suggester] + list(passers) + ([] if refuter is None else [refuter]):
+            if self.__player_index.get(name, 0) == 0:
+                raise ValueError(f"{name!r} is not a player")
+        if refuter is not None and (refuter == suggester or refuter in passers):
+            raise ValueError(f"{refuter!r} cannot both refute the suggestion and pass or make it")
+        if suggester in passers:
+            raise ValueError(f"{suggester!r} cannot pass on their own suggestion")
+        if shown_card is not None and (refuter is None or shown_card not in suggestion):
+            raise ValueError(f"{shown_card} cannot be shown for this suggestion")
+
+        turn_index = self.begin_turn(label if label is not None else
+                                     f"{suggester}: " + ", ".join(card.value for card in suggestion))
+        for name in passers:
+            self.add_observation(name, Cluedo.AllFalse, suggestion)
+        if refuter is not None:
+            self.add_observation(refuter, Cluedo.SomeTrue, suggestion if shown_card is None else [shown_card])
+        return turn_index
+
+    def __add(self, constraint):
+        self.__constraints.append(constraint)
+        if self.__clause_db.add(constraint):
+            # (the model is rebuilt rather than added to, since simplifying may drop constraints from it)
+            self.__model = None
+            self.__checks = None
+
+    def begin_turn(self, label=None):
+        """
+        Start a new turn: the constraints added from now on, up to the next call, make up the turn,
+        which can then be undone or edited. A checkpoint of what is known when the turn begins is kept
+        with it, so that undoing the turn restores the deductions and results of the earlier turns
+        without solving again.
+        @param: label A description of the turn, e.g. as entered by the user.
+        @return: the index of the turn.
+        """
+        self.__turns.append({
+            'label': label,
+            'start': len(self.__constraints),
+            'facts': self.__facts,
+            'infeasible': self.__infeasible,
+            'seen': self.__seen,
+            'marginals': self.__marginals,
+            'intervals': self.__intervals,
+            'complete': self.__complete,
+            'result': self.__result,
+            'clause_db': self.__clause_db.copy(),
+        })
+        return len(self.__turns) - 1
+
+    @property
+    def turns(self):
+        """
+        @return: the turns begun so far, as (label, constraints) tuples.
+        """
+        ends = [turn['start'] for turn in self.__turns[1:]] + [len(self.__constraints)]
+        return [(turn['label'], self.__constraints[turn['start']:end]) for turn, end in zip(self.__turns, ends)]
+
+    def undo(self, num_turns=1):
+        """
+        Remove the last <num_turns> turns and their constraints, and go back to what was known when the
+        first of them began. The solutions found since remain valid witnesses of the smaller set of
+        constraints, and are kept.
+        @return: the turns removed, as (label, constraints) tuples, which can be passed to replay().
+        """
+        if not 0 < num_turns <= len(self.__turns):
+            raise ValueError(f"cannot undo {num_turns} of {len(self.__turns)} turns")
+        removed = self.turns[-num_turns:]
+        checkpoint = self.__turns[-num_turns]
+        del self.__turns[-num_turns:]
+        del self.__constraints[checkpoint['start']:]
+        self.__clause_db = checkpoint['clause_db']
+        self.__facts = checkpoint['facts']
+        self.__infeasible = checkpoint['infeasible']
+        self.__seen = checkpoint['seen']
+        self.__marginals = checkpoint['marginals']
+        self.__intervals = checkpoint['intervals']
+        self.__complete = checkpoint['complete']
+        self.__result = checkpoint['result']
+        self.__solver = None
+        self.__solution_collector = None
+        self.__model = None
+        self.__checks = None
+        return removed
+
+    def replay(self, turns):
+        """
+        Add turns, as returned by turns or undo().
+        """
+        for label, constraints in turns:
+            self.begin_turn(label)
+            for constraint in constraints:
+                self.__add(tuple(constraint))
+
+    def edit_turn(self, turn_index, add, label=None):
+        """
+        Replace the constraints of turn <turn_index>: the turns from it on are undone, <add>(cluedo) is
+        called to add the new constraints of the turn, and the later turns are replayed. The deductions
+        made before the turn are kept.
+        @param: add A callable that adds the constraints of the edited turn, e.g. with add_constraint().
+        @param: label The new label of the turn; by default, the label is kept.
+        """
+        removed = self.undo(len(self.__turns) - turn_index)
+        self.begin_turn(removed[0][0] if label is None else label)
+        add(self)
+        self.replay(removed[1:])
+
+    def solve(self, time_limit=None, mode=Enumerate, keep_solutions=False, incremental=True, propagate=True,
+              num_workers=1, break_symmetry=True, progress=None, cancel=None, num_samples=None):
+        """
+        Solve the model.
+        @param: time_limit The maximum number of seconds to spend solving.
+        @param: mode Either Cluedo.Enumerate, which enumerates every solution, Cluedo.Backbone,
+                which only runs the satisfiability checks needed to find the forced variables, or
+                Cluedo.Count, which counts the consistent deals exactly without enumerating them and
+                so also gives exact ownership probabilities. If counting does not finish within the
+                time limit, count mode falls back to backbone mode: there are then no probabilities,
+                and complete is False. Cluedo.Sample estimates the ownership probabilities from
+                deals sampled by a Markov chain (see sampling.DealSampler), within a fixed memory and
+                the time limit, for boards with too many deals to count in time: the estimates come
+                with confidence intervals (see confidence_intervals()), and the values seen in the
+                samples are possible but not proven to be the only ones, so complete is False.
+        @param: keep_solutions In enumerate mode, keep every solution in a solution matrix and run the
+                search to completion, so that ownership probabilities are available.
+        @param: incremental Reuse the deductions and the solutions of earlier solves rather than
+                starting from scratch, and the results of the last solve if the board has not changed.
+        @param: propagate Apply the simple card-ownership deductions (see propagation.Propagator)
+                before calling the solver, and skip the solver altogether if they settle the board.
+        @param: num_workers In backbone mode, the number of worker processes the feasibility checks are
+                spread across; the reference solution is searched with as many CP-SAT workers. Other
+                modes only run with one worker (CP-SAT enumerates solutions single-threaded, and
+                counting is pure Python), so a ValueError is raised for more.
+        @param: break_symmetry In enumerate mode, only enumerate one deal per orbit of interchangeable
+                players and cards (see Cluedo.symmetries()); results are still reported for every
+                player and card. With keep_solutions, only card symmetries are broken, since those
+                orbits can be weighed exactly.
+        @param: progress A callable called with (seen_zero, seen_one) bitsets as the solve proceeds. In
+                backbone mode, these are conservative: a variable is only shown with a single value once
+                it is proven. In enumerate mode, they are the values seen so far.
+        @param: cancel A threading.Event which, once set, stops the solve as if its time limit expired.
+        @param: num_samples In sample mode, the number of deals to sample, unless the time limit expires
+                first; with neither, Cluedo.DefaultSamples.
+        If the game has a cache, a board already solved the same way is answered from it without a
+        solver; solver and solution_collector are then None, and the packed result is available from
+        player(), players and domains().
+        @return: a SolveStats, whose solutions are the number of solutions examined; enumeration stops
+                 as soon as every variable has been seen with both values, unless solutions are kept,
+                 in which case it is the number of consistent deals (in backbone mode, the number of
+                 witness solutions; in count mode, the exact number of consistent deals; in sample
+                 mode, the number of deals sampled). The stats
+                 are also logged at debug level, and passed to the callbacks added with
+                 add_solve_callback().
+        """
+        if num_workers > 1 and mode != Cluedo.Backbone:
+            raise ValueError(f"num_workers > 1 is only supported in backbone mode, not in {mode} mode")
+
+        stats = self.__stats = SolveStats(mode, time_limit, len(self.__constraints))
+        start, start_cpu = time.perf_counter(), time.process_time()
+        key = SolveCache.key(self.__players_spec, self.__clause_db.constraints(), mode, keep_solutions, propagate,
+                             break_symmetry, self.__deck.signature())
+        entry = None
+        if incremental and self.__result is not None and self.__result[0] == key:
+            # the board has not changed since it was last solved (or restored, see from_state())
+            entry = self.__result[1], self.__seen, self.__marginals
+        elif self.__cache is not None:
+            entry = self.__cache.get(key)
+        if entry is not None:
+            num_solutions, self.__seen, marginals = entry
+            self.__marginals = None if marginals is None else np.array(marginals)
+            self.__intervals = None
+            self.__solver = None
+            self.__solution_collector = None
+            self.__complete = True
+            self.__result = key, num_solutions
+            stats.cached = True
+        else:
+            num_solutions = self.__solve(time_limit, mode, keep_solutions, incremental, propagate, num_workers,
+                                         break_symmetry, progress, cancel, num_samples)
+            self.__result = (key, num_solutions) if self.__complete else None
+            if self.__cache is not None and self.__complete:
+                marginals = None if self.__marginals is None else self.__marginals.tolist()
+                self.__cache.put(key, (num_solutions, self.__seen, marginals))
+
+        stats.wall_time = time.perf_counter() - start
+        stats.user_time = time.process_time() - start_cpu
+        stats.solutions = num_solutions
+        stats.complete = self.__complete
+        if self.__infeasible or self.__complete and not num_solutions:
+            stats.status = SolveStats.Infeasible
+        elif self.__complete:
+            stats.status = SolveStats.Optimal
+        elif num_solutions:
+            stats.status = SolveStats.Feasible
+        stats.num_variables = self.__num_variables
+        logger.debug("solve: %s", stats)
+        for callback in self.__solve_callbacks:
+            callback(self, stats)
+        return stats
+
+    def add_solve_callback(self, callback):
+        """
+        Call <callback>(cluedo, stats) after every solve, e.g. to export per-turn latency.
+        """
+        self.__solve_callbacks.append(callback)
+
+    def remove_solve_callback(self, callback):
+        self.__solve_callbacks.remove(callback)
+
+    def __solve(self, time_limit, mode, keep_solutions, incremental, propagate, num_workers, break_symmetry,
+                progress=None, cancel=None, num_samples=None):
+        self.__marginals = None
+        self.__intervals = None
+        self.__complete = True
+        fallback = False
+        if mode == Cluedo.Count:
+            deadline = time.time() + time_limit if time_limit else None
+            try:
+                return self.__solve_count(deadline, cancel)
+            except TimeoutError:
+                # too many states to count in time: fall back to the forced variables alone
+                fallback = True
+                mode = Cluedo.Backbone
+                # (the count used up the budget, so the backbone gets a tenth of it again on top)
+                if time_limit:
+                    time_limit = max(deadline - time.time(), 0.0) + 0.1 * time_limit
+
+        if not incremental:
+            self.__facts, self.__infeasible, self.__witnesses = (0, 0), False, []
+        if propagate:
+            propagator = self.propagator()
+            if not propagator.consistent:
+                self.__infeasible = True
+                self.__seen = (0, 0)
+                return 0
+            fact_mask, fact_values = propagator.facts()
+            self.__facts = (self.__facts[0] | fact_mask, self.__facts[1] | fact_values)
+            if propagator.settled:
+                self.__solver = None
+                self.__solution_collector = None
+                self.__seen = (fact_mask & ~fact_values, fact_values)
+                self.__stats.propagated = True
+                if keep_solutions or mode == Cluedo.Sample:
+                    values = [fact_values >> index & 1 for index in range(self.__num_variables)]
+                    self.__marginals = np.array(values, dtype=float).reshape(len(self.__player_names), self.__deck.num_cards)
+                self.__complete = not fallback
+                return 1
+
+        if mode == Cluedo.Sample:
+            return self.__solve_sample(time_limit, num_samples, cancel)
+
+        if mode == Cluedo.Backbone:
+            num_solutions = self.__solve_backbone(time_limit, num_workers, progress, cancel)
+            # a count that fell back to the backbone did not produce what was asked for
+            self.__complete = self.__complete and not fallback
+            return num_solutions
 
-    def solve(self, time_limit=None):
         # create the solver and solve the problem
         self.__solver = cp_model.CpSolver()
         if time_limit:
             # Sets a time limit of 10 seconds",
             self.__solver.parameters.max_time_in_seconds = time_limit
 
-        self.__solution_collector = Cluedo.SolutionCollector(self.variable_map)
-        status = self.__solver.SearchForAllSolutions(self.__model, self.__solution_collector)
+        model, variables = self.__fact_model()
+        symmetries = self.symmetries(players=not keep_solutions) if break_symmetry else None
+        if symmetries:
+            symmetries.add_constraints(model, variables, len(self.__player_names))
+        self.__solution_collector = Cluedo.SolutionCollector(variables, keep_solutions=keep_solutions,
+                                                             fixed=self.__facts[0],
+                                                             player_names=self.__player_names,
+                                                             symmetries=symmetries, progress=progress,
+                                                             cancel=cancel, deck=self.__deck)
+        status = self.__solver.SearchForAllSolutions(model, self.__solution_collector.callback)
+        self.__stats.add_search(self.__solver, status)
+        self.__seen = self.__solution_collector.Seen()
+        self.__infeasible = status == cp_model.INFEASIBLE
+        everything = (1 << len(variables)) - 1
+        cancelled = cancel is not None and cancel.is_set()
+        self.__complete = status in (cp_model.OPTIMAL, cp_model.INFEASIBLE) and not cancelled or \
+            not keep_solutions and self.__seen[0] & self.__seen[1] | self.__facts[0] == everything
+        marginals = self.__solution_collector.Marginals()
+        if marginals is not None:
+            self.__marginals = marginals.reshape(len(self.__player_names), self.__deck.num_cards)
+        if keep_solutions:
+            return self.__solution_collector.DealCount()
         return self.__solution_collector.SolutionCount()
 
+    def __fact_model(self):
+        """
+        @return: a (model, variables) tuple for a fresh model in which the variables already proven
+                 are fixed.
+        """
+        model, _, variables = self.__build_model()
+        fact_mask, fact_values = self.__facts
+        for i, var in enumerate(variables):
+            if fact_mask >> i & 1:
+                model.Add(var == (fact_values >> i & 1))
+        self.__stats.num_model_constraints = len(model.Proto().constraints)
+        return model, variables
+
+    def propagator(self):
+        """
+        @return: a Propagator over the players specification and the constraints added so far.
+        """
+        return Propagator(self.__hand_sizes, self.__deck.category_sizes, self.__clause_db.constraints())
+
+    def symmetries(self, players=True, cards=True):
+        """
+        @param: players, cards Which kinds of symmetry to look for.
+        @return: the Symmetries of the board: the players with the same hand size, and the cards of
+                 the same category, that no constraint added so far mentions.
+        """
+        return Symmetries.find(self.__hand_sizes, self.__deck.category_sizes, self.__clause_db.constraints(),
+                               players=players, cards=cards)
+
+    def __check_model(self):
+        """
+        @return: a (model, variables) tuple for the model the satisfiability checks share. It is built
+                 once for the constraints added so far, and the variables already proven are fixed
+                 through their domains, so that a check only has to fix the variable it checks.
+        """
+        if self.__checks is None:
+            model, _, variables = self.__build_model()
+            self.__checks = [model, variables, (0, 0)]
+        model, variables, fixed = self.__checks
+        if fixed != self.__facts:
+            for index, var in enumerate(variables):
+                set_domain(model, var, *self.__fact_domain(index))
+            self.__checks[2] = self.__facts
+        self.__stats.num_model_constraints = len(model.Proto().constraints)
+        return model, variables
+
+    def __fact_domain(self, index):
+        """
+        @return: the (low, high) domain of variable <index>: its value if it is proven, else (0, 1).
+        """
+        fact_mask, fact_values = self.__facts
+        if fact_mask >> index & 1:
+            return (fact_values >> index & 1,) * 2
+        return 0, 1
+
+    def __witness(self, time_limit, index=None, value=None, num_search_workers=1):
+        """
+        Find a single solution, optionally with variable <index> fixed to <value>. The variables
+        already proven are fixed in the model, and the last solution found is given as a hint.
+        The solver runs <num_search_workers> parallel search workers where CP-SAT supports them.
+        @return: a (status, bits) tuple, where bits is the bitset of variables set to 1 in the
+                 solution, or None if there is no such solution (or the time limit expired before
+                 one was found).
+        """
+        model, variables = self.__check_model()
+        if index is not None:
+            set_domain(model, variables[index], value, value)
+        model.ClearHints()
+        if self.__witnesses:
+            for i, var in enumerate(variables):
+                model.AddHint(var, self.__witnesses[-1] >> i & 1)
+
+        self.__solver = cp_model.CpSolver()
+        if time_limit is not None:
+            self.__solver.parameters.max_time_in_seconds = max(time_limit, 0.0)
+        set_search_workers(self.__solver.parameters, num_search_workers)
+        set_check_parameters(self.__solver.parameters)
+        try:
+            status = self.__solver.Solve(model)
+        finally:
+            if index is not None:
+                set_domain(model, variables[index], *self.__fact_domain(index))
+        self.__stats.add_search(self.__solver, status)
+        if status not in (cp_model.FEASIBLE, cp_model.OPTIMAL):
+            return status, None
+        ones = 0
+        for i, var in enumerate(variables):
+            if self.__solver.Value(var):
+                ones |= 1 << i
+        self.__witnesses.append(ones)
+        del self.__witnesses[:-Cluedo.MaxWitnesses]
+        return status, ones
+
+    def __satisfies(self, bits):
+        """
+        @return: whether the assignment <bits> satisfies every constraint added so far. (The hand
+                 and card constraints hold for any solution of an earlier version of the model.)
+        """
+        for kind, player_index, card_indices, value in self.__clause_db.constraints():
+            held = [bits >> (player_index * self.__deck.num_cards + card_index) & 1 for card_index in card_indices]
+            if kind == 'or' and not any(held):
+                return False
+            if kind == 'eq' and held[0] != value:
+                return False
+        return True
+
+    def __reference_witness(self, time_limit, num_workers=1, cancel=None):
+        """
+        @return: a solution that satisfies every constraint added so far: the last such witness kept
+                 from earlier solves, or else a new one, or None if there is none (the model is then
+                 marked infeasible) or none was found in time.
+        """
+        self.__witnesses = [witness for witness in self.__witnesses if self.__satisfies(witness)]
+        if self.__witnesses:
+            return self.__witnesses[-1]
+        if cancel is not None and cancel.is_set():
+            return None
+        status, reference = self.__witness(time_limit, num_search_workers=num_workers)
+        self.__infeasible = reference is None and status == cp_model.INFEASIBLE
+        return reference
+
+    def deal_sampler(self, witness, rng=None):
+        """
+        @param: witness The bitset of the variables set to 1 in a solution, to start sampling from.
+        @return: a DealSampler over the players specification and the constraints added so far.
+        """
+        num_cards = self.__deck.num_cards
+        deal = [next(holder for holder in range(len(self.__player_names)) if witness >> holder * num_cards + card & 1)
+                for card in range(num_cards)]
+        return DealSampler(self.__hand_sizes, self.__deck.category_sizes, self.__clause_db.constraints(), deal, rng)
+
+    def __solve_sample(self, time_limit, num_samples=None, cancel=None):
+        """
+        Estimate the ownership probabilities from deals sampled by a Markov chain started from a
+        solution, until <num_samples> deals are sampled or the time limit expires.
+        """
+        deadline = time.time() + time_limit if time_limit else None
+        self.__solver = None
+        self.__solution_collector = None
+        self.__complete = False
+        reference = None if self.__infeasible else self.__reference_witness(time_limit, cancel=cancel)
+        if reference is None:
+            self.__complete = self.__infeasible
+            self.__seen = (0, 0) if self.__infeasible else self.__seen_from_facts()
+            return 0
+
+        if num_samples is None and deadline is None:
+            num_samples = Cluedo.DefaultSamples
+        sampler = self.deal_sampler(reference)
+        sampler.run(num_samples, deadline=deadline, cancel=cancel)
+        counts = sampler.counts().ravel()
+        seen_zero, seen_one = 0, 0
+        for index, count in enumerate(counts.tolist()):
+            if count:
+                seen_one |= 1 << index
+            if count < sampler.num_samples:
+                seen_zero |= 1 << index
+        self.__seen = (seen_zero, seen_one)
+        self.__marginals = sampler.probabilities()
+        self.__intervals = sampler.intervals()
+        return sampler.num_samples
+
+    def __solve_backbone(self, time_limit, num_workers=1, progress=None, cancel=None):
+        """
+        Compute the backbone of the model, i.e. the variables that take the same value in every
+        solution, without enumerating the solutions. Each undetermined variable is checked by
+        asking for a solution in which it takes the opposite value to a reference witness; every
+        solution found along the way proves all the variables it flips to be free.
+
+        The variables proven by earlier solves are not checked again, and the solutions found by
+        earlier solves that are still solutions are reused as witnesses. With more than one worker,
+        the checks are split between the processes of a worker pool.
+
+        <progress> is called with the variables proven so far, first once the reference solution is
+        found and then after each check; the checks stop once <cancel> is set.
+        """
+        deadline = time.time() + time_limit if time_limit else None
+
+        self.__solution_collector = None
+        if self.__infeasible:
+            self.__seen = (0, 0)
+            return 0
+
+        reference = self.__reference_witness(time_limit, num_workers, cancel)
+        if reference is None:
+            self.__complete = self.__infeasible
+            # out of time: report what is already known, and everything else as undetermined
+            self.__seen = (0, 0) if self.__infeasible else self.__seen_from_facts()
+            return 0
+
+        everything = (1 << self.__num_variables) - 1
+        free = 0
+        for witness in self.__witnesses:
+            free |= witness ^ reference
+        num_witnesses = len(self.__witnesses)
+        candidates = [index for index in range(self.__num_variables) if not (free | self.__facts[0]) >> index & 1]
+
+        def publish(probe_free, proven):
+            if progress is not None:
+                known = (self.__facts[0] | proven) & ~(free | probe_free)
+                progress((everything & ~(known & reference), everything & (~known | reference)))
+        publish(0, 0)
+
+        if num_workers > 1 and len(candidates) > 1:
+            state = self.state()
+            chunks = [candidates[worker::num_workers] for worker in range(num_workers)]
+            timeout = None if deadline is None else deadline - time.time()
+            from concurrent.futures.process import BrokenProcessPool
+            try:
+                results = [future.result() for future in
+                           [worker_pool(num_workers).submit(probe, state, chunk, reference, timeout)
+                            for chunk in chunks if chunk]]
+            except BrokenProcessPool:
+                # a worker died: start a new pool, and run this solve's checks in it once more
+                discard_worker_pool(num_workers)
+                results = [future.result() for future in
+                           [worker_pool(num_workers).submit(probe, state, chunk, reference, timeout)
+                            for chunk in chunks if chunk]]
+            timed_out = 0
+            for chunk_free, chunk_timed_out, witnesses, counters in results:
+                self.__stats.add_counters(counters)
+                free |= chunk_free
+                timed_out |= chunk_timed_out
+                num_witnesses += len(witnesses)
+                self.__witnesses.extend(witnesses)
+            del self.__witnesses[:-Cluedo.MaxWitnesses]
+        else:
+            probe_free, timed_out, witnesses = self.probe(candidates, reference, deadline, publish, cancel)
+            free |= probe_free
+            num_witnesses += len(witnesses)
+
+        free |= timed_out
+        self.__complete = not timed_out
+        self.__facts = (everything & ~free, reference & ~free)
+        self.__seen = ((everything & ~reference) | free, reference | free)
+        return num_witnesses
+
+    def __seen_from_facts(self):
+        """
+        @return: the (seen_zero, seen_one) bitsets in which the variables already proven take their
+                 single value and every other variable takes both.
+        """
+        everything = (1 << self.__num_variables) - 1
+        fact_mask, fact_values = self.__facts
+        return everything & ~(fact_mask & fact_values), everything & (~fact_mask | fact_values)
+
+    def probe(self, candidates, reference, deadline=None, progress=None, cancel=None):
+        """
+        Check, for each candidate variable, whether there is a solution in which it takes the opposite
+        value to the reference solution. Candidates flipped by a solution found along the way are not
+        checked.
+        @param: candidates The indices of the variables to check.
+        @param: reference The bitset of the variables set to 1 in the reference solution.
+        @param: deadline The time.time() after which the remaining candidates are not checked.
+        @param: progress A callable called with the (free, proven) bitsets after each check, where proven
+                is the bitset of the variables proven to take the reference value.
+        @param: cancel A threading.Event which, once set, stops the checks as if the deadline passed.
+        @return: a (free, timed_out, witnesses) tuple: the bitset of the variables proven to take both
+                 values, the bitset of the variables left unchecked, and the solutions found.
+        """
+        free, timed_out, proven, witnesses = 0, 0, 0, []
+        for index in candidates:
+            if free >> index & 1:
+                continue
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0 or cancel is not None and cancel.is_set():
+                # out of time: stay conservative and report the variable as undetermined
+                timed_out |= 1 << index
+                continue
+            status, witness = self.__witness(remaining, index, 1 - (reference >> index & 1))
+            if witness is None:
+                if status == cp_model.INFEASIBLE:
+                    proven |= 1 << index
+                else:
+                    timed_out |= 1 << index
+            else:
+                witnesses.append(witness)
+                free |= witness ^ reference
+            if progress is not None:
+                progress(free, proven)
+        return free, timed_out, witnesses
+
+    def state(self, results=False):
+        """
+        @param: results Also include the results of the last solve, and the results known when each
+                turn began except for their probabilities, so that the restored game answers queries,
+                and undoes turns, without solving again.
+        @return: a picklable snapshot of the game: the players specification, the constraints added
+                 so far, and the deductions and solutions carried over between solves.
+        """
+        state = {
+            'deck': self.__deck.name,
+            'players_spec': list(self.__players_spec),
+            'constraints': list(self.__constraints),
+            'facts': self.__facts,
+            'infeasible': self.__infeasible,
+            'witnesses': list(self.__witnesses),
+            'turns': [{'label': turn['label'], 'start': turn['start'], 'facts': turn['facts'],
+                       'infeasible': turn['infeasible']} for turn in self.__turns],
+        }
+        if results:
+            state['results'] = {
+                'seen': self.__seen,
+                'marginals': None if self.__marginals is None else self.__marginals.tolist(),
+                'intervals': None if self.__intervals is None else self.__intervals.tolist(),
+                'complete': self.__complete,
+                'result': self.__result,
+            }
+            for snapshot, turn in zip(state['turns'], self.__turns):
+                # (the probabilities of every turn would make the snapshot grow with the square of the
+                # turns, so results with probabilities are not reused once undone to)
+                snapshot.update(seen=turn['seen'], complete=turn['complete'],
+                                result=turn['result'] if turn['marginals'] is None else None)
+        return state
+
+    @staticmethod
+    def from_state(state, cache=None):
+        """
+        @return: a Cluedo instance restored from a snapshot taken by Cluedo.state().
+        """
+        cluedo = Cluedo(state['players_spec'], cache, state.get('deck', CLASSIC.name))
+        cluedo.__constraints = [(kind, player_index, tuple(card_indices), value)
+                                for kind, player_index, card_indices, value in state['constraints']]
+        cluedo.__facts = tuple(state['facts'])
+        cluedo.__infeasible = state['infeasible']
+        cluedo.__witnesses = list(state['witnesses'])
+        # (without results in the snapshot, undoing a restored turn only restores its deductions)
+        cluedo.__turns = [dict(turn, facts=tuple(turn['facts']), seen=Cluedo.__restored_seen(turn.get('seen')),
+                               marginals=None, intervals=None, complete=turn.get('complete', False),
+                               result=Cluedo.__restored_result(turn.get('result')))
+                          for turn in state.get('turns', [])]
+        # (the clause database is built in a single pass, keeping a copy at the start of every turn)
+        cluedo.__clause_db, added = ClauseDatabase(), 0
+        for turn in cluedo.__turns:
+            for constraint in cluedo.__constraints[added:turn['start']]:
+                cluedo.__clause_db.add(constraint)
+            added = turn['start']
+            turn['clause_db'] = cluedo.__clause_db.copy()
+        for constraint in cluedo.__constraints[added:]:
+            cluedo.__clause_db.add(constraint)
+        results = state.get('results')
+        if results is not None:
+            cluedo.__seen = Cluedo.__restored_seen(results['seen'])
+            cluedo.__marginals = None if results['marginals'] is None else np.array(results['marginals'])
+            cluedo.__intervals = None if results['intervals'] is None else np.array(results['intervals'])
+            cluedo.__complete = results['complete']
+            cluedo.__result = Cluedo.__restored_result(results['result'])
+        return cluedo
+
+    @staticmethod
+    def __restored_seen(seen):
+        return None if seen is None else tuple(seen)
+
+    @staticmethod
+    def __restored_result(result):
+        return None if result is None else tuple(result)
+
+    def deal_counter(self, deadline=None, cancel=None):
+        """
+        @return: a DealCounter over the players specification and the constraints added so far.
+        """
+        return DealCounter(self.__hand_sizes, self.__deck.category_sizes, self.__clause_db.constraints(), deadline,
+                           cancel)
+
+    def __solve_count(self, deadline=None, cancel=None):
+        """
+        Count the consistent deals, and the deals giving each card to each player, by dynamic
+        programming over the cards rather than by enumeration.
+        @raise: TimeoutError if counting does not finish before <deadline>, or <cancel> is set.
+        """
+        self.__solver = None
+        self.__solution_collector = None
+        counter = self.deal_counter(deadline, cancel)
+        total = counter.total
+        seen_zero, seen_one = 0, 0
+        for index, count in enumerate(count for row in counter.counts for count in row):
+            if count:
+                seen_one |= 1 << index
+            if count < total:
+                seen_zero |= 1 << index
+        self.__seen = (seen_zero, seen_one)
+        self.__marginals = np.array(counter.probabilities())
+        self.__infeasible = not total
+        if total:
+            single = seen_zero ^ seen_one
+            self.__facts = (single, seen_one & single)
+        return total
+
+    def recommend(self, player_name, top=None, num_samples=2000, time_limit=RecommendTimeLimit, seed=None):
+        """
+        Rank the suggestions player <player_name> can make by expected information gain (see
+        recommend.SuggestionRanker), over <num_samples> deals drawn uniformly from the deals consistent
+        with the constraints added so far. The other players answer in the order of the players
+        specification, starting after <player_name>. The deals, and the gains of each suggester, are
+        reused until a constraint is added or removed.
+        @param: top The number of suggestions returned; by default, all of them.
+        @param: time_limit The maximum number of seconds to spend drawing the deals, or None for no
+                limit. The deals are counted to be drawn uniformly; if counting takes too long, the rest
+                of the time goes to drawing them from a Markov chain instead, which is only near-uniform,
+                and fewer than <num_samples> deals may then be drawn.
+        @param: seed The seed of the random deals, for reproducible rankings.
+        @return: a list of (suggestion, expected information gain in bits) tuples, best first, where a
+                 suggestion is a tuple of one card per category.
+        @raise: TimeoutError if there was not even time to draw a consistent deal; ValueError if no
+                deal is consistent with the constraints.
+        """
+        key = (tuple(self.__clause_db.constraints()), num_samples, seed)
+        if self.__ranker is None or self.__ranker[0] != key:
+            deadline = time.time() + time_limit if time_limit else None
+            rng = random.Random(seed)
+            try:
+                deals = self.deal_counter(deadline).sample(num_samples, rng)
+            except TimeoutError:
+                # too many deals to count in time: draw them from a Markov chain instead (see DealSampler)
+                witness = self.__reference_witness(max(deadline - time.time(), 0.01) if deadline else None)
+                if witness is None and self.__infeasible:
+                    raise ValueError("there is no consistent deal to sample")
+                if witness is None:
+                    raise
+                deals = list(self.deal_sampler(witness, rng).deals(num_samples, deadline=deadline))
+                if not deals:
+                    raise TimeoutError("no deal was drawn within the time limit")
+            ranker = SuggestionRanker(deals, self.__deck.category_sizes)
+            # (a ranking over fewer deals than asked for is not kept, so that a later call can do better)
+            if len(deals) == num_samples:
+                self.__ranker = key, ranker
+        else:
+            ranker = self.__ranker[1]
+        suggester = self.__player_index[player_name]
+        responders = list(range(suggester + 1, len(self.__player_names))) + list(range(1, suggester))
+        return [(tuple(self.__deck.cards[card] for card in ranker.candidates[index]), gain)
+                for index, gain in ranker.rank(responders, top)]
+
+    def murderer_distribution(self, top=None, time_limit=None):
+        """
+        The exact distribution of the Murderer's cards: the number of consistent deals in which the
+        Murderer holds each combination of one card per category (each of the 324 possible accusations
+        with the classic deck). An accusation is safe once it is the only one left. The deals are
+        counted in a single pass for every combination at once (see DealCounter.murderer_counts()), and
+        the counts are reused until a constraint is added or removed.
+        @param: top The number of combinations returned; by default, all of them, including those with
+                no consistent deal.
+        @param: time_limit The maximum number of seconds to spend counting.
+        @return: a list of (cards, number of deals, probability) tuples, most likely first, where cards
+                 is a tuple of one card per category.
+        @raise: TimeoutError if counting does not finish within <time_limit>.
+        """
+        key = tuple(self.__clause_db.constraints())
+        if self.__murderer_counts is None or self.__murderer_counts[0] != key:
+            deadline = time.time() + time_limit if time_limit else None
+            card_classes = self.symmetries(players=False).card_classes
+            self.__murderer_counts = key, self.deal_counter(deadline).murderer_counts(card_classes)
+        counts = self.__murderer_counts[1]
+        total = sum(counts.values())
+        # (ties, such as the combinations with no deal, are listed in card order)
+        combinations = itertools.product(*[range(self.__deck.card_slices[card_type].start,
+                                                 self.__deck.card_slices[card_type].stop)
+                                           for card_type in self.__deck.card_types])
+        ranked = sorted(combinations, key=lambda cards: -counts.get(cards, 0))[:top]
+        return [(tuple(self.__deck.cards[card] for card in cards), counts.get(cards, 0),
+                 counts.get(cards, 0) / total if total else 0.0) for cards in ranked]
+
+    def domains(self):
+        """
+        @return: the set of values each variable can take after the last solve, indexed by variable.
+        """
+        return [{value for value, seen in enumerate(self.__seen) if seen >> index & 1}
+                for index in range(self.__num_variables)]
+
+    @staticmethod
+    def pack(seen, player_index, deck=CLASSIC):
+        """
+        Pack the variable domains of a single player by card type.
+        @param: seen A (seen_zero, seen_one) tuple of bitsets over the variable indices.
+        @param: player_index The index of the player in Cluedo.player_names.
+        @param: deck The Deck of the game.
+        @return: a {Suspect/Weapon/Room: {card: set of values}} dictionary.
+        """
+        seen_zero, seen_one = (seen_bits >> player_index * deck.num_cards for seen_bits in seen)
+        ret_val = {card_type: defaultdict(set) for card_type in deck.card_types}
+        for card_index, card in enumerate(deck.cards):
+            values = ret_val[type(card)][card.value]
+            if seen_zero >> card_index & 1:
+                values.add(0)
+            if seen_one >> card_index & 1:
+                values.add(1)
+        return ret_val
+
     def player(self, player_name=Player.Murderer):
-        return self.solution_collector.PackedSolutions(player_name)
+        start = time.perf_counter()
+        ret_val = Cluedo.pack(self.__seen, self.__player_index[player_name], self.__deck)
+        self.__stats.packing_time += time.perf_counter() - start
+        return ret_val
+
+    def __seen_matrix(self, seen=None):
+        """
+        @return: a (2 x players x cards) boolean array of the values seen for each variable.
+        """
+        num_bytes = (self.__num_variables + 7) // 8
+        seen = [np.unpackbits(np.frombuffer(bits.to_bytes(num_bytes, 'little'), dtype=np.uint8),
+                              count=self.__num_variables, bitorder='little')
+                for bits in (self.__seen if seen is None else seen)]
+        return np.array(seen, dtype=bool).reshape(2, len(self.__player_names), self.__deck.num_cards)
 
     @property
     def players(self):
-        player_names = [name for name, _ in self.__players.items()]
+        return self.assignments()
+
+    def assignments(self, seen=None):
+        """
+        @param: seen A (seen_zero, seen_one) tuple of bitsets over the variable indices, such as those
+                passed to the progress callback of solve(); by default, those of the last solve.
+        @return: a dictionary from player name to the player's packed solutions, as returned by player().
+        """
+        start = time.perf_counter()
+        # one reduction gives every variable a domain code: bit 0 if seen set to 0, bit 1 if seen set to 1
+        seen_zero, seen_one = self.__seen_matrix(seen)
+        codes = seen_zero.astype(np.uint8) | seen_one.astype(np.uint8) << 1
+        domains = np.array([set(), {0}, {1}, {0, 1}], dtype=object)[codes]
         player_assignments = {}
-        for player_name in player_names:
-            player_assignments[player_name] = self.player(player_name)
+        for player_name, row in zip(self.__player_names, domains):
+            player_assignments[player_name] = {
+                card_type: defaultdict(set, zip(self.__deck.card_values[card_type],
+                                                map(set, row[self.__deck.card_slices[card_type]])))
+                for card_type in self.__deck.card_types
+            }
+        self.__stats.packing_time += time.perf_counter() - start
         return player_assignments
 
+    def summary(self):
+        """
+        @return: a dictionary from player name to the number of cards the player is known to hold,
+                 known not to hold, and still undetermined.
+        """
+        seen_zero, seen_one = self.__seen_matrix()
+        held = (seen_one & ~seen_zero).sum(axis=1)
+        not_held = (seen_zero & ~seen_one).sum(axis=1)
+        unknown = (seen_zero & seen_one).sum(axis=1)
+        return {player_name: {'held': int(h), 'not_held': int(n), 'unknown': int(u)}
+                for player_name, h, n, u in zip(self.__player_names, held, not_held, unknown)}
+
+    def probabilities(self, player_name=Player.Murderer, allow_partial=False):
+        """
+        The probability that player <player_name> holds each card, over the solutions found by the
+        last call to solve(keep_solutions=True), or over all consistent deals after
+        solve(mode=Cluedo.Count), or as estimated by solve(mode=Cluedo.Sample).
+        @param: allow_partial Return the probabilities even if the last solve stopped at its time
+                limit, in which case they are over a partial, order-biased set of solutions.
+        @return: a {Suspect/Weapon/Room: {card: probability}} dictionary.
+        """
+        if self.__marginals is None:
+            raise ValueError("no ownership probabilities: solve with mode=Cluedo.Count or keep_solutions=True first")
+        if not self.__complete and self.__intervals is None and not allow_partial:
+            raise ValueError("ownership probabilities are over a partial enumeration: the solve hit its time limit")
+        ret_val = {card_type: {} for card_type in self.__deck.card_types}
+        for card, probability in zip(self.__deck.cards, self.__marginals[self.__player_index[player_name]].tolist()):
+            ret_val[type(card)][card.value] = probability
+        return ret_val
+
+    def confidence_intervals(self, player_name=Player.Murderer):
+        """
+        The confidence interval, at about 95%, of the probability that player <player_name> holds each
+        card, as estimated by solve(mode=Cluedo.Sample). Exact probabilities have intervals of no width.
+        @return: a {Suspect/Weapon/Room: {card: (low, high)}} dictionary.
+        """
+        probabilities = self.probabilities(player_name)
+        player_index = self.__player_index[player_name]
+        ret_val = {card_type: {} for card_type in self.__deck.card_types}
+        for card_index, card in enumerate(self.__deck.cards):
+            probability = probabilities[type(card)][card.value]
+            half_width = 0.0 if self.__intervals is None else float(self.__intervals[player_index, card_index])
+            ret_val[type(card)][card.value] = (max(probability - half_width, 0.0), min(probability + half_width, 1.0))
+        return ret_val
+
+    @property
+    def infeasible(self):
+        """
+        @return: whether the constraints added so far have been proven to admit no deal at all.
+        """
+        return self.__infeasible
+
+    @property
+    def complete(self):
+        """
+        @return: whether the last solve ran to completion, rather than stopping at its time limit.
+        """
+        return self.__complete
+
+    @property
+    def stats(self):
+        """
+        @return: the SolveStats of the last solve.
+        """
+        return self.__stats
+
+    @property
+    def intervals(self):
+        """
+        @return: the (players x cards) array of the confidence half-widths of the marginals estimated by
+                 the last solve in sample mode, or None.
+        """
+        return self.__intervals
+
+    @property
+    def marginals(self):
+        """
+        @return: the (players x cards) array of ownership probabilities, or None.
+        """
+        return self.__marginals
+
     @property
     def player_names(self):
-        return [name for name, _ in self.__players.items()]
+        return list(self.__player_names)
+
+    @property
+    def deck(self):
+        return self.__deck
+
+    @property
+    def clause_database(self):
+        """
+        @return: the ClauseDatabase of the constraints added so far, in the simplified form the models
+                 and counters are built from.
+        """
+        return self.__clause_db
 
     @property
     def model(self):
+        self.__ensure_model()
         return self.__model
 
+    @property
+    def variables(self):
+        """
+        @return: the flat list of every player's variables, indexed by Cluedo.index().
+        """
+        self.__ensure_model()
+        return self.__variables
+
     @property
     def variable_map(self):
+        self.__ensure_model()
         return self.__variable_map
 
+    @property
+    def cache(self):
+        return self.__cache
+
     @property
     def solver(self):
         return self.__solver
@@ -262,5 +1362,92 @@ class Cluedo(object):
         return self.__solution_collector
 
 
+@functools.lru_cache(maxsize=None)
+def solution_callback_class():
+    """
+    @return: a CP-SAT solution callback class, whose instances call a function on each solution.
+    """
+    class SolutionCallback(cp_model.CpSolverSolutionCallback):
+        def __init__(self, on_solution):
+            cp_model.CpSolverSolutionCallback.__init__(self)
+            self.__on_solution = on_solution
+
+        def OnSolutionCallback(self):
+            self.__on_solution()
+
+    return SolutionCallback
+
+
+def set_domain(model, variable, low, high):
+    """
+    Set the domain of <variable> in <model> to [<low>, <high>], in place.
+    """
+    domain = model.Proto().variables[variable.Index()].domain
+    domain[0], domain[1] = low, high
+
+
+def set_search_workers(parameters, num_workers):
+    """
+    Set the number of parallel search workers on CP-SAT solver parameters, under whichever name the
+    installed version of CP-SAT uses.
+    """
+    if hasattr(parameters, 'num_workers'):
+        parameters.num_workers = num_workers
+    elif hasattr(parameters, 'num_search_workers'):
+        parameters.num_search_workers = num_workers
+
+
+def set_check_parameters(parameters):
+    """
+    Turn off the presolve, symmetry and linearization passes on CP-SAT solver parameters: the checks
+    are small, purely Boolean models solved many times over, which these passes cost more than they
+    save on.
+    """
+    parameters.cp_model_presolve = False
+    parameters.cp_model_probing_level = 0
+    parameters.symmetry_level = 0
+    parameters.linearization_level = 0
+
+
+# process pools, by number of workers; they are kept until the interpreter exits so that the cost
+# of starting the workers and importing ortools is only paid once
+worker_pools = {}
+
 
+def worker_pool(num_workers):
+    """
+    @return: a process pool with <num_workers> workers.
+    """
+    if num_workers not in worker_pools:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+        context = multiprocessing.get_context('spawn')
+        worker_pools[num_workers] = ProcessPoolExecutor(max_workers=num_workers, mp_context=context)
+    return worker_pools[num_workers]
 
+
+def discard_worker_pool(num_workers):
+    """
+    Shut down the pool with <num_workers> workers, e.g. after one of its workers died, so that the
+    next call to worker_pool() starts a new one.
+    """
+    pool = worker_pools.pop(num_workers, None)
+    if pool is not None:
+        # (the pending tasks can only be cancelled from Python 3.9 on; before, they run on the old workers)
+        pool.shutdown(wait=False, **({'cancel_futures': True} if sys.version_info >= (3, 9) else {}))
+
+
+@atexit.register
+def shutdown_worker_pools():
+    for num_workers in list(worker_pools):
+        discard_worker_pool(num_workers)
+
+
+def probe(state, candidates, reference, time_limit):
+    """
+    Run Cluedo.probe() in a worker process, on a copy of the game restored from <state>.
+    @return: the result of Cluedo.probe(), followed by the search counters of the checks.
+    """
+    deadline = None if time_limit is None else time.time() + time_limit
+    cluedo = Cluedo.from_state(state)
+    return cluedo.probe(candidates, reference, deadline) + (cluedo.stats.counters(),)
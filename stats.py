@@ -0,0 +1,67 @@
+class SolveStats(object):
+    """
+    What a call to Cluedo.solve() did and how long it took.
+
+    The search counters (branches, conflicts, solver calls) add up every CP-SAT search the solve ran,
+    including those run by worker processes. The packing time is the time spent afterwards turning
+    the result into per-player dictionaries (Cluedo.player() and Cluedo.players), and so keeps growing
+    after solve() returns.
+    """
+
+    # statuses
+    Optimal = 'OPTIMAL'  # the result is exact: every solution was accounted for
+    Feasible = 'FEASIBLE'  # the result is partial: the solve stopped at its time limit
+    Infeasible = 'INFEASIBLE'  # no deal is consistent with the constraints
+    Unknown = 'UNKNOWN'  # the solve stopped at its time limit before finding any solution
+
+    def __init__(self, mode, time_limit=None, num_constraints=0):
+        self.mode = mode
+        self.time_limit = time_limit
+        self.num_constraints = num_constraints  # the number of constraints added to the game so far
+        self.status = SolveStats.Unknown
+        self.solver_status = None  # the status name returned by the last CP-SAT search, if any
+        self.complete = False
+        self.cached = False
+        self.propagated = False  # whether propagation alone settled the board
+        self.solutions = 0
+        self.wall_time = 0.0
+        self.user_time = 0.0
+        self.branches = 0
+        self.conflicts = 0
+        self.solver_calls = 0
+        self.num_variables = 0
+        self.num_model_constraints = None  # the size of the CP-SAT model searched, if the solve built one
+        self.packing_time = 0.0
+
+    @property
+    def time_limit_hit(self):
+        return bool(self.time_limit) and not self.complete
+
+    def add_search(self, solver, status):
+        """
+        Account for one CP-SAT search.
+        """
+        self.branches += solver.NumBranches()
+        self.conflicts += solver.NumConflicts()
+        self.solver_calls += 1
+        self.solver_status = solver.StatusName(status)
+
+    def add_counters(self, counters):
+        """
+        Account for the searches counted by another SolveStats, as returned by counters().
+        """
+        branches, conflicts, solver_calls = counters
+        self.branches += branches
+        self.conflicts += conflicts
+        self.solver_calls += solver_calls
+
+    def counters(self):
+        return self.branches, self.conflicts, self.solver_calls
+
+    def as_dict(self):
+        fields = dict(vars(self))
+        fields['time_limit_hit'] = self.time_limit_hit
+        return fields
+
+    def __repr__(self):
+        return 'SolveStats({})'.format(', '.join(f'{name}={value!r}' for name, value in self.as_dict().items()))
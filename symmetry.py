@@ -0,0 +1,135 @@
+from math import factorial
+from cluedo.lazy import LazyModule
+
+np = LazyModule('numpy')
+
+
+class Symmetries(object):
+    """
+    The interchangeable players and cards of a Cluedo board.
+
+    Players with the same hand size that no constraint mentions can swap hands, and cards of the same
+    category that no constraint mentions can swap holders, without changing whether a deal is
+    consistent. A solver therefore only needs one representative deal per orbit. Representatives are
+    picked by double-lex ordering of the (holder x card) matrix. Of two interchangeable players, the
+    first has the lexicographically larger hand. Of two interchangeable cards, the first has the
+    holder with the smaller index. This choice is sound for row and column symmetries together.
+
+    Results over the representatives are mapped back to every player and card: a value seen for one
+    variable of an orbit is seen for all of them, and each representative is weighted by the number
+    of deals in its orbit.
+    """
+
+    def __init__(self, player_classes, card_classes, num_cards):
+        """
+        @param: player_classes Lists of interchangeable player indices, each with at least two players.
+        @param: card_classes Lists of interchangeable card indices, each with at least two cards.
+        @param: num_cards The number of cards in the deck.
+        """
+        self.__player_classes = [sorted(players) for players in player_classes]
+        self.__card_classes = [sorted(cards) for cards in card_classes]
+        self.__num_cards = num_cards
+
+    @staticmethod
+    def find(hand_sizes, category_sizes, constraints, players=True, cards=True):
+        """
+        Find the players and cards that no constraint distinguishes.
+        @param: hand_sizes The number of cards held by each holder, indexed by player index. The
+                Murderer, holder 0, is never interchangeable with a player.
+        @param: category_sizes The number of cards in each category, in card ordinal order.
+        @param: constraints A list of (kind, player index, card indices, value) tuples.
+        @param: players, cards Which kinds of symmetry to look for.
+        """
+        mentioned_players = {player_index for _, player_index, _, _ in constraints}
+        mentioned_cards = {card for _, _, card_indices, _ in constraints for card in card_indices}
+
+        player_classes = []
+        if players:
+            by_size = {}
+            for player_index, hand_size in enumerate(hand_sizes):
+                if player_index and player_index not in mentioned_players:
+                    by_size.setdefault(hand_size, []).append(player_index)
+            player_classes = [group for group in by_size.values() if len(group) > 1]
+
+        card_classes = []
+        if cards:
+            offset = 0
+            for size in category_sizes:
+                group = [card for card in range(offset, offset + size) if card not in mentioned_cards]
+                if len(group) > 1:
+                    card_classes.append(group)
+                offset += size
+
+        return Symmetries(player_classes, card_classes, sum(category_sizes))
+
+    def __bool__(self):
+        return bool(self.__player_classes or self.__card_classes)
+
+    @property
+    def player_classes(self):
+        return [list(players) for players in self.__player_classes]
+
+    @property
+    def card_classes(self):
+        return [list(cards) for cards in self.__card_classes]
+
+    def add_constraints(self, model, variables, num_players):
+        """
+        Add the symmetry-breaking constraints to a CP-SAT model.
+        @param: variables The flat list of variables, indexed by player index x card index.
+        @param: num_players The number of holders, including the Murderer.
+        """
+        n = self.__num_cards
+        for cards in self.__card_classes:
+            holder = [sum(p * variables[p * n + card] for p in range(1, num_players)) for card in cards]
+            for first, second in zip(holder, holder[1:]):
+                model.Add(first <= second)
+        for players in self.__player_classes:
+            hand = [sum((1 << (n - 1 - card)) * variables[p * n + card] for card in range(n)) for p in players]
+            for first, second in zip(hand, hand[1:]):
+                model.Add(first >= second)
+
+    def expand(self, bits):
+        """
+        @param: bits A bitset over the flat variable layout, e.g. the variables seen set to 1.
+        @return: the bitset closed under the symmetries: a variable is set if any variable in its orbit is.
+        """
+        n = self.__num_cards
+        for cards in self.__card_classes:
+            mask = sum(1 << card for card in cards)
+            row = (1 << n) - 1
+            player_index = 0
+            while bits >> player_index * n:
+                if bits >> player_index * n & row & mask:
+                    bits |= mask << player_index * n
+                player_index += 1
+        for players in self.__player_classes:
+            row_bits = 0
+            for player_index in players:
+                row_bits |= bits >> player_index * n & ((1 << n) - 1)
+            for player_index in players:
+                bits |= row_bits << player_index * n
+        return bits
+
+    def weigh(self, solutions, num_players):
+        """
+        Weigh representative solutions by the sizes of their orbits under the card symmetries.
+        (Player symmetries are not weighed: only break card symmetries when weights are needed.)
+        @param: solutions A (solutions x variables) 0/1 matrix of representatives.
+        @return: a (weights, marginals) tuple: the number of deals each representative stands for,
+                 and the fraction of all those deals in which each variable is set, as a
+                 (players x cards) array.
+        """
+        assert not self.__player_classes, "player symmetries cannot be weighed"
+        solutions = np.asarray(solutions, dtype=float).reshape(len(solutions), num_players, self.__num_cards)
+        weights = np.ones(len(solutions))
+        for cards in self.__card_classes:
+            # the cards of a class are dealt to the same multiset of holders throughout the orbit, each
+            # arrangement once: multinomial(k; m_0, m_1, ...) deals, each card held by h with odds m_h / k
+            held = solutions[:, :, cards].sum(axis=2)
+            weights *= factorial(len(cards)) / np.prod([[factorial(int(m)) for m in row] for row in held], axis=1)
+            solutions[:, :, cards] = (held / len(cards))[:, :, None]
+        if not len(solutions):
+            return weights, None
+        marginals = np.tensordot(weights, solutions, axes=1) / weights.sum()
+        return weights, marginals
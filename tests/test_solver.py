@@ -1,6 +1,638 @@
+import pytest
+import time
+from .context import *
+
 # pylint: disable=redefined-outer-name
 def test_smoke(cluedo_solver):
     print(f"{cluedo_solver}")
 
 
 
+
+
+def small_game():
+    """
+    A game where Will's and Julie's hands are fully known, so that only a few hundred solutions remain.
+    """
+    cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)])
+    cards = list(Suspect) + list(Weapon) + list(Room)
+    will = [Suspect.MISS_SCARLET, Suspect.PROF_PLUM, Weapon.CANDLESTICK, Weapon.DAGGER, Room.KITCHEN, Room.BALLROOM]
+    julie = [Suspect.MRS_PEACOCK, Weapon.LEAD_PIPE, Room.CONSERVATORY, Room.DINING_ROOM, Room.BILLIARD_ROOM,
+             Room.LIBRARY]
+    for card in cards:
+        cluedo.add_constraint('Will', card, card in will)
+        cluedo.add_constraint('Julie', card, card in julie)
+    cluedo.add_or_constraint('Laura', [Suspect.MR_GREEN, Weapon.REVOLVER, Room.LOUNGE])
+    cluedo.add_constraint('Laura', Suspect.MRS_WHITE, False)
+    return cluedo
+
+
+def test_backbone_matches_enumeration():
+    cluedo = small_game()
+    assert cluedo.solve().solutions > 0
+    expected = cluedo.players
+
+    assert cluedo.solve(mode=Cluedo.Backbone).solutions > 0
+    assert cluedo.players == expected
+    assert cluedo.player()[Suspect][Suspect.MRS_WHITE.value] == {1}
+    assert cluedo.player()[Weapon][Weapon.ROPE.value] == {0, 1}
+    assert cluedo.player('Laura')[Suspect][Suspect.MRS_WHITE.value] == {0}
+
+
+def test_enumeration_stops_once_packed(cluedo_solver):
+    # an unconstrained game has far too many solutions to enumerate, but every variable is free
+    assert cluedo_solver.solve(time_limit=60).solutions > 0
+    assert cluedo_solver.player('Will')[Room][Room.KITCHEN.value] == {0, 1}
+    assert cluedo_solver.solution_collector.Domains() == [{0, 1}] * len(cluedo_solver.variables)
+    assert cluedo_solver.solution_collector.PackedSolutions('Will') == cluedo_solver.player('Will')
+
+
+def test_variable_layout(cluedo_solver):
+    index = cluedo_solver.index('Julie', Room.KITCHEN)
+    assert cluedo_solver.variables[index] is cluedo_solver.variable_map['Julie$KITCHEN']
+    assert index == 2 * NUM_CARDS + CARD_INDEX[Room.KITCHEN]
+
+
+def test_solution_matrix():
+    cluedo = small_game()
+    assert cluedo.solve(keep_solutions=True).solutions == 9
+    assert cluedo.solution_collector.Solutions().shape == (9, len(cluedo.variables))
+    # the murderer holds one of the three remaining weapons, each in a third of the deals
+    assert cluedo.probabilities()[Weapon][Weapon.ROPE.value] == 1 / 3
+    assert cluedo.probabilities('Laura')[Suspect][Suspect.MRS_WHITE.value] == 0
+    assert cluedo.summary()['Will'] == {'held': 6, 'not_held': 15, 'unknown': 0}
+    assert cluedo.summary()['Laura'] == {'held': 2, 'not_held': 13, 'unknown': 6}
+
+
+def test_count_matches_enumeration():
+    cluedo = small_game()
+    cluedo.add_or_constraint('Laura', [Weapon.ROPE, Room.HALL])
+    num_solutions = cluedo.solve(keep_solutions=True).solutions
+    expected, marginals = cluedo.players, cluedo.marginals
+
+    assert cluedo.solve(mode=Cluedo.Count).solutions == num_solutions
+    assert cluedo.players == expected
+    assert (abs(cluedo.marginals - marginals) < 1e-12).all()
+
+
+def test_count_unconstrained(cluedo_solver):
+    # 324 envelopes, then the 18 remaining cards split 6/6/6
+    assert cluedo_solver.solve(mode=Cluedo.Count).solutions == 324 * 17153136
+    assert cluedo_solver.probabilities()[Room][Room.KITCHEN.value] == 1 / 9
+    assert cluedo_solver.probabilities('Will')[Room][Room.KITCHEN.value] == 8 / 27
+
+
+def test_incremental_backbone():
+    cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)])
+    cluedo.add_constraint('Will', Suspect.MR_GREEN)
+    cluedo.solve(mode=Cluedo.Backbone)
+    cluedo.add_or_constraint('Julie', [Suspect.MRS_WHITE, Weapon.ROPE])
+    cluedo.add_constraint('Julie', Weapon.ROPE, False)
+    cluedo.add_constraint('Laura', Suspect.MRS_WHITE, False)
+    cluedo.solve(mode=Cluedo.Backbone)
+    incremental = cluedo.players
+
+    cluedo.solve(mode=Cluedo.Backbone, incremental=False)
+    assert cluedo.players == incremental
+    assert cluedo.player('Julie')[Suspect][Suspect.MRS_WHITE.value] == {1}
+    assert cluedo.player()[Suspect][Suspect.MR_GREEN.value] == {0}
+
+
+def test_propagation():
+    cluedo = small_game()
+    propagator = cluedo.propagator()
+    assert propagator.consistent and not propagator.settled
+    assert propagator.held[0] >> CARD_INDEX[Suspect.MRS_WHITE] & 1
+    assert propagator.held[3] >> CARD_INDEX[Suspect.MR_GREEN] & 1
+
+    cluedo.add_constraint('Laura', Weapon.ROPE)
+    cluedo.add_constraint('Laura', Weapon.WRENCH)
+    cluedo.add_constraint('Laura', Room.HALL)
+    cluedo.add_constraint('Laura', Room.STUDY)
+    # propagation alone names the murderer, and the solver is never called
+    assert cluedo.solve().solutions == 1
+    assert cluedo.solver is None
+    assert cluedo.player()[Weapon][Weapon.REVOLVER.value] == {1}
+    assert cluedo.player()[Room][Room.LOUNGE.value] == {1}
+
+    cluedo.add_constraint('Julie', Room.LOUNGE)
+    assert cluedo.solve().solutions == 0
+
+
+def test_parallel_backbone():
+    cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)])
+    cluedo.add_constraint('Will', Suspect.MR_GREEN)
+    cluedo.add_or_constraint('Julie', [Suspect.MRS_WHITE, Weapon.ROPE])
+    cluedo.add_constraint('Julie', Weapon.ROPE, False)
+    cluedo.solve(mode=Cluedo.Backbone, num_workers=2)
+    parallel = cluedo.players
+
+    cluedo.solve(mode=Cluedo.Backbone, incremental=False)
+    assert cluedo.players == parallel
+    assert cluedo.player('Julie')[Suspect][Suspect.MRS_WHITE.value] == {1}
+
+
+def test_enumeration_stops_once_packed_with_known_cards():
+    cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)])
+    cluedo.add_constraint('Will', Suspect.MR_GREEN)
+    start = time.time()
+    num_solutions = cluedo.solve(time_limit=10).solutions
+    assert time.time() - start < 5
+    assert num_solutions < 10000
+    assert cluedo.player('Julie')[Suspect][Suspect.MR_GREEN.value] == {0}
+    assert cluedo.player('Julie')[Suspect][Suspect.MRS_WHITE.value] == {0, 1}
+
+
+def test_solve_cache(tmp_path):
+    cache = SolveCache(max_size=2, path=str(tmp_path / 'solves'))
+    cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)], cache=cache)
+    cluedo.add_constraint('Will', Suspect.MR_GREEN)
+    cluedo.add_or_constraint('Julie', [Suspect.MRS_WHITE, Weapon.ROPE])
+    num_solutions = cluedo.solve(mode=Cluedo.Count).solutions
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    # the same board, reached in another order by other players, is answered from the cache
+    other = Cluedo([('Ann', 6), ('Bob', 6), ('Cat', 6)], cache=cache)
+    other.add_or_constraint('Bob', [Weapon.ROPE, Suspect.MRS_WHITE])
+    other.add_constraint('Ann', Suspect.MR_GREEN)
+    other.add_constraint('Ann', Suspect.MR_GREEN)
+    assert other.solve(mode=Cluedo.Count).solutions == num_solutions
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert other.player('Bob') == cluedo.player('Julie')
+    assert other.probabilities('Bob') == cluedo.probabilities('Julie')
+    assert other.solution_collector is None
+    assert other.domains()[other.index('Bob', Suspect.MR_GREEN)] == {0}
+
+    # propagation changes what enumeration returns, so it is part of the key
+    cluedo.solve(propagate=False)
+    assert cache.misses == 2
+
+    cluedo.solve(mode=Cluedo.Backbone)
+    assert len(cache) == 2
+    cache.close()
+
+    # evicted entries are still found on disk
+    cache = SolveCache(max_size=2, path=str(tmp_path / 'solves'))
+    restored = Cluedo.from_state(other.state(), cache=cache)
+    assert restored.solve(mode=Cluedo.Count).solutions == num_solutions
+    assert (cache.hits, cache.misses) == (1, 0)
+    cache.close()
+
+
+def test_backbone_timeout_keeps_known_cards():
+    cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)])
+    cluedo.add_constraint('Will', Suspect.MR_GREEN)
+    assert cluedo.solve(time_limit=1e-9, mode=Cluedo.Backbone).solutions == 0
+    assert cluedo.player('Will')[Suspect][Suspect.MR_GREEN.value] == {1}
+    assert cluedo.player('Julie')[Suspect][Suspect.MR_GREEN.value] == {0}
+    assert cluedo.player('Julie')[Suspect][Suspect.MRS_WHITE.value] == {0, 1}
+
+
+def test_partial_probabilities(cluedo_solver):
+    # an unconstrained game cannot be enumerated in a few milliseconds
+    cluedo_solver.solve(time_limit=0.05, keep_solutions=True)
+    assert not cluedo_solver.complete
+    with pytest.raises(ValueError):
+        cluedo_solver.probabilities()
+    assert cluedo_solver.probabilities(allow_partial=True)[Room][Room.KITCHEN.value] >= 0
+
+
+def test_count_time_limit():
+    # a feasible board with too many deals to count in time: only the observer's own hand is known
+    from cluedo.deck import MASTER_DETECTIVE
+    cluedo = Cluedo(MASTER_DETECTIVE.players_spec(10), deck=MASTER_DETECTIVE)
+    me = cluedo.player_names[1]
+    hand = MASTER_DETECTIVE.cards[:3]
+    for card in MASTER_DETECTIVE.cards:
+        cluedo.add_constraint(me, card, card in hand)
+    start = time.time()
+    stats = cluedo.solve(time_limit=0.05, mode=Cluedo.Count)
+    assert time.time() - start < 2
+    assert stats.time_limit_hit and not cluedo.complete and cluedo.marginals is None
+    with pytest.raises(ValueError):
+        cluedo.probabilities()
+    # the known cards are still returned
+    assert all(cluedo.player(me)[card.__class__][card.value] == {1} for card in hand)
+
+
+def test_count_infeasible():
+    cluedo = small_game()
+    cluedo.add_constraint('Laura', Suspect.MRS_WHITE)
+    assert cluedo.solve(mode=Cluedo.Count).solutions == 0
+    assert cluedo.infeasible
+
+
+def test_enumerate_infeasible():
+    # without propagation, the contradiction is only found by the search
+    cluedo = small_game()
+    cluedo.add_observation('Laura', Cluedo.SomeTrue, [Suspect.MRS_WHITE, Weapon.ROPE])
+    cluedo.add_observation('Laura', Cluedo.AllFalse, [Suspect.MRS_WHITE, Weapon.ROPE])
+    assert cluedo.solve(mode=Cluedo.Enumerate, propagate=False).solutions == 0
+    assert cluedo.infeasible and cluedo.complete
+
+
+def test_broken_worker_pool_is_replaced():
+    cluedo = small_game()
+    cluedo.solve(mode=Cluedo.Backbone, num_workers=2)
+    expected = cluedo.players
+    for process in worker_pool(2)._processes.values():
+        process.kill()
+    cluedo.solve(mode=Cluedo.Backbone, num_workers=2, incremental=False)
+    assert cluedo.players == expected
+    with pytest.raises(ValueError):
+        cluedo.solve(num_workers=2)
+
+
+def test_symmetry_breaking():
+    cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 3), ('Ann', 3)])
+    for card in [Suspect.MISS_SCARLET, Suspect.PROF_PLUM, Weapon.CANDLESTICK, Weapon.DAGGER, Room.KITCHEN,
+                 Room.BALLROOM]:
+        cluedo.add_constraint('Will', card)
+    for card in [Suspect.MRS_PEACOCK, Weapon.LEAD_PIPE, Room.CONSERVATORY, Room.DINING_ROOM, Room.BILLIARD_ROOM,
+                 Room.LIBRARY]:
+        cluedo.add_constraint('Julie', card)
+    symmetries = cluedo.symmetries()
+    assert symmetries.player_classes == [[3, 4]]
+    assert [len(cards) for cards in symmetries.card_classes] == [3, 3, 3]
+
+    assert cluedo.solve(keep_solutions=True).solutions == 3 ** 3 * 20
+    assert len(cluedo.solution_collector.Solutions()) < 3 ** 3 * 20
+    expected = cluedo.solve(keep_solutions=True, break_symmetry=False).solutions
+    assert expected == 3 ** 3 * 20
+    players, marginals = cluedo.players, cluedo.marginals
+    cluedo.solve(keep_solutions=True)
+    assert cluedo.players == players
+    assert np.allclose(cluedo.marginals, marginals)
+    cluedo.solve()
+    assert cluedo.players == players
+
+    cluedo.add_or_constraint('Laura', [Suspect.MR_GREEN, Weapon.REVOLVER])
+    total = cluedo.solve(mode=Cluedo.Count).solutions
+    players, marginals = cluedo.players, cluedo.marginals
+    assert cluedo.solve(keep_solutions=True).solutions == total
+    assert cluedo.players == players
+    assert np.allclose(cluedo.marginals, marginals)
+
+
+def test_benchmark():
+    from cluedo import benchmark
+    results = benchmark.run_suite(player_counts=(3,), phases=('near_solved',), modes=(Cluedo.Count,), isolate=False)
+    assert results[0]['turns'] == 12 and results[0]['complete'] and results[0]['solutions'] > 0
+    assert benchmark.compare(results, results) == []
+    slower = [dict(results[0], wall_time=results[0]['wall_time'] + 1.0, solutions=results[0]['solutions'] + 1)]
+    assert len(benchmark.compare(slower, results)) == 2
+
+
+def test_solve_stats():
+    cluedo = small_game()
+    seen = []
+    cluedo.add_solve_callback(lambda game, stats: seen.append(stats))
+    stats = cluedo.solve(mode=Cluedo.Backbone, propagate=False)
+    assert stats is cluedo.stats and seen == [stats]
+    assert stats.status == 'OPTIMAL' and stats.complete and not stats.time_limit_hit
+    assert stats.solver_calls > 0 and stats.branches >= 0 and stats.wall_time > 0
+    assert stats.num_constraints == 44 and stats.num_variables == len(cluedo.variables)
+    cluedo.players
+    assert stats.packing_time > 0
+
+    cluedo.add_constraint('Laura', Suspect.MRS_WHITE)
+    assert cluedo.solve(mode=Cluedo.Backbone).status == 'INFEASIBLE'
+
+    stats = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)]).solve(time_limit=1e-9, mode=Cluedo.Backbone)
+    assert stats.time_limit_hit and stats.status == 'UNKNOWN'
+
+
+def test_anytime_solve():
+    from cluedo.anytime import AnytimeSolve
+    cluedo = small_game()
+    published, done = [], []
+    solve = AnytimeSolve(cluedo, on_progress=published.append, on_done=done.append, interval=0)
+    stats = solve.start(mode=Cluedo.Backbone, propagate=False, incremental=False).wait(timeout=60)
+    assert done == [stats] and stats.complete and len(published) > 1
+    assert published[-1] == cluedo.players
+    # nothing is published as known before it is proven
+    for player_name, player in published[0].items():
+        for card_type in CARD_TYPES:
+            for card, values in player[card_type].items():
+                assert values >= cluedo.players[player_name][card_type][card]
+
+    cluedo = Cluedo([(name, 3) for name in 'ABCDEF'])
+    solve = AnytimeSolve(cluedo).start(mode=Cluedo.Count)
+    solve.cancel()
+    stats = solve.wait(timeout=30)
+    assert solve.cancelled and not stats.complete and not solve.running
+
+
+def test_undo_and_edit_turns():
+    cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)])
+    cluedo.begin_turn('my hand')
+    for card in [Suspect.MISS_SCARLET, Suspect.PROF_PLUM, Weapon.CANDLESTICK, Weapon.DAGGER, Room.KITCHEN,
+                 Room.BALLROOM]:
+        cluedo.add_constraint('Will', card)
+    cluedo.solve(mode=Cluedo.Backbone)
+    expected = cluedo.players
+
+    cluedo.begin_turn('Julie cannot refute')
+    for card in (Suspect.MR_GREEN, Weapon.ROPE, Room.HALL):
+        cluedo.add_constraint('Julie', card, False)
+    cluedo.begin_turn('Laura refutes')
+    cluedo.add_or_constraint('Laura', [Suspect.MR_GREEN, Weapon.ROPE, Room.HALL])
+    cluedo.solve(mode=Cluedo.Backbone)
+    assert [label for label, _ in cluedo.turns] == ['my hand', 'Julie cannot refute', 'Laura refutes']
+
+    removed = cluedo.undo(2)
+    assert [label for label, _ in removed] == ['Julie cannot refute', 'Laura refutes']
+    assert cluedo.players == expected and len(cluedo.turns) == 1
+    cluedo.solve(mode=Cluedo.Backbone)
+    assert cluedo.players == expected
+
+    cluedo.replay(removed)
+    cluedo.edit_turn(1, lambda game: game.add_constraint('Julie', Suspect.MR_GREEN, False))
+    assert cluedo.turns[1] == ('Julie cannot refute', [('eq', 2, (CARD_INDEX[Suspect.MR_GREEN],), 0)])
+    cluedo.solve(mode=Cluedo.Backbone)
+    rebuilt = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)])
+    rebuilt.replay(cluedo.turns)
+    rebuilt.solve(mode=Cluedo.Backbone)
+    assert cluedo.players == rebuilt.players
+
+    restored = Cluedo.from_state(cluedo.state())
+    assert restored.turns == cluedo.turns
+    restored.undo(1)
+    assert len(restored.turns) == 2
+    # the clause database a turn restores is that of a rebuild from the turns kept
+    log = [c for _, turn in restored.turns for c in turn]
+    assert restored.clause_database.constraints() == ClauseDatabase(log).constraints()
+
+
+def test_cli(tmp_path, capsys):
+    import json
+    import subprocess
+    import sys
+    from cluedo import cli
+    game = tmp_path / 'game.json'
+    game.write_text(json.dumps({'players': [['Will', 6], ['Julie', 6], ['Laura', 6]],
+                                'turns': [['Julie', Cluedo.AllFalse, 'MR_GREEN', 'ROPE', 'HALL']]}))
+    turns = tmp_path / 'turns.jsonl'
+    turns.write_text(json.dumps(['Laura', Cluedo.SomeTrue, 'MR_GREEN', 'ROPE', 'HALL']) + '\n')
+    assert cli.main([str(game), '--turns', str(turns), '--mode', Cluedo.Count, '--json']) == 0
+    result = json.loads(capsys.readouterr().out)
+    assert result['complete'] and 'MR_GREEN' in result['players']['Julie']['not_held']
+    assert 0 < result['players']['Laura']['probabilities']['MR_GREEN'] < 1
+
+    # the solver and the view import none of the heavy libraries until they are used
+    code = "import sys, cluedo.view; print(sorted({'ortools', 'numpy', 'ipywidgets', 'tabulate', 'IPython', " \
+           "'multiprocessing'} & set(sys.modules)))"
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    output = subprocess.run([sys.executable, '-c', code], cwd=root, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == '[]'
+
+
+def test_batch():
+    from cluedo import batch
+    game = {'id': 'g', 'players_spec': [['Will', 6], ['Julie', 6], ['Laura', 6]],
+            'turns': [['Will', Cluedo.SomeTrue, 'KITCHEN'], ['Julie', Cluedo.AllFalse, 'MR_GREEN', 'ROPE', 'HALL'],
+                      ['Laura', Cluedo.SomeTrue, 'MR_GREEN', 'ROPE', 'HALL']]}
+    every = list(batch.analyze([game]))
+    assert [result['turn'] for result in every] == [1, 2, 3]
+    assert 'KITCHEN' in every[0]['players']['Will']['held']
+    final = list(batch.analyze([game, dict(game, id='h'), {'id': 'bad'}], at=batch.FinalTurn, num_workers=2))
+    assert sorted(str(result.get('turn')) for result in final) == ['3', '3', 'None']
+    assert next(result for result in final if result['id'] == 'g')['players'] == every[-1]['players']
+    assert 'error' in next(result for result in final if result['id'] == 'bad')
+    assert [result['turn'] for result in batch.analyze([dict(game, solve_at=[0, 2])])] == [0, 2]
+
+
+def test_simulation():
+    from cluedo import game, batch
+    holders = game.deal(1000, [6, 6, 6], np.random.default_rng(0))
+    assert (np.sort(holders, axis=1)[:, :3] == 0).all() and ((holders == 3).sum(axis=1) == 6).all()
+    for card_type in CARD_TYPES:
+        assert ((holders[:, CARD_SLICES[card_type]] == 0).sum(axis=1) == 1).all()
+
+    simulation = game.Simulation(3, refutation=game.first_refutation, seed=1)
+    report = simulation.run(2)
+    assert report['solved'] == 2 and report['turns_to_solve']['max'] >= report['turns_to_solve']['mean'] > 0
+    log = report['results'][0]['log']
+    final = list(batch.analyze([log], at=batch.FinalTurn))[0]
+    assert len([card for card in final['players']['Murderer']['held']]) == 3
+
+
+def test_master_detective_deck():
+    from cluedo import benchmark, game
+    from cluedo.deck import MASTER_DETECTIVE, MasterDetectiveSuspect, MasterDetectiveRoom
+    assert MASTER_DETECTIVE.num_cards == 30 and MASTER_DETECTIVE.hand_sizes(10) == [3] * 7 + [2] * 3
+    with pytest.raises(ValueError):
+        Cluedo(CLASSIC.players_spec(6) + [('P6', 0)])
+
+    simulation = game.Simulation(10, seed=0, deck=MASTER_DETECTIVE)
+    holders = simulation.deal(1)[0]
+    cluedo = Cluedo(simulation.players_spec, deck='master_detective')
+    for card, holder in zip(MASTER_DETECTIVE.cards, holders):
+        if holder == 1:
+            cluedo.add_observation('P0', Cluedo.SomeTrue, [card.value])
+    cluedo.add_observation('P1', Cluedo.SomeTrue, [MasterDetectiveSuspect.SERGEANT_GRAY, MasterDetectiveRoom.GAZEBO])
+    assert cluedo.solve(mode=Cluedo.Backbone).complete
+    assert set(cluedo.player('P1')[MasterDetectiveSuspect]) == {card.value for card in MasterDetectiveSuspect}
+    assert Cluedo.from_state(cluedo.state()).deck is MASTER_DETECTIVE
+
+    results = benchmark.run_suite(player_counts=(10,), phases=('near_solved',), modes=(Cluedo.Count,),
+                                  isolate=False, decks=('master_detective',))
+    assert results[0]['name'] == 'master_detective/10p/near_solved/count/0' and results[0]['complete']
+    assert results[0]['solutions'] > 0
+    assert benchmark.scaling(results) == {('master_detective', 30, Cluedo.Count): {10: results[0]['wall_time']}}
+
+
+def test_recommend_suggestions():
+    from cluedo.recommend import SuggestionRanker
+    # the Murderer holds the only card of the last two categories, and the first category is a coin flip
+    # between the Murderer and the first responder: asking about either card reveals exactly one bit
+    ranker = SuggestionRanker([[0, 2, 0, 0], [2, 0, 0, 0]], [2, 1, 1])
+    assert ranker.candidates.tolist() == [[0, 2, 3], [1, 2, 3]]
+    assert np.allclose(ranker.gains([2, 3]), [1.0, 1.0]) and np.allclose(ranker.gains([3]), [0.0, 0.0])
+    probabilities, choice_entropy = ranker.outcomes([2, 3])
+    assert np.allclose(probabilities.sum(axis=1), 1.0) and np.allclose(probabilities[0, [0, -1]], [0.5, 0.5])
+
+    cluedo = small_game()
+    ranked = cluedo.recommend('Will', seed=0)
+    assert len(ranked) == 6 * 6 * 9 and cluedo.recommend('Will', top=5, seed=0) == ranked[:5]
+    assert all(first[1] >= second[1] for first, second in zip(ranked, ranked[1:]))
+    # nobody can refute a suggestion of the suggester's own cards
+    assert dict(ranked)[Suspect.MISS_SCARLET, Weapon.CANDLESTICK, Room.KITCHEN] == 0.0
+    assert ranked[0][1] > 0.5
+
+
+def test_recommend_time_limit():
+    # too many deals to count in time: the one deadline is shared by counting, finding a witness and
+    # drawing the deals from the Markov chain
+    from cluedo.deck import MASTER_DETECTIVE
+    cluedo = Cluedo(MASTER_DETECTIVE.players_spec(10), deck=MASTER_DETECTIVE)
+    suggester = cluedo.player_names[1]
+    cluedo.recommend(suggester, top=1, time_limit=0.2, seed=0)
+    start = time.time()
+    ranked = cluedo.recommend(suggester, top=3, time_limit=0.5, seed=0)
+    assert len(ranked) == 3 and time.time() - start < 2.0
+
+
+def test_murderer_distribution():
+    cluedo = small_game()
+    cluedo.add_or_constraint('Laura', [Suspect.MR_GREEN, Weapon.ROPE])
+    distribution = cluedo.murderer_distribution()
+    assert len(distribution) == 6 * 6 * 9 and cluedo.murderer_distribution(top=3) == distribution[:3]
+    assert all(first[1] >= second[1] for first, second in zip(distribution, distribution[1:]))
+    total = cluedo.solve(mode=Cluedo.Count).solutions
+    assert sum(count for _, count, _ in distribution) == total
+    # the distribution adds up to the Murderer's card probabilities
+    for card_type in CARD_TYPES:
+        for card, probability in cluedo.probabilities()[card_type].items():
+            assert np.isclose(sum(p for cards, _, p in distribution if card_type(card) in cards), probability)
+    cluedo.add_constraint('Laura', Suspect.MR_GREEN)
+    assert sum(count for _, count, _ in cluedo.murderer_distribution()) == cluedo.solve(mode=Cluedo.Count).solutions
+
+    # with no constraint, every card is interchangeable with the rest of its category
+    distribution = Cluedo([('A', 6), ('B', 6), ('C', 6)]).murderer_distribution()
+    assert len({count for _, count, _ in distribution}) == 1 and np.isclose(distribution[0][2], 1 / 324)
+
+
+def test_sample_mode():
+    cluedo = small_game()
+    exact = cluedo.solve(mode=Cluedo.Count) and cluedo.marginals
+    stats = cluedo.solve(mode=Cluedo.Sample, num_samples=4000)
+    assert stats.solutions == 4000 and not stats.complete and stats.status == 'FEASIBLE'
+    assert np.abs(cluedo.marginals - exact).max() < 0.06 and cluedo.intervals.max() < 0.1
+    low, high = cluedo.confidence_intervals('Laura')[Suspect][Suspect.MR_GREEN.value]
+    assert low <= cluedo.probabilities('Laura')[Suspect][Suspect.MR_GREEN.value] <= high
+    assert cluedo.player('Will')[Suspect][Suspect.MISS_SCARLET.value] == {1}
+
+    # the memory is fixed, and the time limit bounds the latency of the most open boards
+    from cluedo.deck import MASTER_DETECTIVE
+    cluedo = Cluedo(MASTER_DETECTIVE.players_spec(10), deck=MASTER_DETECTIVE)
+    start = time.perf_counter()
+    stats = cluedo.solve(mode=Cluedo.Sample, time_limit=0.5)
+    assert time.perf_counter() - start < 2.0 and stats.solutions > 0
+    assert np.allclose(cluedo.marginals.sum(axis=0), 1.0)
+
+
+def test_add_turn_and_clause_database():
+    cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)])
+    turn = cluedo.add_turn('Will', [Suspect.MR_GREEN, Weapon.ROPE, Room.HALL], ['Julie'], 'Laura')
+    assert turn == 0 and cluedo.turns[0][0] == 'Will: MR_GREEN, ROPE, HALL'
+    assert cluedo.clause_database.num_clauses == 1 and cluedo.clause_database.num_units == 3
+
+    # the clause is dropped once Laura is known to hold one of its cards...
+    cluedo.add_turn('Julie', [Suspect.PROF_PLUM, Weapon.ROPE, Room.LOUNGE], [], 'Laura', Weapon.ROPE)
+    assert cluedo.clause_database.num_clauses == 0
+    # ...and a clause loses the cards held by somebody else, down to a single card
+    cluedo.add_turn('Laura', [Suspect.MR_GREEN, Weapon.ROPE, Room.KITCHEN], ['Will'], 'Julie')
+    assert ('eq', 2, (CARD_INDEX[Room.KITCHEN],), 1) in cluedo.clause_database.constraints()
+    assert cluedo.clause_database.num_added == len([c for _, turn in cluedo.turns for c in turn])
+    with pytest.raises(ValueError):
+        cluedo.add_turn('Will', [Suspect.MR_GREEN, Weapon.ROPE, Room.HALL], ['Julie'], 'Julie')
+    with pytest.raises(ValueError):
+        cluedo.add_turn('Will', [Suspect.MR_GREEN, Weapon.ROPE, Room.HALL], [], 'Julie', Weapon.WRENCH)
+
+    # the model stays as small as what is still unknown, and gives the same results as the full log
+    cluedo.solve(mode=Cluedo.Count)
+    counter = DealCounter([3, 6, 6, 6], [len(card_type) for card_type in CARD_TYPES],
+                          [c for _, turn in cluedo.turns for c in turn])
+    assert np.allclose(cluedo.marginals, counter.probabilities())
+    assert len(cluedo.model.Proto().constraints) < 21 + 4 * 4 + 13
+
+    cluedo.undo()
+    assert cluedo.clause_database.num_clauses == 0 and cluedo.clause_database.num_units == 4
+    # (the database restored by undo is the checkpoint's own copy, not shared with the turns kept)
+    cluedo.undo()
+    assert cluedo.clause_database.num_clauses == 1 and cluedo.clause_database.num_added == 4
+    cluedo.add_turn('Julie', [Suspect.PROF_PLUM, Weapon.ROPE, Room.LOUNGE], [], 'Laura', Weapon.ROPE)
+    cluedo.undo()
+    assert cluedo.clause_database.num_clauses == 1 and cluedo.clause_database.num_added == 4
+    assert not ClauseDatabase([('eq', 1, (0,), 1), ('eq', 2, (0,), 0), ('or', 1, (0, 1), 1)]).constraints()[1:]
+    assert ClauseDatabase([('eq', 1, (0,), 1), ('eq', 2, (0,), 1)]).contradictory
+
+
+def test_session_snapshot_and_restore(tmp_path):
+    from cluedo import session
+    from cluedo.view import View
+    cluedo = small_game()
+    cluedo.solve(mode=Cluedo.Backbone)
+    before = cluedo.players
+    cluedo.add_turn('Julie', [Suspect.MR_GREEN, Weapon.ROPE, Room.LOUNGE], [], 'Laura')
+    cluedo.solve(mode=Cluedo.Count)
+    view = View(cluedo, [['Laura', Cluedo.SomeTrue, 'MR_GREEN', 'ROPE', 'LOUNGE']])
+    path = tmp_path / 'game.json.gz'
+    view.save(path)
+    assert path.stat().st_size < 4096
+
+    restored = View.load(path)
+    assert restored.history == view.history
+    game = restored.cluedo
+    assert game.players == cluedo.players and game.probabilities('Laura') == cluedo.probabilities('Laura')
+    # the restored results are reused until the board changes
+    stats = game.solve(mode=Cluedo.Count)
+    assert stats.cached and stats.solutions == cluedo.stats.solutions and game.solver is None
+    game.undo()
+    assert game.players == before
+    assert game.solve(mode=Cluedo.Backbone).cached
+
+    with pytest.raises(ValueError):
+        session.restore(dict(session.snapshot(cluedo), version=session.Version + 1))
+
+
+def test_service():
+    import asyncio
+    from cluedo import service
+
+    async def scenario():
+        games = service.GameService(num_workers=1, max_queue=2)
+        server = await service.serve(games, port=0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def call(method, path, body=None):
+            return await service.request('127.0.0.1', port, method, path, body)
+
+        async with server:
+            status, created = await call('POST', '/games', {'players': [['Will', 6], ['Julie', 6], ['Laura', 6]]})
+            assert status == 201
+            game = f"/games/{created['id']}"
+            assert (await call('POST', game + '/turns', {'row': ['Will', Cluedo.SomeTrue, 'KITCHEN']}))[0] == 201
+            status, turn = await call('POST', game + '/turns', {'suggester': 'Will', 'suggestion': ['MR_GREEN', 'ROPE', 'HALL'],
+                                                                'passers': ['Julie'], 'refuter': 'Laura'})
+            assert status == 201 and turn == {'turn': 1}
+            assert (await call('POST', game + '/turns', {'row': ['Nobody', Cluedo.SomeTrue, 'HALL']}))[0] == 400
+            assert (await call('GET', '/games/missing'))[0] == 404
+
+            # concurrent queries of the same board share one solve
+            answers = await asyncio.gather(*[call('GET', game + '/deductions?time_limit=30') for _ in range(3)])
+            assert [status for status, _ in answers] == [200] * 3
+            assert 'KITCHEN' in answers[0][1]['players']['Will']['held'] and answers[0][1]['complete']
+            status, metrics = await call('GET', '/metrics')
+            assert metrics['solves'] == 1 and metrics['coalesced'] + metrics['reused'] == 2
+            assert metrics['endpoints']['GET /games/<id>/deductions']['requests'] == 3
+
+            status, result = await call('GET', game + '/probabilities?mode=count')
+            assert status == 200 and abs(sum(result['probabilities']['Murderer'].values()) - 3) < 1e-9
+
+            # a full queue turns new solves away
+            others = [(await call('POST', '/games', {'players': [['A', 9], ['B', 9]]}))[1]['id'] for _ in range(3)]
+            answers = await asyncio.gather(*[call('GET', f'/games/{other}/deductions?time_limit=30') for other in others])
+            assert sorted(status for status, _ in answers) == [200, 200, 503]
+
+            status, snapshot = await call('GET', game + '/session')
+            status, restored = await call('POST', '/games', {'session': snapshot})
+            assert (await call('GET', f"/games/{restored['id']}"))[1]['turns'] == 2
+
+    asyncio.run(scenario())
+
+
+def test_count_does_not_import_cp_sat():
+    import os
+    import subprocess
+    import sys
+    script = ("import sys\n"
+              "from cluedo.solver import Cluedo\n"
+              "cluedo = Cluedo([('Will', 6), ('Julie', 6), ('Laura', 6)])\n"
+              "cluedo.add_observation('Laura', Cluedo.SomeTrue, ['MR_GREEN', 'ROPE', 'HALL'])\n"
+              "stats = cluedo.solve(mode=Cluedo.Count)\n"
+              "assert stats.complete and stats.num_model_constraints is None\n"
+              "assert 'ortools.sat.python.cp_model' not in sys.modules\n")
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    subprocess.run([sys.executable, '-c', script], check=True, env=dict(os.environ, PYTHONPATH=root))
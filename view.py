@@ -1,15 +1,83 @@
 from cluedo.solver import *
-import ipywidgets as widgets
-from tabulate import tabulate
-from IPython.display import HTML, display, display_html
+from cluedo import session
+from cluedo.anytime import AnytimeSolve
+from cluedo.lazy import LazyModule
 
-tabulate.PRESERVE_WHITESPACE = True
+# the UI libraries are imported on first use, so that the rendering helpers can be used headless
+widgets = LazyModule('ipywidgets')
+tabulate = LazyModule('tabulate', on_import=lambda module: setattr(module, 'PRESERVE_WHITESPACE', True))
+
+
+class CardTable(object):
+    """
+    A table widget of the cards of one type against the players, which is updated in place: each
+    cell is a widget of its own, and a render only sends the cells whose content changed since the
+    previous render. The grid itself is only rebuilt when the players change.
+    """
+
+    def __init__(self, card_type, layout=None):
+        self.__card_type = card_type
+        self.__card_values = [card.value for card in card_type]
+        self.__player_names = None
+        self.__cells = {}  # (card, player name) -> cell widget
+        self.__widget = widgets.GridBox([], layout=layout or widgets.Layout())
+
+    @property
+    def widget(self):
+        return self.__widget
+
+    def __build(self, player_names):
+        self.__player_names = player_names
+        self.__cells = {(card, player_name): widgets.HTML(value='')
+                        for card in self.__card_values for player_name in player_names}
+        children = [widgets.HTML(value='')] + [widgets.HTML(value=f'<b>{name}</b>') for name in player_names]
+        for card in self.__card_values:
+            children.append(widgets.HTML(value=card))
+            children.extend(self.__cells[card, player_name] for player_name in player_names)
+        self.__widget.children = children
+        self.__widget.layout.grid_template_columns = f'auto repeat({len(player_names)}, max-content)'
+
+    def update(self, player_assignments, probabilities=None):
+        """
+        Render <player_assignments>, only touching the cells that changed.
+        @return: the number of cells updated.
+        """
+        player_names, cells = View.table_cells(self.__card_type, player_assignments, probabilities)
+        if player_names != self.__player_names:
+            self.__build(player_names)
+        updated = 0
+        for key, value in cells.items():
+            cell = self.__cells[key]
+            if cell.value != value:
+                cell.value = value
+                updated += 1
+        return updated
+
+    def clear(self):
+        for cell in self.__cells.values():
+            cell.value = ''
 
 
 class View(object):
-    def __init__(self, cluedo):
+    def __init__(self, cluedo, history=None):
+        """
+        @param: history The turn history of <cluedo>, e.g. as restored by View.load().
+        """
         self.__cluedo = cluedo
-        self.__history = []
+        self.__history = [] if history is None else list(history)
+
+    def save(self, path):
+        """
+        Save the game, its results and the turn history to the session file <path> (see cluedo.session).
+        """
+        session.save(path, self.__cluedo, self.__history)
+
+    @staticmethod
+    def load(path, cache=None):
+        """
+        @return: a View of the game restored from the session file <path>, without solving it again.
+        """
+        return View(*session.load(path, cache))
 
     @property
     def cluedo(self):
@@ -19,83 +87,68 @@ class View(object):
     def history(self):
         return self.__history
 
-    def display_suspects(self, player_assignments):
-        suspects = [s.value for s in Suspect]
-        player_names = []
-        rows = []
-        for suspect in suspects:
-            row = [suspect]
-            for player_name, player in player_assignments.items():
-                player_names.append(player_name)
-                value = player[Suspect][suspect]
-                if value == {0}:
-                    row.append("<font color='red'>&#10007</font>")
-                elif value == {1}:
-                    row.append("<font color='green'>&#10003</font>")
-                else:
-                    row.append("<font color='lightgray'>&ndash;</font>")
-            rows.append(row)
-
-        header_row = ['']
-        header_row = header_row + player_names
-        table = [header_row] + rows
-        return tabulate(table,
-                        tablefmt='html',
-                        headers='firstrow',
-                        stralign='right'
-                        )
-
-    def display_weapons(self, player_assignments):
-        weapons = [w.value for w in list(Weapon)]
-        player_names = []
-        rows = []
-        for weapon in weapons:
-            row = [weapon]
-            for player_name, player in player_assignments.items():
-                player_names.append(player_name)
-                value = player[Weapon][weapon]
-                if value == {0}:
-                    row.append("<font color='red'>&#10007</font>")
-                elif value == {1}:
-                    row.append("<font color='green'>&#10003</font>")
-                else:
-                    row.append("<font color='lightgray'>&ndash;</font>")
-            rows.append(row)
-
-        header_row = ['']
-        header_row = header_row + player_names
-        table = [header_row] + rows
-        return tabulate(table,
-                        tablefmt='html',
-                        headers='firstrow',
-                        stralign='right'
-                        )
-
-    def display_rooms(self, player_assignments):
-        rooms = [r.value for r in list(Room)]
-        player_names = []
-        rows = []
-        for room in rooms:
-            row = [room]
-            for player_name, player in player_assignments.items():
-                player_names.append(player_name)
-                value = player[Room][room]
-                if value == {0}:
-                    row.append("<font color='red'>&#10007</font>")
-                elif value == {1}:
-                    row.append("<font color='green'>&#10003</font>")
-                else:
-                    row.append("<font color='lightgray'>&ndash;</font>")
-            rows.append(row)
-
-        header_row = ['']
-        header_row = header_row + player_names
-        table = [header_row] + rows
-        return tabulate(table,
-                        tablefmt='html',
-                        headers='firstrow',
-                        stralign='right'
-                        )
+    @staticmethod
+    def display_cell(value, probability=None):
+        """
+        Render a single table cell: a tick or a cross when the card's owner is known, and either a
+        dash or, if given, the probability of ownership otherwise.
+        """
+        if value == {0}:
+            return "<font color='red'>&#10007</font>"
+        elif value == {1}:
+            return "<font color='green'>&#10003</font>"
+        elif probability is not None:
+            return f"<font color='gray'>{round(100 * probability)}%</font>"
+        else:
+            return "<font color='lightgray'>&ndash;</font>"
+
+    @staticmethod
+    def display_stats(stats):
+        """
+        Render a one-line summary of a SolveStats.
+        """
+        solutions = 'deals' if stats.mode == Cluedo.Count else 'solutions'
+        limit = ', time limit hit' if stats.time_limit_hit else ''
+        cached = ', cached' if stats.cached else ''
+        return f"<p><font color='gray'>{stats.solutions} {solutions} in {stats.wall_time:.2f}s " \
+               f"({stats.branches} branches, {stats.conflicts} conflicts{limit}{cached})</font></p>"
+
+    @staticmethod
+    def table_cells(card_type, player_assignments, probabilities=None):
+        """
+        The rendering pipeline shared by the static tables and the table widgets: the rendered
+        cells of the table of one card type.
+        @param: player_assignments The packed solutions of every player, as returned by Cluedo.players.
+        @param: probabilities The ownership probabilities of every player, by player name, or None.
+        @return: a (player names, {(card, player name): cell}) tuple.
+        """
+        cells = {}
+        for player_name, player in player_assignments.items():
+            for card in card_type:
+                card = card.value
+                probability = probabilities[player_name][card_type][card] if probabilities else None
+                cells[card, player_name] = View.display_cell(player[card_type][card], probability)
+        return list(player_assignments), cells
+
+    def display_table(self, card_type, player_assignments, probabilities=None):
+        player_names, cells = self.table_cells(card_type, player_assignments, probabilities)
+        header_row = [''] + player_names
+        rows = [[card.value] + [cells[card.value, player_name] for player_name in player_names]
+                for card in card_type]
+        return tabulate.tabulate([header_row] + rows,
+                                 tablefmt='html',
+                                 headers='firstrow',
+                                 stralign='right'
+                                 )
+
+    def display_suspects(self, player_assignments, probabilities=None):
+        return self.display_table(self.__cluedo.deck.card_types[0], player_assignments, probabilities)
+
+    def display_weapons(self, player_assignments, probabilities=None):
+        return self.display_table(self.__cluedo.deck.card_types[1], player_assignments, probabilities)
+
+    def display_rooms(self, player_assignments, probabilities=None):
+        return self.display_table(self.__cluedo.deck.card_types[2], player_assignments, probabilities)
 
     def input(self):
         player_names = self.__cluedo.player_names
@@ -108,32 +161,20 @@ class View(object):
         )
 
         booleans = widgets.Select(
-            options=['', 'SOME_TRUE', 'ALL_FALSE'],
+            options=['', Cluedo.SomeTrue, Cluedo.AllFalse],
             description='',
             disabled=False,
             layout=widgets.Layout(width='150px', height='100px')
         )
 
-        suspects = widgets.Select(
-            options=['', *[s.value for s in Suspect]],
-            description='',
-            disabled=False,
-            layout=widgets.Layout(width='150px', height='170px')
-        )
-
-        weapons = widgets.Select(
-            options=['', *[w.value for w in Weapon]],
-            description='',
-            disabled=False,
-            layout=widgets.Layout(width='150px', height='170px')
-        )
-
-        rooms = widgets.Select(
-            options=['', *[r.value for r in Room]],
+        deck = self.__cluedo.deck
+        # one card selector per category of the deck
+        selectors = [widgets.Select(
+            options=['', *[card.value for card in card_type]],
             description='',
             disabled=False,
             layout=widgets.Layout(width='150px', height='170px')
-        )
+        ) for card_type in deck.card_types]
 
         add = widgets.Button(
             description='Add',
@@ -149,26 +190,8 @@ class View(object):
             tooltip='Run',
         )
 
-        suspects_display = widgets.HTML(
-            value="",
-            placeholder='',
-            description='',
-            layout=widgets.Layout(width='30%', height='250')
-        )
-
-        weapons_display = widgets.HTML(
-            value="",
-            placeholder='',
-            description='',
-            layout=widgets.Layout(width='30%', height='250px')
-        )
-
-        rooms_display = widgets.HTML(
-            value="",
-            placeholder='',
-            description='',
-            layout=widgets.Layout(width='30%', height='250px')
-        )
+        tables = [CardTable(card_type, layout=widgets.Layout(width='30%', height='250px'))
+                  for card_type in deck.card_types]
 
         hist_display = widgets.HTML(
             value="",
@@ -189,73 +212,124 @@ class View(object):
             readout_format='.1f',
         )
 
-        def on_run_button_clicked(b):
-            suspects_display.value = ""
-            weapons_display.value = ""
-            rooms_display.value = ""
-            num_solutions = self.__cluedo.solve(time_limit=time_limit.value)
-            # print(f"- possible solutions: {num_solutions}")
-            # print(f"- solver time : {round(self.__cluedo.solver.WallTime(), 2)} seconds")
-            player_assignments = self.__cluedo.players
-            suspects_display.value = str(HTML(self.display_suspects(player_assignments)).data)
-            weapons_display.value = self.display_weapons(player_assignments)
-            rooms_display.value = self.display_rooms(player_assignments)
-            # display_html(HTML(suspects_display.value))
+        status_display = widgets.HTML(
+            value="",
+            placeholder='',
+            description=''
+        )
 
-        def on_add_button_clicked(b):
+        show_probabilities = widgets.Checkbox(
+            value=False,
+            description='Show probabilities',
+            disabled=False
+        )
 
-            constraints = []
-            if suspects.value:
-                constraints.append(Suspect(suspects.value))
-            if weapons.value:
-                constraints.append(Weapon(weapons.value))
-            if rooms.value:
-                constraints.append(Room(rooms.value))
+        undo = widgets.Button(
+            description='Undo',
+            disabled=False,
+            button_style='',
+            tooltip='Remove the last turn',
+        )
 
-            if not players.value or not booleans.value or len(constraints) == 0:
+        cancel = widgets.Button(
+            description='Cancel',
+            disabled=True,
+            button_style='warning',
+            tooltip='Stop the solver, keeping what it has proven so far',
+        )
+
+        def show_tables(player_assignments, probabilities=None):
+            for table in tables:
+                table.update(player_assignments, probabilities)
+
+        def on_done(stats):
+            run.disabled, add.disabled, undo.disabled, cancel.disabled = False, False, False, True
+            if stats is None:
+                status_display.value = f"<p><font color='red'>The solver failed: {solve.error}</font></p>"
+                return
+            if self.__cluedo.infeasible:
+                status_display.value = "<p><font color='red'>No deal is consistent with the turns entered: " \
+                                       "check the turn history.</font></p>"
                 return
+            status_display.value = ""
+            probabilities = None
+            if stats.mode == Cluedo.Count:
+                if self.__cluedo.marginals is not None:
+                    probabilities = {name: self.__cluedo.probabilities(name) for name in self.__cluedo.player_names}
+                else:
+                    status_display.value = "<p>Counting the deals did not finish in time: " \
+                                           "showing the known cards only.</p>"
+            status_display.value += self.display_stats(stats)
+            show_tables(self.__cluedo.players, probabilities)
 
-            self.__history.append([players.value, booleans.value] + [c.value for c in constraints])
+        solve = AnytimeSolve(self.__cluedo, on_progress=show_tables, on_done=on_done)
+
+        def on_run_button_clicked(b):
+            status_display.value = "<p><font color='gray'>Solving...</font></p>"
+            run.disabled, add.disabled, undo.disabled, cancel.disabled = True, True, True, False
+            mode = Cluedo.Count if show_probabilities.value else Cluedo.Backbone
+            solve.start(time_limit=time_limit.value, mode=mode)
+
+        def on_cancel_button_clicked(b):
+            solve.cancel()
+
+        def show_history():
             value = ''
             for counter, row in enumerate(self.__history):
                 value += f"<p><b>Turn {counter+1}:</b> {row}</p>"
             hist_display.value = value
 
-            if booleans.value == 'SOME_TRUE':
-                if len(constraints) == 1:
-                    self.__cluedo.add_constraint(players.value, constraints[0])
-                else:
-                    self.__cluedo.add_or_constraint(players.value, constraints)
-            elif booleans.value == 'ALL_FALSE':
-                if suspects.value:
-                    self.__cluedo.add_constraint(players.value, Suspect(suspects.value), False)
-                if weapons.value:
-                    self.__cluedo.add_constraint(players.value, Weapon(weapons.value), False)
-                if rooms.value:
-                    self.__cluedo.add_constraint(players.value, Room(rooms.value), False)
+        def on_undo_button_clicked(b):
+            if not self.__history:
+                return
+            self.__cluedo.undo()
+            self.__history.pop()
+            show_history()
+            if self.__cluedo.complete:
+                show_tables(self.__cluedo.players)
+
+        def on_add_button_clicked(b):
+
+            constraints = [card_type(selector.value) for card_type, selector in zip(deck.card_types, selectors)
+                           if selector.value]
+
+            if not players.value or not booleans.value or len(constraints) == 0:
+                return
+
+            self.__history.append([players.value, booleans.value] + [c.value for c in constraints])
+            show_history()
+
+            self.__cluedo.begin_turn(str(self.__history[-1]))
+            self.__cluedo.add_observation(players.value, booleans.value, constraints)
 
             players.value = ''
             booleans.value = ''
-            suspects.value = ''
-            weapons.value = ''
-            rooms.value = ''
+            for selector in selectors:
+                selector.value = ''
 
         add.on_click(on_add_button_clicked)
         run.on_click(on_run_button_clicked)
+        cancel.on_click(on_cancel_button_clicked)
+        undo.on_click(on_undo_button_clicked)
+
+        # (a restored game shows its history and results straight away)
+        show_history()
+        if self.__cluedo.complete:
+            show_tables(self.__cluedo.players)
 
         return widgets.VBox(
             [widgets.HBox([widgets.VBox([widgets.Label('Players'), players]),
                            widgets.VBox([widgets.Label('Boolean Logic'), booleans]),
-                           widgets.VBox([widgets.Label('Max Solver Time'), time_limit])
+                           widgets.VBox([widgets.Label('Max Solver Time'), time_limit, show_probabilities])
                            ],
                           ),
-             widgets.HBox([widgets.VBox([widgets.Label('Suspects'), suspects]),
-                           widgets.VBox([widgets.Label('Weapons'), weapons]),
-                           widgets.VBox([widgets.Label('Rooms'), rooms])
+             widgets.HBox([widgets.VBox([widgets.Label(category_name), selector])
+                           for category_name, selector in zip(deck.category_names, selectors)
                            ],
                           ),
-             widgets.HBox([add, run]),
-             widgets.HBox([suspects_display, weapons_display, rooms_display],
+             widgets.HBox([add, undo, run, cancel]),
+             status_display,
+             widgets.HBox([table.widget for table in tables],
                           layout=widgets.Layout(width='100%', height='300px')
                           ),
              widgets.VBox([widgets.Label('Turn History'), hist_display])